@@ -0,0 +1,212 @@
+# analytics.py
+#
+# Ventas y embudo de la tienda. Los handlers registran eventos (vista de
+# categoría, añadido al carrito, vista del carrito, compra y unidades
+# vendidas por producto) con record(), que solo añade una tupla a un búfer
+# en memoria. Un volcador los escribe por lotes en la tabla events cada
+# ANALYTICS_FLUSH_INTERVAL segundos (antes si el búfer llega a
+# ANALYTICS_BATCH_SIZE) y cada ANALYTICS_ROLLUP_INTERVAL segundos se
+# agregan de forma incremental en stats_hourly y stats_daily (en hora
+# local del servidor). /stats lee solo los agregados y el último día de
+# cada usuario de los últimos 30 días (stats_users, para contar usuarios
+# distintos por ventana), así que su coste no depende de la historia
+# acumulada.
+#
+# Los eventos ya agregados se borran pasados ANALYTICS_RETENTION_DAYS. Si
+# el búfer supera ANALYTICS_BUFFER_MAX (base de datos caída) se descartan
+# eventos nuevos antes que frenar a los compradores.
+
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+import repository
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("ANALYTICS_ENABLED", "1").strip().lower() not in (
+    "0", "false", "no", "off")
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "2"))
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "500"))
+ANALYTICS_BUFFER_MAX = int(os.getenv("ANALYTICS_BUFFER_MAX", "100000"))
+ANALYTICS_ROLLUP_INTERVAL = float(os.getenv("ANALYTICS_ROLLUP_INTERVAL", "60"))
+ANALYTICS_RETENTION_DAYS = float(os.getenv("ANALYTICS_RETENTION_DAYS", "30"))
+
+# Eventos agregados por transacción (cada una bloquea las escrituras de los
+# demás unas decenas de milisegundos)
+_ROLLUP_BATCH = 5000
+_DAY = 86400
+# Ventana más larga de /stats: hasta dónde se recuerda el último día de
+# cada usuario
+_WINDOW_DAYS = 30
+
+# Tipos de evento
+CATEGORY = 'category'
+ADD = 'add'
+CART = 'cart'
+CHECKOUT = 'checkout'
+# Una fila por producto de cada compra (item = product_id)
+SOLD = 'sold'
+
+stats = {'recorded': 0, 'written': 0, 'dropped': 0, 'rolled_up': 0}
+
+_buffer = []
+_wakeup = None
+_flusher = None
+_roller = None
+
+
+def set_enabled(enabled: bool):
+    """Activa o desactiva el registro de eventos."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def record(kind: str, user_id: int, item='', qty: int = 0,
+           amount_cup: float = 0):
+    """Registra un evento; no toca la base de datos."""
+    if not ENABLED:
+        return
+    if len(_buffer) >= ANALYTICS_BUFFER_MAX:
+        stats['dropped'] += 1
+        return
+    _buffer.append((time.time(), kind, user_id, item, qty, amount_cup))
+    stats['recorded'] += 1
+    if len(_buffer) == ANALYTICS_BATCH_SIZE and _wakeup is not None:
+        _wakeup.set()
+
+
+def record_checkout(user_id: int, lines: list):
+    """Una compra y sus unidades por producto ([(id, nombre, precio_cup,
+    cantidad), ...])."""
+    total = 0
+    units = 0
+    for product_id, _, price, qty in lines:
+        record(SOLD, user_id, str(product_id), qty, price * qty)
+        total += price * qty
+        units += qty
+    record(CHECKOUT, user_id, '', units, total)
+
+
+def utc_offset(now: float) -> int:
+    """Segundos de la hora local respecto a UTC en el instante `now`."""
+    return time.localtime(now).tm_gmtoff
+
+
+def day_start(now: float, days_ago: int = 0) -> int:
+    """Inicio (hora local) del día de `now` menos `days_ago` días."""
+    offset = utc_offset(now)
+    return int((now + offset) // _DAY) * _DAY - offset - days_ago * _DAY
+
+
+async def flush():
+    """Escribe los eventos del búfer."""
+    global _buffer
+    if not _buffer:
+        return
+    batch, _buffer = _buffer, []
+    try:
+        await repository.append_events(batch)
+    except Exception:
+        # Se reintentan en el siguiente volcado (sin pasar del máximo)
+        _buffer[:0] = batch[:max(0, ANALYTICS_BUFFER_MAX - len(_buffer))]
+        raise
+    stats['written'] += len(batch)
+
+
+async def rollup() -> int:
+    """Agrega todos los eventos escritos pendientes; devuelve cuántos."""
+    total = 0
+    while True:
+        now = time.time()
+        count = await repository.rollup_events(
+            _ROLLUP_BATCH, utc_offset(now),
+            now - ANALYTICS_RETENTION_DAYS * _DAY, day_start(now, 1),
+            day_start(now, _WINDOW_DAYS - 1))
+        total += count
+        if count < _ROLLUP_BATCH:
+            break
+    stats['rolled_up'] += total
+    return total
+
+
+async def summary(top: int = 5) -> dict:
+    """Lo que muestra /stats, leído solo de los agregados."""
+    now = time.time()
+    offset = utc_offset(now)
+    hour = int((now + offset) // 3600) * 3600 - offset
+    return {
+        'today': await repository.stats_totals(day_start(now)),
+        'week': await repository.stats_totals(day_start(now, 6)),
+        'month': await repository.stats_totals(
+            day_start(now, _WINDOW_DAYS - 1)),
+        'top': await repository.stats_top_items(SOLD, day_start(now, 6),
+                                                top),
+        'hour': await repository.stats_hour(hour),
+    }
+
+
+async def _flush_loop():
+    while True:
+        # Como en notifications.py: wait_for podría tragarse la cancelación
+        # de stop_analytics()
+        wakeup = asyncio.ensure_future(_wakeup.wait())
+        try:
+            await asyncio.wait((wakeup,), timeout=ANALYTICS_FLUSH_INTERVAL)
+        finally:
+            wakeup.cancel()
+        _wakeup.clear()
+        try:
+            await flush()
+        except Exception:
+            logger.exception("No se pudieron guardar %s eventos",
+                             len(_buffer))
+
+
+async def _rollup_loop():
+    while True:
+        await asyncio.sleep(ANALYTICS_ROLLUP_INTERVAL)
+        try:
+            await rollup()
+        except Exception:
+            logger.exception("No se pudieron agregar los eventos")
+
+
+def start_analytics():
+    """Arranca el volcado y la agregación (requiere un event loop activo)."""
+    global _wakeup, _flusher, _roller
+    if _flusher is None:
+        _wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        _flusher = loop.create_task(_flush_loop())
+        _roller = loop.create_task(_rollup_loop())
+        metrics.register_counter('bot_events_recorded_total',
+                                 'Eventos de la tienda registrados',
+                                 lambda: stats['recorded'])
+        metrics.register_counter('bot_events_dropped_total',
+                                 'Eventos descartados con el búfer lleno',
+                                 lambda: stats['dropped'])
+        metrics.register_gauge('bot_events_buffered',
+                               'Eventos en memoria sin guardar',
+                               lambda: len(_buffer))
+
+
+async def stop_analytics():
+    """Guarda y agrega los eventos pendientes y detiene las tareas."""
+    global _wakeup, _flusher, _roller
+    if _flusher is None:
+        return
+    for task in (_flusher, _roller):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _wakeup = _flusher = _roller = None
+    try:
+        await flush()
+        await rollup()
+    except Exception:
+        logger.exception("No se pudieron guardar los eventos al apagar")
@@ -0,0 +1,173 @@
+# benchmarks/analytics_bench.py
+#
+# Coste del registro de eventos (analytics.py):
+#
+#   1. Sobrecarga por actualización: coste de record() y de la escritura
+#      por lotes de cada evento, por los eventos que genera cada
+#      actualización de la prueba de carga (load_test.py, handlers reales).
+#      Además, pasadas alternas con el registro activado y desactivado para
+#      ver el tiempo de CPU por actualización de extremo a extremo (con más
+#      ruido).
+#   2. Agregación: --history eventos sintéticos repartidos en 30 días y
+#      cuánto tarda rollup() en plegarlos.
+#   3. /stats: latencia de analytics.summary() con poca y con mucha
+#      historia, frente a calcular lo mismo recorriendo la tabla events.
+#
+# Uso: python -m benchmarks.analytics_bench [--users N] [--steps S]
+#        [--rounds R] [--history EVENTOS]
+
+import argparse
+import asyncio
+import random
+import shutil
+import time
+
+from benchmarks import load_test
+from benchmarks.load_test import DEFAULT_MIX, LoadTest
+
+import analytics
+import bot
+import repository
+from database import get_db
+
+DAY = 86400
+
+
+async def overhead(test: LoadTest, rounds: int) -> dict:
+    """CPU por actualización con y sin registro, en pasadas alternas."""
+    cpu = {True: 0.0, False: 0.0}
+    updates = {True: 0, False: 0}
+    first_user = 10_000_000
+    for _ in range(rounds):
+        for enabled in (False, True):
+            analytics.set_enabled(enabled)
+            start = time.process_time()
+            latencies, _ = await test.run_pass(first_user)
+            await analytics.flush()
+            cpu[enabled] += time.process_time() - start
+            updates[enabled] += sum(len(v) for v in latencies.values())
+            first_user += 1_000_000
+    analytics.set_enabled(True)
+    return {enabled: cpu[enabled] / updates[enabled] for enabled in cpu}
+
+
+async def unit_costs(count: int = 50_000) -> tuple:
+    """Segundos por evento de record() y de la escritura por lotes."""
+    analytics.set_enabled(True)
+    await analytics.flush()
+    start = time.perf_counter()
+    for i in range(count):
+        analytics.record(analytics.ADD, i, '1', 1, 100.0)
+    record = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    await analytics.flush()
+    write = (time.perf_counter() - start) / count
+    return record, write
+
+
+def synthetic_events(count: int, now: float, seed: int = 1):
+    rng = random.Random(seed)
+    kinds = [analytics.CATEGORY] * 4 + [analytics.ADD] * 3 + [
+        analytics.CART] * 2 + [analytics.CHECKOUT]
+    start = now - 30 * DAY
+    step = 30 * DAY / count
+    for i in range(count):
+        kind = rng.choice(kinds)
+        yield (start + i * step, kind, rng.randrange(50_000),
+               '' if kind in (analytics.CART, analytics.CHECKOUT)
+               else str(rng.randrange(1, 14)), 1, 100.0)
+
+
+async def load_history(count: int):
+    now = time.time()
+    batch = []
+    for event in synthetic_events(count, now):
+        batch.append(event)
+        if len(batch) == 50_000:
+            await repository.append_events(batch)
+            batch = []
+    if batch:
+        await repository.append_events(batch)
+
+
+def scan_events(since: float) -> list:
+    """Lo mismo que los totales de /stats, recorriendo los eventos."""
+    return get_db().execute(
+        "SELECT kind, COUNT(*), SUM(qty), SUM(amount_cup), "
+        "COUNT(DISTINCT user_id) FROM events WHERE ts >= ? GROUP BY kind",
+        (since,)).fetchall()
+
+
+async def timed(func, repeat: int = 20) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await func()
+    return (time.perf_counter() - start) / repeat
+
+
+async def run(args):
+    test = LoadTest(args.users, args.steps, DEFAULT_MIX, bot.UPDATE_WORKERS,
+                    0.0, 42)
+    await test.application.initialize()
+    await bot.post_init(test.application)
+    try:
+        await test.run_pass(first_user=1_000_000)
+        recorded = analytics.stats['recorded']
+        latencies, _ = await test.run_pass(first_user=2_000_000)
+        per_update = ((analytics.stats['recorded'] - recorded)
+                      / sum(len(v) for v in latencies.values()))
+        await analytics.flush()
+        cpu = await overhead(test, args.rounds)
+        record_cost, write_cost = await unit_costs()
+        await analytics.rollup()
+        small = await timed(analytics.summary)
+
+        await load_history(args.history)
+        start = time.perf_counter()
+        folded = await analytics.rollup()
+        rollup_seconds = time.perf_counter() - start
+        large = await timed(analytics.summary)
+        since = time.time() - 30 * DAY
+        scan = await timed(lambda: repository.run_db(scan_events, since), 3)
+    finally:
+        await bot.post_stop(test.application)
+        await test.application.shutdown()
+        await bot.post_shutdown(test.application)
+
+    extra = (cpu[True] - cpu[False]) * 1e6
+    cost = per_update * (record_cost + write_cost) * 1e6
+    print(f"users: {args.users}  steps: {args.steps}  rounds: {args.rounds}")
+    print(f"events/update: {per_update:.2f}  record(): "
+          f"{record_cost * 1e9:.0f} ns/event  batched write: "
+          f"{write_cost * 1e6:.2f} µs/event")
+    print(f"overhead: {cost:.2f} µs/update "
+          f"({cost / (cpu[False] * 1e6):.2%} of {cpu[False] * 1e6:.0f} µs "
+          f"CPU/update)")
+    print(f"A/B CPU/update: {cpu[False] * 1e6:.1f} µs without events, "
+          f"{cpu[True] * 1e6:.1f} µs with events ({extra:+.1f} µs)")
+    print(f"events written: {analytics.stats['written']:,}  "
+          f"dropped: {analytics.stats['dropped']}")
+    print(f"rollup: {folded:,} events in {rollup_seconds:.2f} s "
+          f"({folded / rollup_seconds:,.0f} events/s)")
+    print(f"/stats from rollups: {small * 1e3:.2f} ms with little history, "
+          f"{large * 1e3:.2f} ms with {args.history:,} more events")
+    print(f"same totals scanning events: {scan * 1e3:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=3,
+                        help="pasadas con y sin registro")
+    parser.add_argument('--history', type=int, default=1_000_000,
+                        help="eventos sintéticos para la agregación")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    finally:
+        shutil.rmtree(load_test._tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+# benchmarks/broadcast_bench.py
+#
+# Difusión a muchos usuarios con un Bot falso: crea N usuarios en una base
+# de datos temporal (una parte ha bloqueado el bot), lanza una difusión,
+# simula un apagado a mitad de camino, arranca de nuevo el motor y espera a
+# que termine. Mientras tanto hay compradores usando el bot en el mismo
+# proceso y se compara su latencia con la que tienen sin difusión.
+#
+# Comprueba que cada usuario activo recibió el anuncio (y cuántos lo
+# recibieron dos veces por la reanudación), que los bloqueados quedaron
+# marcados y que la siguiente difusión ya no los cuenta.
+#
+# Uso: python -m benchmarks.broadcast_bench [--users N] [--blocked 0.03]
+#        [--rate MSG_S] [--concurrency C] [--latency SEGUNDOS]
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import tempfile
+import time
+
+# La base de datos de pruebas debe configurarse antes de importar bot.py
+_tmpdir = tempfile.mkdtemp(prefix="bot-bench-")
+_src_db = os.path.join(os.path.dirname(__file__), '..', 'products',
+                       'database.db')
+os.environ["DB_PATH"] = os.path.join(_tmpdir, 'database.db')
+os.environ["ERROR_LOG_FILE"] = os.path.join(_tmpdir, 'errors.log')
+shutil.copy(_src_db, os.environ["DB_PATH"])
+# Compradores sintéticos a la velocidad de la máquina: sin antirrebote ni límite
+os.environ["TAP_DEBOUNCE_WINDOW"] = "0"
+os.environ["TAP_BURST"] = os.environ["TAP_RATE"] = "1e9"
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import bot  # noqa: E402
+import broadcasts  # noqa: E402
+import callbacks  # noqa: E402
+import repository  # noqa: E402
+from products.catalog import get_catalog  # noqa: E402
+from benchmarks.fake_telegram import (  # noqa: E402
+    FAKE_TOKEN, FakeTelegramRequest, callback_update)
+
+ADMIN_ID = bot.ADMIN_IDS[0]
+FIRST_USER = 100_000_000
+FIRST_SHOPPER = 900_000_000
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def create_users(count: int):
+    conn = sqlite3.connect(os.environ["DB_PATH"])
+    with conn:
+        conn.executemany("INSERT INTO users (user_id, currency) VALUES (?, ?)",
+                         ((FIRST_USER + i, 'CUP') for i in range(count)))
+    conn.close()
+
+
+async def shoppers(application, stop: asyncio.Event, workers: int) -> list:
+    """Compradores tocando botones hasta que `stop`; devuelve latencias."""
+    catalog = get_catalog()
+    categories = list(catalog.by_category)
+    product_ids = list(catalog.by_id)
+    latencies = []
+    update_ids = iter(range(1, 1 << 62))
+
+    async def shopper(user_id: int):
+        rng = random.Random(user_id)
+        while not stop.is_set():
+            data = rng.choice([
+                callbacks.encode('category', rng.choice(categories)),
+                callbacks.encode('add', rng.choice(product_ids),
+                                 catalog.revision),
+                'cart'])
+            update = Update.de_json(
+                callback_update(next(update_ids), user_id, data),
+                application.bot)
+            t = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - t)
+            # Un comprador real tarda en pulsar el siguiente botón
+            await asyncio.sleep(rng.uniform(0.01, 0.05))
+
+    await asyncio.gather(*(shopper(FIRST_SHOPPER + i)
+                           for i in range(workers)))
+    return latencies
+
+
+async def wait_status(status: str, timeout: float = 3600) -> tuple:
+    deadline = time.monotonic() + timeout
+    while True:
+        row = await broadcasts.latest()
+        if row[2] == status:
+            return row
+        if time.monotonic() > deadline:
+            raise SystemExit(f"❌ La difusión no llegó a '{status}': {row}")
+        await asyncio.sleep(0.2)
+
+
+async def run(args):
+    blocked = set(FIRST_USER + i for i in random.Random(1).sample(
+        range(args.users), int(args.users * args.blocked)))
+    request = FakeTelegramRequest(args.latency, blocked_chats=blocked)
+    application = (Application.builder().token(FAKE_TOKEN).request(request)
+                   .updater(None).build())
+    bot.register_handlers(application)
+    await application.initialize()
+    await bot.post_init(application)
+    create_users(args.users)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    try:
+        # Latencia de los compradores sin difusión
+        stop = asyncio.Event()
+        task = asyncio.ensure_future(shoppers(application, stop,
+                                              args.shoppers))
+        await asyncio.sleep(3)
+        stop.set()
+        quiet = await task
+
+        stop = asyncio.Event()
+        task = asyncio.ensure_future(shoppers(application, stop,
+                                              args.shoppers))
+        start = time.perf_counter()
+        broadcast_id, total = await broadcasts.create("📣 Nuevo producto",
+                                                      ADMIN_ID)
+
+        # Apagado a mitad de la difusión y nuevo arranque del motor
+        while sum(request.delivered.values()) < args.users * 0.4:
+            await asyncio.sleep(0.05)
+        await broadcasts.stop_engine()
+        interrupted = (await broadcasts.latest())[3] - FIRST_USER + 1
+        broadcasts.start_engine(application.bot)
+
+        row = await wait_status('done')
+        elapsed = time.perf_counter() - start
+        stop.set()
+        busy = await task
+        remaining = await repository.count_users()
+    finally:
+        await bot.post_stop(application)
+        await application.shutdown()
+        await bot.post_shutdown(application)
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    recipients = [FIRST_USER + i for i in range(args.users)]
+    missing = sum(1 for user_id in recipients
+                  if user_id not in blocked and not request.delivered[user_id])
+    duplicates = sum(1 for user_id in recipients
+                     if request.delivered[user_id] > 1)
+    _, _, status, _, _, sent, failed, marked, _, _, _ = row
+
+    print(f"users: {args.users}  blocked: {len(blocked)}  rate: {args.rate:.0f}"
+          f" msg/s  concurrency: {args.concurrency}  api latency: "
+          f"{args.latency * 1e3:.0f} ms")
+    print(f"broadcast #{broadcast_id}: {status}  recipients: {total}  "
+          f"interrupted at user #{interrupted}")
+    print(f"sent: {sent}  blocked: {marked}  failed: {failed}  "
+          f"in {elapsed:.1f} s ({(sent + marked + failed) / elapsed:,.0f} "
+          f"recipients/s)")
+    print(f"missing: {missing}  delivered twice: {duplicates}")
+    print(f"next broadcast recipients: {remaining}")
+    print(f"peak RSS growth: {(rss_after - rss_before) / 1024:,.1f} MiB")
+    print(f"shopper latency without broadcast: p50 "
+          f"{percentile(quiet, .5) * 1e3:.2f} ms, p99 "
+          f"{percentile(quiet, .99) * 1e3:.2f} ms ({len(quiet)} taps)")
+    print(f"shopper latency during broadcast:  p50 "
+          f"{percentile(busy, .5) * 1e3:.2f} ms, p99 "
+          f"{percentile(busy, .99) * 1e3:.2f} ms ({len(busy)} taps)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--blocked', type=float, default=0.03,
+                        help="fracción de usuarios que bloquearon el bot")
+    parser.add_argument('--rate', type=float, default=2000,
+                        help="BROADCAST_RATE (mensajes por segundo)")
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="latencia simulada de la Bot API en segundos")
+    parser.add_argument('--shoppers', type=int, default=20)
+    args = parser.parse_args()
+
+    broadcasts.BROADCAST_RATE = args.rate
+    broadcasts.BROADCAST_CONCURRENCY = args.concurrency
+    try:
+        asyncio.run(run(args))
+    finally:
+        shutil.rmtree(_tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# benchmarks/fake_telegram.py
+#
+# Implementación de BaseRequest que responde como la Bot API sin salir a la
+# red. Sirve para ejecutar la Application real con un Bot "de mentira".
+
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+
+_BOT_USER = {"id": 123456, "is_bot": True, "first_name": "FakeBot",
+             "username": "fake_bot"}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Cuenta las llamadas por método y opcionalmente simula latencia.
+
+    Con `strict_edits`, como la Bot API real, responde 400 "message is not
+    modified" a un editMessageText idéntico al contenido actual del mensaje.
+    Los chats de `blocked_chats` responden 403 a sendMessage (usuario que
+    bloqueó el bot); `delivered` cuenta los sendMessage entregados por chat.
+    """
+
+    def __init__(self, latency: float = 0.0, strict_edits: bool = False,
+                 blocked_chats=()):
+        self.latency = latency
+        self.calls = Counter()
+        self.delivered = Counter()
+        self.strict_edits = strict_edits
+        self.blocked_chats = set(blocked_chats)
+        # (chat_id, message_id) -> (texto, teclado)
+        self.contents = {}
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None,
+                         read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = _BOT_USER
+        elif endpoint == 'sendMessage':
+            chat_id = int(params.get('chat_id'))
+            if chat_id in self.blocked_chats:
+                return 403, json.dumps({
+                    "ok": False, "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user"
+                }).encode()
+            self.delivered[chat_id] += 1
+            result = {"message_id": next(self._message_ids),
+                      "date": int(time.time()),
+                      "chat": {"id": params.get('chat_id'), "type": "private"},
+                      "text": params.get('text')}
+        elif endpoint == 'getUpdates':
+            result = []
+        elif endpoint == 'editMessageText' and self.strict_edits:
+            key = (params.get('chat_id'), params.get('message_id'))
+            content = (params.get('text'), str(params.get('reply_markup')))
+            if self.contents.get(key) == content:
+                return 400, json.dumps({
+                    "ok": False, "error_code": 400,
+                    "description": "Bad Request: message is not modified: "
+                                   "specified new message content and reply "
+                                   "markup are exactly the same as a current "
+                                   "content and reply markup of the message"
+                }).encode()
+            self.contents[key] = content
+            result = True
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    """Actualización JSON de un tap en un botón inline."""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {"message_id": 1, "date": 0, "text": "menu",
+                        "chat": {"id": user_id, "type": "private"}},
+        },
+    }
+
+
+def command_update(update_id: int, user_id: int, text: str) -> dict:
+    """Actualización JSON de un mensaje con un comando."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "entities": [{"type": "bot_command", "offset": 0,
+                          "length": len(text.split()[0])}],
+        },
+    }
@@ -0,0 +1,307 @@
+# benchmarks/load_test.py
+#
+# Prueba de carga de los handlers reales de bot.py: simula muchos
+# compradores concurrentes que envían actualizaciones sintéticas (comandos y
+# taps) a una Application con un Bot falso (sin red) y mide rendimiento,
+# percentiles de latencia por ruta, sentencias SQL y llamadas a la Bot API
+# por actualización y asignaciones de memoria.
+#
+# Los resultados pueden guardarse como línea base (JSON versionado en
+# benchmarks/baselines/) y compararse en ejecuciones posteriores para que
+# las regresiones se vean en la revisión.
+#
+# Como en el bot real, solo `--workers` actualizaciones se procesan a la vez
+# (UPDATE_WORKERS); la latencia es la de cada handler una vez que tiene
+# turno.
+#
+# Uso: python -m benchmarks.load_test [--users N] [--steps S] [--workers W]
+#        [--mix start=1,category=3,...] [--latency SEGUNDOS]
+#        [--metrics on|off] [--save-baseline] [--compare] [--tolerance 0.25]
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+# La base de datos de pruebas debe configurarse antes de importar bot.py
+_tmpdir = tempfile.mkdtemp(prefix="bot-bench-")
+_src_db = os.path.join(os.path.dirname(__file__), '..', 'products',
+                       'database.db')
+os.environ["DB_PATH"] = os.path.join(_tmpdir, 'database.db')
+shutil.copy(_src_db, os.environ["DB_PATH"])
+# Las sesiones y los eventos se vuelcan al final de cada pasada (no según
+# el reloj) para que el número de sentencias SQL sea reproducible
+os.environ["SESSION_FLUSH_INTERVAL"] = "3600"
+os.environ["ANALYTICS_FLUSH_INTERVAL"] = "3600"
+os.environ["ANALYTICS_ROLLUP_INTERVAL"] = "3600"
+# Los compradores sintéticos tocan a la velocidad de la máquina: tap_guard
+# sigue en el camino (se mide su coste) pero sin antirrebote ni límite
+os.environ["TAP_DEBOUNCE_WINDOW"] = "0"
+os.environ["TAP_BURST"] = os.environ["TAP_RATE"] = "1e9"
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import analytics  # noqa: E402
+import bot  # noqa: E402
+import callbacks  # noqa: E402
+import database  # noqa: E402
+import metrics  # noqa: E402
+import orders  # noqa: E402
+from sessions import session_cache  # noqa: E402
+from products.catalog import get_catalog  # noqa: E402
+from products.exchange_rates import get_rates  # noqa: E402
+from benchmarks.fake_telegram import (  # noqa: E402
+    FAKE_TOKEN, FakeTelegramRequest, callback_update, command_update)
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baselines',
+                             'load_test.json')
+
+# Reparto por defecto de acciones de cada comprador
+DEFAULT_MIX = {'start': 1, 'category': 4, 'add': 3, 'cart': 2,
+               'currency': 1, 'checkout': 1}
+
+# Métricas comparadas con la línea base: (clave, mayor es mejor)
+COMPARED = [('throughput', True), ('p50_ms', False), ('p99_ms', False),
+            ('sql_per_update', False), ('api_calls_per_update', False),
+            ('alloc_bytes_per_update', False)]
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise SystemExit(f"Acción desconocida en --mix: {name!r}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def shopper_script(rng: random.Random, steps: int, mix: dict) -> list:
+    """Secuencia de (ruta, payload) de un comprador."""
+    catalog = get_catalog()
+    categories = list(catalog.by_category)
+    product_ids = list(catalog.by_id)
+    currencies = list(get_rates().currencies)
+    actions, weights = zip(*mix.items())
+
+    script = [('start', ('command', '/start'))]
+    for action in rng.choices(actions, weights, k=steps - 1):
+        if action == 'start':
+            payload = ('callback', 'start')
+        elif action == 'category':
+            payload = ('callback', f'category:{rng.choice(categories)}')
+        elif action == 'add':
+            payload = ('callback', callbacks.encode(
+                'add', rng.choice(product_ids), catalog.revision))
+        elif action == 'cart':
+            payload = ('callback', 'cart')
+        elif action == 'currency':
+            payload = ('callback', f'set_currency:{rng.choice(currencies)}')
+        else:
+            payload = ('callback', 'checkout')
+        script.append((action, payload))
+    return script
+
+
+class LoadTest:
+    def __init__(self, users: int, steps: int, mix: dict, workers: int,
+                 latency: float, seed: int):
+        self.users = users
+        self.steps = steps
+        self.workers = workers
+        self.mix = mix
+        self.seed = seed
+        self.request = FakeTelegramRequest(latency)
+        self.application = (Application.builder().token(FAKE_TOKEN)
+                            .request(metrics.InstrumentedRequest(self.request))
+                            .updater(None).build())
+        bot.register_handlers(self.application)
+        self._update_ids = iter(range(1, 1 << 62))
+
+    def _update(self, user_id: int, payload: tuple) -> Update:
+        kind, data = payload
+        update_id = next(self._update_ids)
+        if kind == 'command':
+            raw = command_update(update_id, user_id, data)
+        else:
+            raw = callback_update(update_id, user_id, data)
+        return Update.de_json(raw, self.application.bot)
+
+    async def _shopper(self, user_id: int, script: list, latencies: dict,
+                       slots: asyncio.Semaphore):
+        for route, payload in script:
+            update = self._update(user_id, payload)
+            async with slots:
+                t = time.perf_counter()
+                await self.application.process_update(update)
+                latencies[route].append(time.perf_counter() - t)
+
+    async def run_pass(self, first_user: int) -> tuple:
+        """Ejecuta todos los compradores a la vez y guarda pedidos y sesiones.
+
+        Devuelve (latencias, segundos).
+        """
+        rng = random.Random(self.seed)
+        scripts = [shopper_script(rng, self.steps, self.mix)
+                   for _ in range(self.users)]
+        latencies = defaultdict(list)
+        slots = asyncio.Semaphore(self.workers)
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            self._shopper(first_user + i, script, latencies, slots)
+            for i, script in enumerate(scripts)))
+        await orders.wait_idle()
+        await session_cache.flush()
+        await analytics.flush()
+        return latencies, time.perf_counter() - start
+
+    async def run(self) -> dict:
+        await self.application.initialize()
+        await bot.post_init(self.application)
+        try:
+            # Calentamiento: carga sesiones, cachés de render y sentencias
+            await self.run_pass(first_user=1_000_000)
+
+            database.count_statements(True)
+            statements = database.stats['statements']
+            self.request.calls.clear()
+            latencies, elapsed = await self.run_pass(first_user=2_000_000)
+            statements = database.stats['statements'] - statements
+            database.count_statements(False)
+            api_calls = sum(self.request.calls.values())
+
+            # Las asignaciones se miden en una pasada aparte porque
+            # tracemalloc ralentiza mucho la ejecución
+            tracemalloc.start()
+            await self.run_pass(first_user=3_000_000)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            await bot.post_stop(self.application)
+            await self.application.shutdown()
+            await bot.post_shutdown(self.application)
+
+        updates = sum(len(values) for values in latencies.values())
+        everything = [v for values in latencies.values() for v in values]
+        return {
+            'users': self.users,
+            'steps': self.steps,
+            'workers': self.workers,
+            'mix': self.mix,
+            'updates': updates,
+            'throughput': updates / elapsed,
+            'p50_ms': percentile(everything, .5) * 1e3,
+            'p95_ms': percentile(everything, .95) * 1e3,
+            'p99_ms': percentile(everything, .99) * 1e3,
+            'sql_per_update': statements / updates,
+            'api_calls_per_update': api_calls / updates,
+            'alloc_bytes_per_update': current / updates,
+            'alloc_peak_kib': peak / 1024,
+            'routes': {
+                route: {'count': len(values),
+                        'p50_ms': percentile(values, .5) * 1e3,
+                        'p99_ms': percentile(values, .99) * 1e3}
+                for route, values in sorted(latencies.items())
+            },
+        }
+
+
+def report(result: dict):
+    print(f"users: {result['users']}  steps: {result['steps']}  "
+          f"workers: {result['workers']}  updates: {result['updates']}")
+    print(f"throughput: {result['throughput']:,.0f} updates/s")
+    print(f"latency: p50 {result['p50_ms']:.2f} ms, p95 "
+          f"{result['p95_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms")
+    for route, stats in result['routes'].items():
+        print(f"  {route:10} {stats['count']:7}  p50 {stats['p50_ms']:.2f} ms"
+              f"  p99 {stats['p99_ms']:.2f} ms")
+    print(f"SQL statements/update: {result['sql_per_update']:.2f}")
+    print(f"Bot API calls/update: {result['api_calls_per_update']:.2f}")
+    print(f"memory retained/update: {result['alloc_bytes_per_update']:,.0f} B"
+          f"  (peak {result['alloc_peak_kib']:,.0f} KiB)")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Imprime la diferencia con la línea base y devuelve las regresiones."""
+    regressions = []
+    print(f"\ncomparación con la línea base ({baseline['recorded_at']}):")
+    for key in ('users', 'steps', 'workers', 'mix'):
+        if baseline['result'][key] != result[key]:
+            print(f"  ⚠️ la línea base usa otro {key}: {baseline['result'][key]}")
+    for key, higher_is_better in COMPARED:
+        old, new = baseline['result'][key], result[key]
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > tolerance:
+            flag = '  ⚠️ regresión'
+            regressions.append(key)
+        print(f"  {key:24} {old:12,.2f} → {new:12,.2f}  ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=10,
+                        help="actualizaciones por comprador")
+    parser.add_argument('--workers', type=int, default=bot.UPDATE_WORKERS,
+                        help="actualizaciones procesadas a la vez")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="pesos por acción, p. ej. category=4,add=3")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="latencia simulada de la Bot API en segundos")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--metrics', choices=('on', 'off'), default='on',
+                        help="instrumentación de metrics.py")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true',
+                        help="comparar con la línea base; sale con código 1 "
+                             "si hay regresiones")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    metrics.set_enabled(args.metrics == 'on')
+    try:
+        result = asyncio.run(LoadTest(args.users, args.steps, args.mix,
+                                      args.workers, args.latency,
+                                      args.seed).run())
+    finally:
+        shutil.rmtree(_tmpdir, ignore_errors=True)
+    report(result)
+
+    if args.compare and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.tolerance):
+            raise SystemExit(1)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'recorded_at': time.strftime('%Y-%m-%d %H:%M'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'result': result,
+            }, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f"\n✅ Línea base guardada en {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+# benchmarks/scaling_bench.py
+#
+# Escalado horizontal: para cada número de workers levanta N procesos
+# benchmarks/shard_worker.py (Telegram falso) detrás de un proceso
+# shard_router.py, todos contra el mismo almacén de estado, envía una ráfaga
+# de taps al router por HTTP y mide las actualizaciones procesadas por
+# segundo de extremo a extremo.
+#
+# Con --backend redis y sin --redis-url se arranca un servidor falso
+# (fakeredis.TcpFakeServer) en otro proceso.
+#
+# Uso: python -m benchmarks.scaling_bench [--workers-list 1,2,4]
+#        [--updates N] [--users U] [--concurrency C] [--latency SEGUNDOS]
+#        [--update-workers W] [--backend sqlite|redis] [--redis-url URL]
+
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.fake_telegram import callback_update
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SOURCE_DB = os.path.join(ROOT, 'products', 'database.db')
+
+FAKE_REDIS = """
+import sys
+from fakeredis import TcpFakeServer
+TcpFakeServer(('127.0.0.1', int(sys.argv[1]))).serve_forever()
+"""
+
+
+def taps(revision: int) -> list:
+    return ['category:streaming', f'add:1:{revision}', 'cart',
+            'category:music', f'add:7:{revision}', 'set_currency:USDT',
+            'cart', 'start']
+
+
+def catalog_revision(db_path: str) -> int:
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT value FROM meta WHERE key = 'catalog_revision'").fetchone()
+    finally:
+        conn.close()
+    return int(row[0]) if row else 0
+
+
+async def wait_ready(session, urls: list, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    for url in urls:
+        while True:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        break
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit(f"❌ {url} no arrancó a tiempo")
+            await asyncio.sleep(0.1)
+
+
+async def processed(session, worker_ports: list) -> int:
+    total = 0
+    for port in worker_ports:
+        async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+            for line in (await resp.text()).splitlines():
+                if line.startswith('bot_updates_processed '):
+                    total += int(float(line.split()[1]))
+    return total
+
+
+async def flood(router_port: int, worker_ports: list, make_payloads,
+                concurrency: int) -> tuple:
+    """Envía `make_payloads()` al router y espera a que los workers los
+    procesen. Devuelve (actualizaciones, segundos).
+    """
+    url = f"http://127.0.0.1:{router_port}/telegram"
+    async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0)) as session:
+        await wait_ready(session, [f"http://127.0.0.1:{port}/"
+                                   for port in [router_port] + worker_ports])
+        # Las cargas se construyen cuando los workers ya migraron la base de
+        # datos (los botones "add" llevan la revisión del catálogo)
+        payloads = make_payloads()
+        before = await processed(session, worker_ports)
+        pending = iter(payloads)
+
+        async def sender():
+            for payload in pending:
+                async with session.post(url, json=payload) as resp:
+                    assert resp.status == 200, resp.status
+
+        start = time.perf_counter()
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+        while await processed(session, worker_ports) - before < len(payloads):
+            await asyncio.sleep(0.02)
+        return len(payloads), time.perf_counter() - start
+
+
+def run_once(shards: int, args, env: dict, first_user: int) -> float:
+    """Actualizaciones por segundo con `shards` workers."""
+    worker_ports = [args.base_port + 1 + i for i in range(shards)]
+    workers = [subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.shard_worker', '--port', str(port),
+         '--workers', str(args.update_workers),
+         '--latency', str(args.latency)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+        for port in worker_ports]
+    router_env = dict(env, PORT=str(args.base_port), SHARD_WORKERS=','.join(
+        f"http://127.0.0.1:{port}/telegram" for port in worker_ports))
+    router = subprocess.Popen([sys.executable, 'shard_router.py'], cwd=ROOT,
+                              env=router_env, stdout=subprocess.DEVNULL)
+
+    def make_payloads():
+        sequence = taps(catalog_revision(env['DB_PATH']))
+        return [callback_update(i + 1, first_user + i % args.users,
+                                sequence[i % len(sequence)])
+                for i in range(args.updates)]
+
+    try:
+        updates, elapsed = asyncio.run(flood(
+            args.base_port, worker_ports, make_payloads, args.concurrency))
+        return updates / elapsed
+    finally:
+        for process in [router] + workers:
+            process.terminate()
+        for process in [router] + workers:
+            process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers-list', default='1,2,4',
+                        help="números de procesos a medir")
+    parser.add_argument('--updates', type=int, default=4000)
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="latencia simulada de la Bot API en segundos")
+    parser.add_argument('--update-workers', type=int, default=16,
+                        help="UPDATE_WORKERS de cada proceso")
+    parser.add_argument('--backend', choices=('sqlite', 'redis'),
+                        default='sqlite')
+    parser.add_argument('--redis-url')
+    parser.add_argument('--base-port', type=int, default=8200)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bot-bench-")
+    db_path = os.path.join(tmpdir, 'database.db')
+    shutil.copy(SOURCE_DB, db_path)
+    env = dict(os.environ, DB_PATH=db_path, STATE_BACKEND=args.backend,
+               ERROR_LOG_FILE=os.path.join(tmpdir, 'errors.log'),
+               # Taps a la velocidad de la máquina: sin antirrebote ni límite
+               TAP_DEBOUNCE_WINDOW='0', TAP_BURST='1e9', TAP_RATE='1e9')
+    fake_redis = None
+    if args.backend == 'redis':
+        if args.redis_url is None:
+            redis_port = args.base_port + 100
+            fake_redis = subprocess.Popen(
+                [sys.executable, '-c', FAKE_REDIS, str(redis_port)])
+            args.redis_url = f"redis://127.0.0.1:{redis_port}/0"
+        env['REDIS_URL'] = args.redis_url
+        env['REDIS_PREFIX'] = f"bench-{os.getpid()}:"
+
+    print(f"updates: {args.updates}  users: {args.users}  concurrency: "
+          f"{args.concurrency}  backend: {args.backend}  api latency: "
+          f"{args.latency * 1e3:.0f} ms  UPDATE_WORKERS: "
+          f"{args.update_workers}  cpus: {os.cpu_count()}")
+    try:
+        baseline = None
+        for run, shards in enumerate(
+                int(n) for n in args.workers_list.split(',')):
+            throughput = run_once(shards, args, env, (run + 1) * 1_000_000)
+            baseline = baseline or throughput
+            print(f"workers: {shards}  {throughput:8,.0f} updates/s  "
+                  f"(x{throughput / baseline:.2f})")
+    finally:
+        if fake_redis is not None:
+            fake_redis.terminate()
+            fake_redis.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
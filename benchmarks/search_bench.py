@@ -0,0 +1,123 @@
+# benchmarks/search_bench.py
+#
+# Mide la latencia de la búsqueda FTS5 (repository._search_products) sobre
+# un catálogo sintético grande y comprueba que un nombre exacto sale primero
+# entre miles de coincidencias y que los triggers mantienen el índice al día
+# tras una sincronización.
+#
+# Uso: python -m benchmarks.search_bench [--products N] [--queries Q]
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+# La base de datos de pruebas debe configurarse antes de importar el proyecto
+_tmpdir = tempfile.mkdtemp(prefix="bot-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmpdir, 'database.db')
+
+from database import get_db  # noqa: E402
+from products.categories import CATEGORIES  # noqa: E402
+from products.load_products import create_tables, sync_products  # noqa: E402
+import repository  # noqa: E402
+
+BRANDS = ['Netflix', 'Spotify', 'Disney', 'HBO', 'Prime', 'YouTube', 'Apple',
+          'Crunchyroll', 'Deezer', 'Tidal', 'Canva', 'Office', 'Steam',
+          'Xbox', 'PlayStation', 'Nintendo', 'Duolingo', 'NordVPN']
+WORDS = ['cuenta', 'perfil', 'premium', 'familiar', 'anual', 'mensual',
+         'pantalla', 'música', 'películas', 'series', 'juegos', 'ultra',
+         'básico', 'estándar', 'entrega', 'inmediata', 'correo', 'código',
+         'suscripción', 'compartida', 'privada', 'garantía', 'regalo']
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'to', 'ne', 'su', 'vi', 'de', 'po',
+             'ta', 'ri', 'ma', 'go', 'le', 'ba', 'co', 'fi', 'nu', 'se']
+QUERIES = ['netflix', 'netfl', 'spotify premium', 'cuenta anual', 'música',
+           'musica', 'pel', 'xbox código', 'garantía privada', 'zzz',
+           'disney perfil mensual', 'pr']
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def synthetic_catalog(count: int) -> list:
+    """Catálogo con vocabulario de frecuencia tipo Zipf, como el texto real:
+    pocas palabras muy comunes y muchas raras."""
+    rng = random.Random(42)
+    categories = list(CATEGORIES)
+    vocabulary = WORDS + [
+        ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        for _ in range(5000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    products = []
+    for i in range(count):
+        brand = rng.choice(BRANDS)
+        name = (f"{brand} "
+                f"{' '.join(rng.choices(vocabulary, weights, k=2))} {i}")
+        description = ' '.join(rng.choices(vocabulary, weights, k=8))
+        delivery = f"Entrega por {rng.choice(['correo', 'chat', 'código'])}"
+        products.append((name, rng.choice(categories), rng.randint(100, 9000),
+                         description, delivery, f"bench-{i}"))
+    return products
+
+
+def run(count: int, queries: int):
+    create_tables()
+    products = synthetic_catalog(count)
+    t = time.perf_counter()
+    sync_products(products)
+    print(f"carga de {count:,} productos con índice FTS: "
+          f"{time.perf_counter() - t:.2f} s")
+
+    for text in QUERIES:
+        latencies = []
+        hits = 0
+        for _ in range(queries):
+            t = time.perf_counter()
+            hits = len(repository._search_products(text, 10))
+            latencies.append(time.perf_counter() - t)
+        print(f"{text!r:26} {hits:2} resultados  "
+              f"p50 {percentile(latencies, .5) * 1e3:.2f} ms  "
+              f"p99 {percentile(latencies, .99) * 1e3:.2f} ms")
+
+    # Un producto nuevo con el nombre exacto de un término muy común sale
+    # primero aunque haya miles de coincidencias anteriores y las primeras
+    # estén retiradas
+    products.append(('Netflix', 'streaming', 1800, 'Cuenta', 'Correo',
+                     'bench-exacto'))
+    sync_products(products[2000:])
+    exact = get_db().execute(
+        "SELECT id FROM products WHERE sku = 'bench-exacto'").fetchone()[0]
+    found = repository._search_products('netflix', 10)
+    assert found[:1] == [exact], "nombre exacto no encontrado"
+    assert len(found) == 10, "coincidencias activas ocultas por las retiradas"
+    print("✅ nombre exacto primero entre miles de coincidencias")
+    del products[-1]
+    sync_products(products)
+
+    # Los triggers deben reflejar renombrados y retiradas
+    products[0] = ('Producto renombrado xyzzy',) + products[0][1:]
+    sync_products(products)
+    assert repository._search_products('xyzzy', 10), "renombrado no indexado"
+    del products[0]
+    sync_products(products)
+    assert not repository._search_products('xyzzy', 10), "retirado visible"
+    print("✅ índice sincronizado tras renombrar y retirar productos")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    try:
+        run(args.products, args.queries)
+    finally:
+        repository.shutdown()
+        shutil.rmtree(_tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# benchmarks/shard_worker.py
+#
+# Un worker del bot para benchmarks/scaling_bench.py: la Application real
+# con un Telegram falso, servida por el webhook de keep_alive en el puerto
+# indicado. La base de datos y el almacén de estado se configuran con las
+# variables de entorno de siempre (DB_PATH, STATE_BACKEND, REDIS_URL...).
+# Publica en /metrics bot_updates_processed, que el benchmark consulta para
+# saber cuándo terminó.
+#
+# Uso: python -m benchmarks.shard_worker --port P [--workers W]
+#        [--latency SEGUNDOS]
+
+import argparse
+import asyncio
+import signal
+
+from telegram.ext import Application
+
+import bot
+from keep_alive import create_app, keep_alive
+from update_processor import UserOrderedUpdateProcessor
+from benchmarks.fake_telegram import FAKE_TOKEN, FakeTelegramRequest
+
+
+async def run(port: int, workers: int, latency: float):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    application = (Application.builder().token(FAKE_TOKEN)
+                   .request(FakeTelegramRequest(latency)).updater(None)
+                   .concurrent_updates(UserOrderedUpdateProcessor(workers))
+                   .build())
+    bot.register_handlers(application)
+    await application.initialize()
+    await bot.post_init(application)
+    await application.start()
+    runner = await keep_alive(create_app(application, '/telegram'),
+                              '127.0.0.1', port)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        await bot.post_stop(application)
+        await application.shutdown()
+        await bot.post_shutdown(application)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--workers', type=int, default=bot.UPDATE_WORKERS)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.port, args.workers, args.latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# benchmarks/startup_bench.py
+#
+# Mide el arranque del bot contra una base de datos temporal: el primer
+# arranque (cold: crea el esquema y carga el catálogo) y los siguientes
+# (warm: esquema y products_data.py sin cambios). Cada arranque es un
+# proceso nuevo que importa bot.py y ejecuta bot.load_state().
+#
+# Uso: python -m benchmarks.startup_bench [--runs N]
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Se imprime el tiempo de importación y el de load_state por separado
+PROBE = """
+import time
+t = time.perf_counter()
+import bot
+t_import = time.perf_counter() - t
+t = time.perf_counter()
+bot.load_state()
+print(f"{t_import * 1e3:.2f} {(time.perf_counter() - t) * 1e3:.2f}")
+"""
+
+
+def start_once(env) -> tuple:
+    out = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    import_ms, load_ms = out.strip().splitlines()[-1].split()
+    return float(import_ms), float(load_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bot-bench-")
+    env = dict(os.environ, DB_PATH=os.path.join(tmpdir, 'database.db'))
+    try:
+        import_ms, load_ms = start_once(env)
+        print(f"cold: import bot {import_ms:.1f} ms, load_state {load_ms:.2f} ms")
+        for _ in range(args.runs):
+            import_ms, load_ms = start_once(env)
+            print(f"warm: import bot {import_ms:.1f} ms, load_state {load_ms:.2f} ms")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
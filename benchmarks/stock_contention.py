@@ -0,0 +1,242 @@
+# benchmarks/stock_contention.py
+#
+# Reserva de claves con muchos compradores a la vez: importa --keys claves
+# de dos productos, lanza --processes procesos del bot (cada uno con su
+# canal de pedidos real, orders.py) contra el mismo almacén y, en el mismo
+# instante, --buyers checkouts que piden 1..--max-qty unidades del primer
+# producto y a veces también del segundo. Hay menos claves que demanda.
+#
+# Al terminar comprueba, leyendo las claves de cada pedido guardado:
+#   - ninguna clave está en dos pedidos,
+#   - cada pedido tiene exactamente las claves que pidió de cada producto,
+#   - reservadas + libres = importadas,
+#   - ningún comprador fue rechazado mientras quedaban claves suficientes
+#     (las libres solo bajan, así que al final deben ser menos de lo que
+#     pidió), es decir, se vendió todo lo que el stock permitía.
+# Y mide reservas (pedidos guardados) y claves por segundo.
+#
+# Con --backend redis y sin --redis-url se arranca un servidor falso
+# (fakeredis.TcpFakeServer) en otro proceso.
+#
+# Uso: python -m benchmarks.stock_contention [--buyers N] [--keys K]
+#        [--max-qty Q] [--processes P] [--backend sqlite|redis]
+#        [--redis-url URL]
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SOURCE_DB = os.path.join(ROOT, 'products', 'database.db')
+
+FIRST_BUYER = 500_000_000
+ADMIN_ID = 1
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def pick_products(db_path: str) -> list:
+    """Dos productos activos: [(id, sku, nombre, precio), ...]."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT id, sku, name, price FROM products WHERE active = 1 "
+            "ORDER BY id LIMIT 2").fetchall()
+    finally:
+        conn.close()
+
+
+def cart(buyer: int, products: list, max_qty: int) -> list:
+    """Líneas del carrito de un comprador (reproducibles por su número)."""
+    rng = random.Random(buyer)
+    picked = products[:2] if rng.random() < 0.3 else products[:1]
+    return [(product_id, name, price, rng.randint(1, max_qty))
+            for product_id, _, name, price in picked]
+
+
+async def child(args):
+    import orders
+    import repository
+
+    products = pick_products(os.environ["DB_PATH"])
+    buyers = range(FIRST_BUYER + args.child, FIRST_BUYER + args.buyers,
+                   args.processes)
+    orders.start_pipeline([ADMIN_ID])
+    stocked = tuple(product[0] for product in products)
+    requests = [orders.OrderRequest(
+        buyer, f"buyer{buyer}", 'CUP', cart(buyer, products, args.max_qty),
+        0, stocked) for buyer in buyers]
+
+    async def checkout(request):
+        t = time.perf_counter()
+        order_id, sold_out = await orders.submit(
+            request._replace(created_at=time.time()))
+        return [request.user_id, order_id, sold_out,
+                time.perf_counter() - t]
+
+    # Todos los procesos empiezan a la vez
+    await asyncio.sleep(max(0.0, args.start_at - time.time()))
+    start = time.time()
+    results = await asyncio.gather(*(checkout(r) for r in requests))
+    end = time.time()
+    await orders.stop_pipeline()
+    await repository.close_store()
+    repository.shutdown()
+    print(json.dumps({'start': start, 'end': end, 'results': results}))
+
+
+async def prepare(products: list, keys: int):
+    import inventory
+    import repository
+
+    result = await inventory.import_keys(
+        (sku, f"{sku}-{i:06d}") for _, sku, _, _ in products
+        for i in range(keys))
+    await repository.close_store()
+    return result['added']
+
+
+async def verify(products: list, keys: int, max_qty: int,
+                 results: list) -> dict:
+    import repository
+
+    names = {name: product_id for product_id, _, name, _ in products}
+    owner = {}
+    reserved = Counter()
+    problems = []
+    placed = [row for row in results if row[1] is not None]
+    for buyer, order_id, _, _ in placed:
+        delivered, manual = await repository.deliver_order_keys(order_id,
+                                                               time.time())
+        got = Counter(names[name] for name, _ in delivered)
+        wanted = Counter({product_id: qty for product_id, _, _, qty
+                          in cart(buyer, products, max_qty)})
+        if got != wanted or manual:
+            problems.append(f"pedido #{order_id}: {dict(got)} en lugar de "
+                            f"{dict(wanted)}")
+        for _, code in delivered:
+            if code in owner:
+                problems.append(f"clave {code} en los pedidos "
+                                f"#{owner[code]} y #{order_id}")
+            owner[code] = order_id
+        reserved.update(got)
+
+    free = await repository.stock_counts([p[0] for p in products])
+    for product_id, _, _, _ in products:
+        if reserved[product_id] + free[product_id] != keys:
+            problems.append(f"producto {product_id}: {reserved[product_id]} "
+                            f"reservadas + {free[product_id]} libres != "
+                            f"{keys}")
+    for buyer, order_id, sold_out, _ in results:
+        if order_id is not None:
+            continue
+        qty = dict((line[0], line[3]) for line in
+                   cart(buyer, products, max_qty))[sold_out]
+        if free[sold_out] >= qty:
+            problems.append(f"comprador {buyer} rechazado con "
+                            f"{free[sold_out]} claves libres de {sold_out}")
+    await repository.close_store()
+    return {'placed': len(placed), 'keys': sum(reserved.values()),
+            'free': free, 'problems': problems}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--buyers', type=int, default=4000)
+    parser.add_argument('--keys', type=int, default=2000,
+                        help="claves importadas de cada producto")
+    parser.add_argument('--max-qty', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--backend', choices=('sqlite', 'redis'),
+                        default='sqlite')
+    parser.add_argument('--redis-url')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        asyncio.run(child(args))
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix="bot-bench-")
+    db_path = os.path.join(tmpdir, 'database.db')
+    shutil.copy(SOURCE_DB, db_path)
+    os.environ.update(DB_PATH=db_path, STATE_BACKEND=args.backend,
+                      ERROR_LOG_FILE=os.path.join(tmpdir, 'errors.log'))
+    fake_redis = None
+    if args.backend == 'redis':
+        from benchmarks.scaling_bench import FAKE_REDIS
+        if args.redis_url is None:
+            fake_redis = subprocess.Popen(
+                [sys.executable, '-c', FAKE_REDIS, '8399'])
+            args.redis_url = "redis://127.0.0.1:8399/0"
+            time.sleep(1)
+        os.environ['REDIS_URL'] = args.redis_url
+        os.environ['REDIS_PREFIX'] = f"bench-{os.getpid()}:"
+
+    try:
+        from products.load_products import create_tables
+        create_tables()
+        products = pick_products(db_path)
+        imported = asyncio.run(prepare(products, args.keys))
+        print(f"buyers: {args.buyers}  processes: {args.processes}  "
+              f"backend: {args.backend}  keys: {imported} "
+              f"({args.keys} per product)  qty: 1..{args.max_qty}  "
+              f"cpus: {os.cpu_count()}")
+
+        start_at = time.time() + 3
+        children = [subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.stock_contention',
+             '--child', str(i), '--start-at', str(start_at),
+             '--buyers', str(args.buyers), '--processes', str(args.processes),
+             '--max-qty', str(args.max_qty)],
+            cwd=ROOT, stdout=subprocess.PIPE) for i in range(args.processes)]
+        outputs = []
+        for process in children:
+            out, _ = process.communicate()
+            if process.returncode:
+                raise SystemExit("❌ Un proceso del benchmark falló")
+            outputs.append(json.loads(out))
+
+        results = [row for out in outputs for row in out['results']]
+        elapsed = (max(out['end'] for out in outputs)
+                   - min(out['start'] for out in outputs))
+        report = asyncio.run(verify(products, args.keys, args.max_qty,
+                                    results))
+    finally:
+        if fake_redis is not None:
+            fake_redis.terminate()
+            fake_redis.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    latencies = [row[3] for row in results]
+    print(f"placed: {report['placed']}  rejected (sold out): "
+          f"{len(results) - report['placed']}  keys reserved: "
+          f"{report['keys']}  left: {report['free']}")
+    print(f"{report['placed'] / elapsed:,.0f} reservations/s  "
+          f"{report['keys'] / elapsed:,.0f} keys/s  "
+          f"({len(results)} checkouts in {elapsed:.2f} s)")
+    print(f"checkout latency: p50 {percentile(latencies, .5) * 1e3:.1f} ms, "
+          f"p99 {percentile(latencies, .99) * 1e3:.1f} ms")
+    if report['problems']:
+        for problem in report['problems'][:20]:
+            print(f"❌ {problem}")
+        raise SystemExit(f"❌ {len(report['problems'])} errores")
+    print("✅ Sin claves duplicadas ni pedidos incompletos; el stock se "
+          "agotó sin rechazos indebidos.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+# benchmarks/tap_replay.py
+#
+# Reproduce una traza sintética de taps de usuarios impacientes (dobles y
+# triples taps, repeticiones tardías de la misma pantalla y ráfagas sobre
+# varios botones) contra los handlers reales de bot.py, con tap_guard
+# desactivado y activado, y compara las llamadas salientes a la Bot API.
+#
+# La traza lleva su propio reloj: las actualizaciones se procesan una a una
+# en orden de tiempo y tap_guard ve ese tiempo virtual, así que el resultado
+# es reproducible y no depende de la velocidad de la máquina. El Telegram
+# falso rechaza las ediciones idénticas como la API real.
+#
+# Uso: python -m benchmarks.tap_replay [--users N] [--intents I] [--seed S]
+
+import argparse
+import asyncio
+import heapq
+import os
+import random
+import shutil
+import tempfile
+
+# La base de datos de pruebas debe configurarse antes de importar bot.py
+_tmpdir = tempfile.mkdtemp(prefix="bot-bench-")
+_src_db = os.path.join(os.path.dirname(__file__), '..', 'products',
+                       'database.db')
+os.environ["DB_PATH"] = os.path.join(_tmpdir, 'database.db')
+os.environ["ERROR_LOG_FILE"] = os.path.join(_tmpdir, 'errors.log')
+shutil.copy(_src_db, os.environ["DB_PATH"])
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import bot  # noqa: E402
+import callbacks  # noqa: E402
+import error_reports  # noqa: E402
+import tap_guard  # noqa: E402
+from products.catalog import get_catalog  # noqa: E402
+from products.exchange_rates import get_rates  # noqa: E402
+from benchmarks.fake_telegram import (  # noqa: E402
+    FAKE_TOKEN, FakeTelegramRequest, callback_update)
+
+
+def user_trace(rng: random.Random, intents: int) -> list:
+    """[(segundos, callback_data), ...] de un usuario."""
+    catalog = get_catalog()
+    categories = list(catalog.by_category)
+    currencies = list(get_rates().currencies)
+    t = rng.uniform(0, 60)
+    category = rng.choice(categories)
+    taps = []
+    for _ in range(intents):
+        t += rng.expovariate(1 / 2.5)
+        action = rng.choices(('category', 'add', 'cart', 'currency'),
+                             (4, 3, 2, 1))[0]
+        if action == 'category':
+            category = rng.choice(categories)
+            data = callbacks.encode('category', category)
+        elif action == 'add':
+            product = rng.choice(catalog.products_in(category))
+            data = callbacks.encode('add', product.id, catalog.revision)
+        elif action == 'cart':
+            data = 'cart'
+        else:
+            data = callbacks.encode('set_currency', rng.choice(currencies))
+        taps.append((t, data))
+
+        # Impaciencia: el mismo botón otra vez antes de ver la respuesta
+        if rng.random() < 0.35:
+            for _ in range(rng.randint(1, 3)):
+                t += rng.uniform(0.1, 0.5)
+                taps.append((t, data))
+        # Volver a pedir la misma pantalla un rato después (sin cambios)
+        if action != 'add' and rng.random() < 0.15:
+            t += rng.uniform(1.5, 4.0)
+            taps.append((t, data))
+        # Ráfaga sobre varias categorías seguidas
+        if rng.random() < 0.04:
+            for _ in range(10):
+                t += rng.uniform(0.05, 0.15)
+                taps.append((t, callbacks.encode('category',
+                                                 rng.choice(categories))))
+    return taps
+
+
+async def replay(application, request, trace: list, first_user: int) -> dict:
+    """Procesa la traza en orden de tiempo; devuelve contadores de la pasada."""
+    request.calls.clear()
+    request.contents.clear()
+    tap_guard.reset()
+    errors = error_reports.aggregator.total
+    stats = dict(tap_guard.stats)
+    now = 0.0
+    tap_guard._clock = lambda: now
+    for update_id, (t, user, data) in enumerate(trace, start=1):
+        now = t
+        await application.process_update(Update.de_json(
+            callback_update(update_id, first_user + user, data),
+            application.bot))
+    return {
+        'taps': len(trace),
+        'api_calls': sum(request.calls.values()),
+        'calls': dict(request.calls),
+        'errors': error_reports.aggregator.total - errors,
+        **{key: tap_guard.stats[key] - stats[key] for key in stats},
+    }
+
+
+async def run(users: int, intents: int, seed: int):
+    request = FakeTelegramRequest(strict_edits=True)
+    application = (Application.builder().token(FAKE_TOKEN).request(request)
+                   .updater(None).build())
+    bot.register_handlers(application)
+    await application.initialize()
+    await bot.post_init(application)
+    try:
+        rng = random.Random(seed)
+        trace = list(heapq.merge(*(
+            [(t, user, data) for t, data in user_trace(rng, intents)]
+            for user in range(users))))
+
+        tap_guard.set_enabled(False)
+        before = await replay(application, request, trace, 1_000_000)
+        tap_guard.set_enabled(True)
+        after = await replay(application, request, trace, 2_000_000)
+    finally:
+        await bot.post_stop(application)
+        await application.shutdown()
+        await bot.post_shutdown(application)
+        tap_guard._clock = tap_guard.time.monotonic
+    return before, after
+
+
+def report(before: dict, after: dict):
+    print(f"taps replayed: {before['taps']}")
+    print(f"{'':24}{'guard off':>12}{'guard on':>12}")
+    methods = sorted(set(before['calls']) | set(after['calls']))
+    for method in methods:
+        print(f"  {method:22}{before['calls'].get(method, 0):12}"
+              f"{after['calls'].get(method, 0):12}")
+    print(f"  {'total API calls':22}{before['api_calls']:12}"
+          f"{after['api_calls']:12}")
+    print(f"  {'handler errors':22}{before['errors']:12}{after['errors']:12}")
+    print(f"debounced: {after['debounced']}  throttled: {after['throttled']}  "
+          f"edits skipped: {after['edits_skipped']}")
+    saved = before['api_calls'] - after['api_calls']
+    print(f"API calls saved: {saved} ({saved / before['api_calls']:.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--intents', type=int, default=12,
+                        help="acciones intencionadas por usuario")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    try:
+        before, after = asyncio.run(run(args.users, args.intents, args.seed))
+    finally:
+        shutil.rmtree(_tmpdir, ignore_errors=True)
+    report(before, after)
+
+
+if __name__ == '__main__':
+    main()
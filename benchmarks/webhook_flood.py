@@ -0,0 +1,137 @@
+# benchmarks/webhook_flood.py
+#
+# Levanta el servidor webhook real (keep_alive.create_app + handlers de
+# bot.py) contra un Telegram falso y le envía actualizaciones en ráfaga por
+# HTTP para medir el rendimiento.
+#
+# Uso: python -m benchmarks.webhook_flood [--updates N] [--concurrency C]
+#        [--workers W] [--latency SEGUNDOS]
+
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+# La base de datos de pruebas debe configurarse antes de importar bot.py
+_tmpdir = tempfile.mkdtemp(prefix="bot-bench-")
+_src_db = os.path.join(os.path.dirname(__file__), '..', 'products',
+                       'database.db')
+os.environ["DB_PATH"] = os.path.join(_tmpdir, 'database.db')
+shutil.copy(_src_db, os.environ["DB_PATH"])
+# Los compradores sintéticos tocan a la velocidad de la máquina: tap_guard
+# sigue en el camino (se mide su coste) pero sin antirrebote ni límite
+os.environ["TAP_DEBOUNCE_WINDOW"] = "0"
+os.environ["TAP_BURST"] = os.environ["TAP_RATE"] = "1e9"
+
+import aiohttp  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import Application, TypeHandler  # noqa: E402
+
+import bot  # noqa: E402
+from update_processor import UserOrderedUpdateProcessor  # noqa: E402
+from keep_alive import create_app, keep_alive  # noqa: E402
+from benchmarks.fake_telegram import (  # noqa: E402
+    FAKE_TOKEN, FakeTelegramRequest, callback_update)
+
+
+def taps() -> list:
+    """Secuencia de taps repetida por los usuarios (tras cargar el catálogo)."""
+    revision = bot.get_catalog().revision
+    return ['category:streaming', f'add:1:{revision}', 'cart',
+            'category:music', f'add:7:{revision}', 'set_currency:USDT',
+            'cart', 'start']
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(updates: int, concurrency: int, users: int, port: int,
+              workers: int, latency: float):
+    request = FakeTelegramRequest(latency)
+    builder = (Application.builder().token(FAKE_TOKEN).request(request)
+               .updater(None))
+    if workers > 1:
+        builder = builder.concurrent_updates(
+            UserOrderedUpdateProcessor(workers))
+    application = builder.build()
+    bot.register_handlers(application)
+
+    processed = 0
+    done = asyncio.Event()
+
+    async def count(update, context):
+        nonlocal processed
+        processed += 1
+        if processed == updates:
+            done.set()
+
+    application.add_handler(TypeHandler(Update, count), group=1)
+
+    await application.initialize()
+    await bot.post_init(application)
+    await application.start()
+    runner = await keep_alive(create_app(application, '/telegram'),
+                              '127.0.0.1', port)
+
+    url = f"http://127.0.0.1:{port}/telegram"
+    latencies = []
+    queue = asyncio.Queue()
+    sequence = taps()
+    for i in range(updates):
+        queue.put_nowait(callback_update(i + 1, 1000 + i % users,
+                                         sequence[i % len(sequence)]))
+
+    async def sender(session):
+        while not queue.empty():
+            payload = queue.get_nowait()
+            t = time.perf_counter()
+            async with session.post(url, json=payload) as resp:
+                assert resp.status == 200, resp.status
+            latencies.append(time.perf_counter() - t)
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(sender(session) for _ in range(concurrency)))
+    accepted = time.perf_counter() - start
+    await done.wait()
+    total = time.perf_counter() - start
+
+    await runner.cleanup()
+    await application.stop()
+    await bot.post_stop(application)
+    await application.shutdown()
+    await bot.post_shutdown(application)
+
+    print(f"updates: {updates}  concurrency: {concurrency}  users: {users}  "
+          f"workers: {workers}  api latency: {latency * 1e3:.0f} ms")
+    print(f"accepted: {updates / accepted:,.0f} updates/s over HTTP")
+    print(f"processed: {updates / total:,.0f} updates/s end to end")
+    print(f"POST latency: p50 {percentile(latencies, .5) * 1e3:.2f} ms, "
+          f"p99 {percentile(latencies, .99) * 1e3:.2f} ms")
+    print(f"Bot API calls: {dict(request.calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="1 = procesamiento secuencial de PTB")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="latencia simulada de la Bot API en segundos")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args.updates, args.concurrency, args.users,
+                        args.port, args.workers, args.latency))
+    finally:
+        shutil.rmtree(_tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,37 @@
+import asyncio
 import logging
-import json
 import os
-import sqlite3
-from threading import Thread
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from products.load_products import DB_PATH, create_tables, clear_and_load_products
+import signal
+import time
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup,
+                      InlineQueryResultArticle, InputTextMessageContent)
+from telegram.ext import (Application, CommandHandler, CallbackQueryHandler,
+                          ContextTypes, InlineQueryHandler)
+from telegram.request import HTTPXRequest
+from products.load_products import prepare_database, sync_products
 from products.categories import CATEGORIES
-from products.exchange_rates import convert_to_currency, format_currency, DEFAULT_CURRENCY
+from products.catalog import get_catalog, price_table, reload_catalog
+from products.exchange_rates import (CURRENCY_NAMES, convert_to_currency,
+                                     format_currency, get_rates, reload_rates)
 from dotenv import load_dotenv
-from keep_alive import keep_alive
+import analytics
+import broadcasts
+import callbacks
+import error_reports
+import inventory
+from keep_alive import create_app, keep_alive
+import metrics
+import notifications
+import orders
+import rate_service
+import repository
+from sessions import (get_currency, get_session, mark_dirty, session_cache,
+                      start_flusher, stop_flusher)
+import tap_guard
+from tap_guard import edit_message
+import views
+from views import render_main_menu, render_category
+from update_processor import UserOrderedUpdateProcessor
 
 load_dotenv()
 
@@ -23,213 +45,119 @@ logger = logging.getLogger(__name__)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 logging.getLogger('telegram').setLevel(logging.WARNING)
 
-
-# Conexión a la base de datos
-def get_db():
-    return sqlite3.connect(DB_PATH)
-
-
-# Obtener la moneda preferida del usuario
-def get_user_currency(user_id: int) -> str:
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT currency FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-
-    if not row or not row[0]:
-        return DEFAULT_CURRENCY
-
-    currency = row[0].strip().upper()
-    if currency in ['CUP', 'USDT']:
-        return currency
-    else:
-        return DEFAULT_CURRENCY
-
-
-# Actualizar la moneda preferida del usuario
-def set_user_currency(user_id: int, currency: str):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-
-    if row:
-        cursor.execute("UPDATE users SET currency = ? WHERE user_id = ?",
-                       (currency, user_id))
-    else:
-        cursor.execute("INSERT INTO users (user_id, currency) VALUES (?, ?)",
-                       (user_id, currency))
-
-    conn.commit()
-    conn.close()
-
-
-# --- AUTO-CREACIÓN DE LA BASE DE DATOS ---
-def ensure_database():
-    if not os.path.exists(DB_PATH):
-        print("⚠️ Base de datos no encontrada. Creando nueva...")
-        create_tables()
-        clear_and_load_products()
-        return
-
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute("SELECT name, category, price FROM products LIMIT 1")
-    except sqlite3.OperationalError:
-        print("⚠️ Tabla 'products' dañada o ausente. Recreando...")
-        create_tables()
-        clear_and_load_products()
-        conn.close()
-        return
-
-    try:
-        cursor.execute(
-            "SELECT user_id, currency, cart, total FROM users LIMIT 1")
-    except sqlite3.OperationalError:
-        print("⚠️ Tabla 'users' incompleta. Recreando...")
-        create_tables()
-        clear_and_load_products()
-        conn.close()
-        return
-
-    cursor.execute("SELECT COUNT(*) FROM products")
-    count = cursor.fetchone()[0]
-    if count == 0:
-        print("⚠️ La tabla 'products' está vacía. Recargando productos...")
-        clear_and_load_products()
-
-    conn.close()
-
-
-# Ejecutar verificación
-ensure_database()
-
-
-# Asegurar que el usuario exista
-async def ensure_user_exists(user_id: int, context: ContextTypes.DEFAULT_TYPE):
-    currency = get_user_currency(user_id)
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT OR IGNORE INTO users (user_id, currency) VALUES (?, ?)",
-        (user_id, currency))
-    conn.commit()
-    conn.close()
+# Modo de ejecución: 'polling' (por defecto) o 'webhook'
+RUN_MODE = os.getenv("RUN_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Con varios workers detrás de shard_router.py, WEBHOOK_URL es la URL pública
+# del router; basta con que uno de los procesos registre el webhook
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "1").strip().lower() not in (
+    "0", "false", "no", "off")
+
+# Administradores que reciben los avisos de compra (separados por comas)
+ADMIN_IDS = [
+    int(admin_id)
+    for admin_id in os.getenv("ADMIN_IDS", "6394480917,7235352661").split(',')
+    if admin_id.strip()
+]
+
+# Administradores que reciben el resumen periódico de errores
+ERROR_ADMIN_IDS = [
+    int(admin_id)
+    for admin_id in os.getenv("ERROR_ADMIN_IDS", "6394480917").split(',')
+    if admin_id.strip()
+]
+
+# Resultados máximos de /buscar y de las consultas inline
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "10"))
+
+# Actualizaciones procesadas en paralelo (las de un mismo usuario van en orden)
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+
+
+# Preparar la base de datos y cargar catálogo y tasas en memoria. Se llama al
+# arrancar (post_init), no al importar el módulo
+def load_state():
+    prepare_database()
+    reload_catalog()
+    reload_rates()
 
 
 # Menú principal
+@callbacks.route('start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    await ensure_user_exists(user_id, context)
-    currency = get_user_currency(user_id)
-
-    keyboard = []
-    for key, label in CATEGORIES.items():
-        keyboard.append(
-            [InlineKeyboardButton(label, callback_data=f'category:{key}')])
-
-    keyboard.extend(
-        [[InlineKeyboardButton("🛒 Ver Carrito", callback_data='cart')],
-         [InlineKeyboardButton("💰 Pagar", callback_data='checkout')],
-         [
-             InlineKeyboardButton("💱 Cambiar a USDT",
-                                  callback_data='set_currency:USDT'),
-             InlineKeyboardButton("💱 Cambiar a CUP",
-                                  callback_data='set_currency:CUP')
-         ]])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    session = await get_session(user_id)
+    if update.message:
+        # Escribir /start prueba que el usuario (de nuevo) acepta mensajes:
+        # el volcado de la sesión lo quita de los bloqueados para difusiones
+        mark_dirty(session)
 
-    await update.effective_message.reply_text(
-        f"¡Bienvenido a la tienda de productos digitales! 🚀\n"
-        f"Moneda actual: {currency}\n\n"
-        f"Elige una categoría:",
-        reply_markup=reply_markup)
+    text, reply_markup = render_main_menu(session.currency)
+    await update.effective_message.reply_text(text, reply_markup=reply_markup)
 
 
-# Mostrar productos
+# Mostrar productos (category:<clave>[:<página>])
+@callbacks.route('category', str, int, optional=1)
 async def show_products_by_category(update: Update,
-                                    context: ContextTypes.DEFAULT_TYPE):
+                                    context: ContextTypes.DEFAULT_TYPE,
+                                    category: str, page: int = 0):
     query = update.callback_query
-    category = query.data.split(':')[1]
 
     if category not in CATEGORIES:
         await query.answer(text="Categoría no válida.", show_alert=True)
-        await query.edit_message_text("Categoría no válida.")
+        await edit_message(query, "Categoría no válida.")
         return
 
     await query.answer(text="Cargando productos...")
 
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, name, price, description FROM products WHERE category = ?",
-        (category,))
-    products = cursor.fetchall()
-    conn.close()
-
-    if not products:
-        await query.edit_message_text(
-            f"No hay productos en {CATEGORIES[category]}.")
-        return
-
-    buttons = []
     user_id = query.from_user.id
-    currency = get_user_currency(user_id)
+    analytics.record(analytics.CATEGORY, user_id, category)
+    currency = (await get_session(user_id)).currency
 
-    for prod in products:
-        product_id, name, price, description = prod
-        price_in_currency = convert_to_currency(price, 'CUP', currency)
-        btn_text = f"{name} - {format_currency(price_in_currency, currency)}"
-        buttons.append([
-            InlineKeyboardButton(btn_text, callback_data=f'add:{product_id}')
-        ])
+    text, reply_markup = render_category(category, currency, page)
+    await edit_message(query, text, reply_markup=reply_markup)
 
-    buttons.append([InlineKeyboardButton("⬅️ Volver", callback_data='start')])
-    reply_markup = InlineKeyboardMarkup(buttons)
-    await query.edit_message_text(f"Productos de {CATEGORIES[category]}:",
-                                  reply_markup=reply_markup)
 
-
-# Añadir al carrito
-async def add_to_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Añadir al carrito (add:<id>:<revisión del catálogo>)
+@callbacks.route('add', int, int, optional=1)
+async def add_to_cart(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                      product_id: int, revision: int = None):
     query = update.callback_query
-    await query.answer()
-
-    product_id = int(query.data.split(':')[1])
     user_id = query.from_user.id
-    await ensure_user_exists(user_id, context)
-
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "SELECT name, price, description FROM products WHERE id = ?",
-        (product_id,))
-    product = cursor.fetchone()
-    if not product:
-        await query.edit_message_text("Producto no encontrado.")
+    session = await get_session(user_id)
+
+    catalog = get_catalog()
+    product = catalog.by_id.get(product_id)
+    if product is None or revision != catalog.revision:
+        # Botón generado con un catálogo anterior: el producto pudo cambiar
+        # de precio o retirarse, así que se muestra la lista vigente
+        if product is None:
+            await query.answer("Este producto ya no está disponible.")
+            text, reply_markup = render_main_menu(session.currency)
+        else:
+            await query.answer("El catálogo se actualizó. Revisa los precios.")
+            text, reply_markup = render_category(product.category,
+                                                 session.currency)
+        await edit_message(query, text, reply_markup=reply_markup)
         return
 
-    cursor.execute("SELECT cart FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    cart = json.loads(row[0]) if row and row[0] else {}
-    cart[str(product_id)] = cart.get(str(product_id), 0) + 1
-
-    current_currency = get_user_currency(user_id)
-
-    cursor.execute(
-        "INSERT OR REPLACE INTO users (user_id, cart, total, currency) VALUES (?, ?, ?, ?)",
-        (user_id, json.dumps(cart), 0, current_currency))
-    conn.commit()
-    conn.close()
+    stock = inventory.available(product_id)
+    if stock is not None and session.cart.get(product_id, 0) >= stock:
+        await query.answer(
+            "😔 Agotado." if not stock else
+            f"😔 Solo quedan {stock} unidades de {product.name}.",
+            show_alert=True)
+        return
 
-    name, price, description = product
-    currency = get_user_currency(user_id)
-    price_in_currency = convert_to_currency(price, 'CUP', currency)
+    await query.answer()
+    session.add_item(product_id)
+    mark_dirty(session)
+    analytics.record(analytics.ADD, user_id, str(product_id), 1,
+                     product.price)
+    currency = session.currency
+    price_in_currency = price_table(currency)[product.id]
 
     keyboard = [
         [InlineKeyboardButton("⬅️ Volver al Menú", callback_data='start')],
@@ -238,54 +166,55 @@ async def add_to_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await query.edit_message_text(
-        f"✅ {name} añadido al carrito.\n\n"
-        f"📝 Descripción: {description}\n\n"
+    await edit_message(
+        query,
+        f"✅ {product.name} añadido al carrito.\n\n"
+        f"📝 Descripción: {product.description}\n\n"
         f"💰 Precio: {format_currency(price_in_currency, currency)}\n\n"
         f"¿Qué deseas hacer?",
         reply_markup=reply_markup)
 
 
+# Líneas del carrito [(id, nombre, precio_cup, cantidad), ...] según el catálogo
+def cart_lines(cart: dict) -> list:
+    by_id = get_catalog().by_id
+    lines = []
+    for prod_id, qty in cart.items():
+        product = by_id.get(prod_id)
+        if product:
+            lines.append((prod_id, product.name, product.price, qty))
+    return lines
+
+
 # Ver carrito
+@callbacks.route('cart')
 async def view_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     user_id = query.from_user.id
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT cart FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-
-    if not row or not row[0]:
-        await query.edit_message_text("Tu carrito está vacío.")
+    analytics.record(analytics.CART, user_id)
+    session = await get_session(user_id)
+    currency = session.currency
+    lines = cart_lines(session.cart)
+
+    if not lines:
+        await edit_message(query, "Tu carrito está vacío.")
         return
 
-    cart = json.loads(row[0])
     total = 0
     items = []
+    prices = price_table(currency)
 
-    conn = get_db()
-    cursor = conn.cursor()
-    currency = get_user_currency(user_id)
-
-    for prod_id, qty in cart.items():
-        cursor.execute("SELECT name, price FROM products WHERE id = ?",
-                       (int(prod_id),))
-        prod = cursor.fetchone()
-        if prod:
-            name, price = prod
-            unit_price = convert_to_currency(price, 'CUP', currency)
-            subtotal = unit_price * qty
-            total += subtotal
-            items.append(
-                f"• {qty}x {name} → {format_currency(subtotal, currency)}")
-
-    conn.close()
+    for prod_id, name, _, qty in lines:
+        unit_price = prices[prod_id]
+        subtotal = unit_price * qty
+        total += subtotal
+        items.append(
+            f"• {qty}x {name} → {format_currency(subtotal, currency)}")
 
     if not items:
-        await query.edit_message_text("Tu carrito está vacío.")
+        await edit_message(query, "Tu carrito está vacío.")
         return
 
     items_str = "\n".join(items)
@@ -295,26 +224,25 @@ async def view_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ], [InlineKeyboardButton("💰 Pagar", callback_data='checkout')
         ], [InlineKeyboardButton("⬅️ Volver al Menú", callback_data='start')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(message, reply_markup=reply_markup)
+    await edit_message(query, message, reply_markup=reply_markup)
 
 
 # Vaciar carrito
+@callbacks.route('clear_cart')
 async def clear_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     user_id = query.from_user.id
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET cart = NULL, total = 0 WHERE user_id = ?",
-                   (user_id,))
-    conn.commit()
-    conn.close()
+    session = await get_session(user_id)
+    session.clear_cart()
+    mark_dirty(session)
 
-    await query.edit_message_text("🗑️ Carrito vaciado.")
+    await edit_message(query, "🗑️ Carrito vaciado.")
 
 
 # Checkout
+@callbacks.route('checkout')
 async def checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -322,72 +250,394 @@ async def checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
     user_name = query.from_user.username or query.from_user.first_name
 
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT cart FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
+    session = await get_session(user_id)
+    currency = session.currency
+    lines = cart_lines(session.cart)
 
-    if not row or not row[0]:
-        await query.edit_message_text("Tu carrito está vacío.")
+    if not lines:
+        await edit_message(query, "Tu carrito está vacío.")
         return
 
-    cart = json.loads(row[0])
-    total = 0
-    items = []
+    prices = price_table(currency)
+    total = sum(prices[prod_id] * qty for prod_id, _, _, qty in lines)
+
+    # El pedido se guarda y se avisa a los administradores en segundo plano;
+    # si lleva productos con claves se espera a su lote para saber si se
+    # pudieron reservar
+    stocked = inventory.stocked(prod_id for prod_id, _, _, _ in lines)
+    placed = orders.submit(orders.OrderRequest(user_id, user_name, currency,
+                                               lines, time.time(), stocked))
+    order_id, sold_out = await placed if stocked else (None, None)
+    if sold_out is not None:
+        name = next(name for prod_id, name, _, _ in lines
+                    if prod_id == sold_out)
+        await edit_message(
+            query,
+            f"😔 No queda stock suficiente de {name}.\n"
+            f"Ajusta tu carrito e inténtalo de nuevo.",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("🛒 Ver Carrito", callback_data='cart')],
+                [InlineKeyboardButton("⬅️ Volver al Menú",
+                                      callback_data='start')]]))
+        return
 
-    conn = get_db()
-    cursor = conn.cursor()
-    currency = get_user_currency(user_id)
+    session.clear_cart()
+    mark_dirty(session)
+    analytics.record_checkout(user_id, lines)
 
-    for prod_id, qty in cart.items():
-        cursor.execute("SELECT name, price FROM products WHERE id = ?",
-                       (int(prod_id),))
-        prod = cursor.fetchone()
-        if prod:
-            name, price = prod
-            unit_price = convert_to_currency(price, 'CUP', currency)
-            subtotal = unit_price * qty
-            total += subtotal
-            items.append(f"{qty}x {name}")
-
-    conn.close()
-
-    ADMIN_IDS = [6394480917, 7235352661]
-
-    cart_items_str = "\n".join(items)
-    message_to_admin = (f"🚨 NUEVA COMPRA!\n"
-                        f"👤 Usuario: @{user_name} ({user_id})\n"
-                        f"🛒 Productos:\n{cart_items_str}\n"
-                        f"💰 Total: {format_currency(total, currency)}\n\n"
-                        f"⚠️ ¡CONFIRMAR PAGO Y ENVIAR PRODUCTO MANUALMENTE!")
-
-    for admin_id in ADMIN_IDS:
-        await context.bot.send_message(chat_id=admin_id, text=message_to_admin)
-
-    await query.edit_message_text(
+    if len(stocked) == len(lines):
+        delivery = "Una vez confirmado, recibirás tus productos aquí automáticamente."
+    else:
+        delivery = "Una vez confirmado, te enviaré los productos manualmente."
+    await edit_message(
+        query,
         f"🎉 Gracias por tu compra!\n"
         f"Total: {format_currency(total, currency)}\n\n"
         f"📧 Nos pondremos en contacto para que realices el pago, por favor espere.\n"
-        f"Una vez confirmado, te enviaré los productos manualmente.\n\n"
+        f"{delivery}\n\n"
         f"💡 Recuerda: No se envían productos hasta que yo confirme el pago.")
 
 
+# Comprobar si quien escribe es administrador
+def is_admin(update: Update) -> bool:
+    return (update.effective_user is not None
+            and update.effective_user.id in ADMIN_IDS)
+
+
+# Listar pedidos pendientes (solo administradores)
+async def list_pending_orders(update: Update,
+                              context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+
+    rows = await orders.pending_orders()
+    if not rows:
+        await update.effective_message.reply_text("No hay pedidos pendientes.")
+        return
+
+    lines = []
+    for order_id, user_id, username, currency, total_cup, created_at in rows:
+        total = convert_to_currency(total_cup, 'CUP', currency)
+        when = time.strftime('%d/%m %H:%M', time.localtime(created_at))
+        lines.append(f"#{order_id} · @{username} ({user_id}) · "
+                     f"{format_currency(total, currency)} · {when}")
+
+    await update.effective_message.reply_text(
+        "🧾 Pedidos pendientes:\n\n" + "\n".join(lines))
+
+
+ORDER_STATUS_MESSAGES = {
+    orders.PAID: "✅ Pago del pedido #{id} confirmado. En breve recibirás tus productos.",
+    orders.DELIVERED: "📦 Pedido #{id} entregado. ¡Gracias por tu compra!",
+    orders.CANCELLED: "❌ Pedido #{id} cancelado.",
+}
+
+
+async def _change_order_status(update: Update,
+                               context: ContextTypes.DEFAULT_TYPE,
+                               status: str, command: str):
+    if not is_admin(update):
+        return
+
+    try:
+        order_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.effective_message.reply_text(f"Uso: /{command} <id>")
+        return
+
+    if status == orders.CANCELLED:
+        buyer_id = await orders.cancel(order_id)
+    else:
+        buyer_id = await orders.set_status(order_id, status)
+    if buyer_id is None:
+        await update.effective_message.reply_text(
+            f"⚠️ El pedido #{order_id} no existe o no está en estado "
+            f"'{orders.TRANSITIONS[status]}'.")
+        return
+
+    await notifications.notify([buyer_id],
+                               ORDER_STATUS_MESSAGES[status].format(id=order_id))
+    reply = f"✅ Pedido #{order_id} marcado como '{status}'."
+    if status == orders.PAID:
+        # Las claves reservadas al comprar se envían ya
+        sent, delivered = await orders.deliver_keys(order_id, buyer_id)
+        if sent:
+            reply += f"\n🔑 {sent} claves enviadas al comprador."
+            reply += (" Pedido entregado." if delivered else
+                      " Quedan productos por enviar a mano.")
+    await update.effective_message.reply_text(reply)
+
+
+# Confirmar pago de un pedido (solo administradores)
+async def mark_order_paid(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _change_order_status(update, context, orders.PAID, 'pagado')
+
+
+# Confirmar entrega de un pedido (solo administradores)
+async def mark_order_delivered(update: Update,
+                               context: ContextTypes.DEFAULT_TYPE):
+    await _change_order_status(update, context, orders.DELIVERED, 'entregado')
+
+
+# Cancelar un pedido pendiente y liberar sus claves (solo administradores)
+async def cancel_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _change_order_status(update, context, orders.CANCELLED, 'cancelar')
+
+
+# Importar claves al stock (solo administradores): /claves <sku> con un
+# código por línea debajo; sin argumentos lista las existencias
+async def import_product_keys(update: Update,
+                              context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+
+    message = update.effective_message
+    first_line, _, rest = message.text.partition('\n')
+    # El sku puede tener espacios: es todo lo que sigue al comando
+    parts = first_line.split(maxsplit=1)
+    if len(parts) < 2:
+        await inventory.refresh()
+        by_id = get_catalog().by_id
+        lines = [f"{by_id[prod_id].name}: {inventory.available(prod_id)}"
+                 for prod_id in inventory.stocked(by_id)]
+        await message.reply_text(
+            "🔑 Claves libres:\n\n" + "\n".join(lines) if lines else
+            "No hay productos con claves.\n"
+            "Uso: /claves <sku> y un código por línea debajo.")
+        return
+
+    sku = parts[1].strip()
+    codes = [code.strip() for code in rest.splitlines() if code.strip()]
+    if not codes:
+        await message.reply_text(
+            "Uso: /claves <sku> y un código por línea debajo.")
+        return
+    result = await inventory.import_keys((sku, code) for code in codes)
+    if result['unknown']:
+        await message.reply_text(f"⚠️ No existe ningún producto con sku '{sku}'.")
+        return
+    await message.reply_text(
+        f"🔑 {result['added']} claves nuevas para {sku}, "
+        f"{result['duplicates']} repetidas.")
+
+
+# Embudo de /stats: (tipo de evento, etiqueta)
+STATS_FUNNEL = [(analytics.CATEGORY, "👀 Vieron productos"),
+                (analytics.ADD, "➕ Añadieron al carrito"),
+                (analytics.CART, "🛒 Abrieron el carrito"),
+                (analytics.CHECKOUT, "✅ Compraron")]
+
+
+def _sales_line(totals: dict) -> str:
+    orders_count, units, amount, _ = totals.get(analytics.CHECKOUT,
+                                                (0, 0, 0, 0))
+    return (f"{orders_count} compras · {units} uds · "
+            f"{format_currency(amount, 'CUP')}")
+
+
+def _conversion(totals: dict) -> str:
+    visitors = totals.get(analytics.CATEGORY, (0, 0, 0, 0))[3]
+    buyers = totals.get(analytics.CHECKOUT, (0, 0, 0, 0))[3]
+    return f"{buyers / visitors:.1%}" if visitors else "—"
+
+
+# Ventas y embudo de compra (solo administradores)
+async def sales_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+
+    # Incluir lo registrado hasta ahora (como mucho unos segundos de eventos)
+    await analytics.flush()
+    await analytics.rollup()
+    summary = await analytics.summary()
+
+    today = summary['today']
+    funnel = "\n".join(
+        f"{label}: {today.get(kind, (0, 0, 0, 0))[3]}"
+        for kind, label in STATS_FUNNEL)
+    by_id = get_catalog().by_id
+    top = "\n".join(
+        f"{i}. {by_id[int(item)].name if int(item) in by_id else item} — "
+        f"{qty} uds · {format_currency(amount, 'CUP')}"
+        for i, (item, qty, amount) in enumerate(summary['top'], 1))
+    hour = summary['hour']
+    await update.effective_message.reply_text(
+        f"📊 Hoy (usuarios únicos):\n{funnel}\n"
+        f"Conversión: {_conversion(today)}\n"
+        f"💰 {_sales_line(today)}\n\n"
+        f"📅 7 días: {_sales_line(summary['week'])} "
+        f"(conversión {_conversion(summary['week'])})\n"
+        f"📅 30 días: {_sales_line(summary['month'])} "
+        f"(conversión {_conversion(summary['month'])})\n\n"
+        f"🏆 Más vendidos (7 días):\n{top or 'Sin ventas.'}\n\n"
+        f"🕐 Esta hora: {hour.get(analytics.CATEGORY, 0)} vistas, "
+        f"{hour.get(analytics.ADD, 0)} añadidos, "
+        f"{hour.get(analytics.CHECKOUT, 0)} compras")
+
+
+BROADCAST_STATUS = {'running': 'en curso', 'done': 'terminada',
+                    'cancelled': 'cancelada'}
+
+
+# Difundir un anuncio a todos los usuarios (solo administradores):
+# /broadcast <texto>, /broadcast estado, /broadcast cancelar
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+
+    message = update.effective_message
+    parts = message.text.split(maxsplit=1)
+    argument = parts[1].strip() if len(parts) > 1 else ''
+
+    if argument.lower() in ('', 'estado', 'status'):
+        row = await broadcasts.latest()
+        if row is None:
+            await message.reply_text(
+                "Uso: /broadcast <texto> · /broadcast estado · "
+                "/broadcast cancelar")
+            return
+        (broadcast_id, _, status, _, total, sent, failed, blocked, _, _,
+         updated_at) = row
+        done = sent + failed + blocked
+        progress = f" ({done / total:.0%})" if total else ""
+        when = time.strftime('%d/%m %H:%M', time.localtime(updated_at))
+        await message.reply_text(
+            f"📣 Difusión #{broadcast_id}: "
+            f"{BROADCAST_STATUS.get(status, status)}\n"
+            f"Procesados: {done} de {total}{progress}\n"
+            f"✅ Enviados: {sent} · 🚫 Bloqueados: {blocked} · "
+            f"⚠️ Fallidos: {failed}\nÚltimo avance: {when}")
+        return
+
+    if argument.lower() in ('cancelar', 'cancel'):
+        broadcast_id = await broadcasts.cancel()
+        if broadcast_id is None:
+            await message.reply_text("No hay ninguna difusión en curso.")
+        else:
+            await message.reply_text(f"🛑 Difusión #{broadcast_id} cancelada.")
+        return
+
+    created = await broadcasts.create(argument, update.effective_user.id)
+    if created is None:
+        await message.reply_text(
+            "⚠️ Ya hay una difusión en curso. Usa /broadcast estado o "
+            "/broadcast cancelar.")
+        return
+    broadcast_id, total = created
+    await message.reply_text(
+        f"📣 Difusión #{broadcast_id} iniciada para {total} usuarios. "
+        f"Te avisaré al terminar.")
+
+
+# Sincronizar el catálogo con products_data.py sin reiniciar (solo administradores)
+async def reload_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+
+    stats = await repository.run_db(sync_products)
+    catalog = await repository.run_db(reload_catalog)
+    await update.effective_message.reply_text(
+        f"✅ Catálogo sincronizado: {len(catalog.by_id)} productos activos, "
+        f"{stats['changed']} nuevos o modificados, {stats['removed']} retirados.")
+
+
+# Productos activos que coinciden con un texto, los más relevantes primero
+async def find_products(text: str, limit: int = SEARCH_LIMIT) -> list:
+    by_id = get_catalog().by_id
+    ids = await repository.search_products(text, limit)
+    return [by_id[prod_id] for prod_id in ids if prod_id in by_id]
+
+
+# Buscar productos por nombre, descripción o datos de entrega
+async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = ' '.join(context.args).strip()
+    if not text:
+        await update.effective_message.reply_text(
+            "Uso: /buscar <texto>\nEjemplo: /buscar netflix")
+        return
+
+    currency = (await get_session(update.effective_user.id)).currency
+    products = await find_products(text)
+    if not products:
+        await update.effective_message.reply_text(
+            f"No se encontraron productos para «{text}».",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("⬅️ Volver al Menú", callback_data='start')
+            ]]))
+        return
+
+    prices = price_table(currency)
+    revision = get_catalog().revision
+    buttons = [
+        [InlineKeyboardButton(
+            f"{product.name} - {format_currency(prices[product.id], currency)}",
+            callback_data=callbacks.encode('add', product.id, revision))]
+        for product in products
+    ]
+    buttons.append([InlineKeyboardButton("⬅️ Volver al Menú",
+                                         callback_data='start')])
+    await update.effective_message.reply_text(
+        f"🔎 Resultados para «{text}»:",
+        reply_markup=InlineKeyboardMarkup(buttons))
+
+
+# Búsqueda inline (@bot texto) desde cualquier chat
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    text = query.query.strip()
+    if not text:
+        await query.answer([], cache_time=300)
+        return
+
+    # Sin crear sesión: quien solo usa el modo inline no es usuario del bot
+    currency = await get_currency(query.from_user.id)
+    prices = price_table(currency)
+    results = []
+    for product in await find_products(text):
+        price = format_currency(prices[product.id], currency)
+        results.append(InlineQueryResultArticle(
+            id=str(product.id),
+            title=f"{product.name} - {price}",
+            description=product.description,
+            input_message_content=InputTextMessageContent(
+                f"🛍️ {product.name}\n\n"
+                f"📝 Descripción: {product.description}\n\n"
+                f"💰 Precio: {price}")))
+    # Los precios dependen de la moneda de cada usuario
+    await query.answer(results, cache_time=30, is_personal=True)
+
+
+# Activar o desactivar las métricas del camino caliente (solo administradores)
+async def toggle_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+
+    if context.args and context.args[0].lower() in ('on', 'off'):
+        metrics.set_enabled(context.args[0].lower() == 'on')
+    state = 'activadas' if metrics.ENABLED else 'desactivadas'
+    await update.effective_message.reply_text(
+        f"📊 Métricas {state}. Uso: /metricas on|off")
+
+
 # Cambiar moneda
-async def set_currency(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callbacks.route('set_currency', str)
+async def set_currency(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                       new_currency: str):
     query = update.callback_query
     await query.answer()
 
-    new_currency = query.data.split(':')[1]
-    if new_currency not in ['CUP', 'USDT']:
-        await query.edit_message_text("Moneda no válida.")
+    if new_currency not in get_rates().cup_per_unit:
+        await edit_message(query, "Moneda no válida.")
         return
 
     user_id = query.from_user.id
-    set_user_currency(user_id, new_currency)
+    session = await get_session(user_id)
+    session.currency = new_currency
+    mark_dirty(session)
 
-    currency_name = "Pesos Cubanos (CUP)" if new_currency == 'CUP' else "Tether (USDT)"
-    await query.edit_message_text(
+    currency_name = CURRENCY_NAMES.get(new_currency, new_currency)
+    await edit_message(
+        query,
         f"✅ ¡Moneda cambiada a {currency_name}!\n\n"
         f"Todos los precios ahora se muestran en {format_currency(1, new_currency)}.\n\n"
         f"Vuelve a seleccionar una categoría para ver los precios actualizados.",
@@ -396,35 +646,166 @@ async def set_currency(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]]))
 
 
-# Handler de callbacks
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    data = query.data
-
-    if data == 'start':
-        await start(update, context)
-    elif data.startswith('category:'):
-        await show_products_by_category(update, context)
-    elif data.startswith('add:'):
-        await add_to_cart(update, context)
-    elif data == 'cart':
-        await view_cart(update, context)
-    elif data == 'clear_cart':
-        await clear_cart(update, context)
-    elif data == 'checkout':
-        await checkout(update, context)
-    elif data.startswith('set_currency:'):
-        await set_currency(update, context)
-
-
-# Handler de errores
+# Handler donde ocurrió un error, para agrupar los errores por origen
+def error_source(update: object) -> str:
+    if not isinstance(update, Update):
+        return 'tarea'
+    if update.callback_query:
+        return f"callback:{callbacks.route_name(update.callback_query.data)}"
+    if update.inline_query:
+        return 'inline'
+    message = update.effective_message
+    if message and message.text and message.text.startswith('/'):
+        return message.text.split()[0].split('@')[0]
+    return 'mensaje'
+
+
+# Handler de errores: se agregan y se envía un resumen periódico
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
-    logger.error(msg="Exception while handling an update:",
-                 exc_info=context.error)
-    if isinstance(update, Update) and update.effective_chat:
-        await context.bot.send_message(
-            chat_id=6394480917,
-            text=f"⚠️ Error en el bot:\n{str(context.error)}")
+    error_reports.record(context.error, error_source(update))
+
+
+# Cargar el estado y arrancar el volcado de sesiones, el canal de pedidos, el
+# envío de avisos, la recarga de tasas, el resumen de errores, las
+# difusiones, los contadores de existencias y el registro de eventos
+async def post_init(application: Application):
+    # Falla al arrancar (no en el primer tap) si STATE_BACKEND no es válido
+    repository.get_store()
+    await repository.run_db(load_state)
+    start_flusher()
+    notifications.start_dispatcher(application.bot)
+    orders.start_pipeline(ADMIN_IDS)
+    rate_service.refresh_price_tables()
+    rate_service.start_rate_service()
+    error_reports.start_reporter(ERROR_ADMIN_IDS)
+    broadcasts.start_engine(application.bot)
+    await inventory.start_refresher()
+    analytics.start_analytics()
+
+
+# Detener lo que envía mensajes mientras el cliente HTTP del Bot sigue
+# abierto (antes de application.shutdown()): la difusión guarda lo ya
+# enviado, los pedidos pendientes se guardan y encolan sus avisos y el
+# despachador marca los entregados para no repetirlos al arrancar
+async def post_stop(application: Application):
+    await broadcasts.stop_engine()
+    await orders.stop_pipeline()
+    await error_reports.stop_reporter()
+    await notifications.stop_dispatcher()
+
+
+# Guardar sesiones y eventos pendientes y liberar recursos al apagar
+async def post_shutdown(application: Application):
+    await rate_service.stop_rate_service()
+    await inventory.stop_refresher()
+    await analytics.stop_analytics()
+    await stop_flusher()
+    await repository.close_store()
+    repository.shutdown()
+
+
+# Registrar handlers y métricas en una Application
+def register_handlers(application: Application):
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("pedidos", list_pending_orders))
+    application.add_handler(CommandHandler("pagado", mark_order_paid))
+    application.add_handler(CommandHandler("entregado", mark_order_delivered))
+    application.add_handler(CommandHandler("cancelar", cancel_order))
+    application.add_handler(CommandHandler("claves", import_product_keys))
+    application.add_handler(CommandHandler(["stats", "estadisticas"],
+                                           sales_stats))
+    application.add_handler(CommandHandler("recargar", reload_products))
+    application.add_handler(CommandHandler("metricas", toggle_metrics))
+    application.add_handler(CommandHandler(["broadcast", "difundir"],
+                                           broadcast))
+    application.add_handler(CommandHandler(["buscar", "search"], search))
+    application.add_handler(InlineQueryHandler(inline_search))
+    application.add_handler(CallbackQueryHandler(callbacks.dispatch))
+    application.add_error_handler(error_handler)
+
+    metrics.register_gauge('bot_update_queue_depth',
+                           'Actualizaciones recibidas aún sin despachar',
+                           application.update_queue.qsize)
+    processor = application.update_processor
+    if isinstance(processor, UserOrderedUpdateProcessor):
+        metrics.register_gauge('bot_updates_waiting',
+                               'Actualizaciones esperando turno o worker',
+                               lambda: processor.waiting)
+        metrics.register_gauge('bot_updates_in_flight',
+                               'Actualizaciones en proceso',
+                               lambda: processor.in_flight)
+        metrics.register_gauge('bot_updates_processed',
+                               'Actualizaciones procesadas desde el arranque',
+                               lambda: processor.processed)
+
+    metrics.register_counter('bot_render_cache_hits_total',
+                             'Pantallas servidas desde la caché de render',
+                             lambda: views.stats['hits'])
+    metrics.register_counter('bot_render_cache_misses_total',
+                             'Pantallas construidas de nuevo',
+                             lambda: views.stats['misses'])
+    metrics.register_counter('bot_session_cache_hits_total',
+                             'Sesiones encontradas en memoria',
+                             lambda: session_cache.stats['hits'])
+    metrics.register_counter('bot_session_cache_misses_total',
+                             'Sesiones cargadas de la base de datos',
+                             lambda: session_cache.stats['misses'])
+    metrics.register_gauge('bot_sessions_cached', 'Sesiones en memoria',
+                           lambda: len(session_cache))
+    metrics.register_counter('bot_callbacks_unknown_total',
+                             'Botones con una ruta que no existe',
+                             lambda: callbacks.stats['unknown'])
+    metrics.register_counter('bot_callbacks_invalid_total',
+                             'Botones con argumentos no válidos',
+                             lambda: callbacks.stats['invalid'])
+    metrics.register_counter('bot_taps_debounced_total',
+                             'Taps repetidos descartados por el antirrebote',
+                             lambda: tap_guard.stats['debounced'])
+    metrics.register_counter('bot_taps_throttled_total',
+                             'Taps descartados por el límite por usuario',
+                             lambda: tap_guard.stats['throttled'])
+    metrics.register_counter('bot_edits_skipped_total',
+                             'Ediciones idénticas que no se enviaron',
+                             lambda: tap_guard.stats['edits_skipped'])
+
+
+# Servir el bot y el servidor HTTP en el mismo event loop
+async def serve(application: Application, webhook: bool):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows no soporta señales en el event loop
+            pass
+
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+
+    if webhook:
+        if WEBHOOK_REGISTER:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES)
+        app = create_app(application, WEBHOOK_PATH, WEBHOOK_SECRET)
+    else:
+        await application.updater.start_polling()
+        app = create_app()
+
+    runner = await keep_alive(app)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        await post_stop(application)
+        await application.shutdown()
+        await post_shutdown(application)
 
 
 # Función principal
@@ -435,18 +816,28 @@ def main():
             "❌ FALTA EL TOKEN DE TELEGRAM. Configúralo como variable de entorno."
         )
 
-    application = Application.builder().token(TOKEN).build()
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(button_handler))
-    application.add_error_handler(error_handler)
+    webhook = RUN_MODE == 'webhook'
+    if webhook and not WEBHOOK_URL:
+        raise ValueError(
+            "❌ RUN_MODE=webhook requiere WEBHOOK_URL (URL pública del bot).")
+
+    # Misma configuración de conexiones que la predeterminada de PTB, con la
+    # latencia de cada llamada a la Bot API medida
+    request = metrics.InstrumentedRequest(
+        HTTPXRequest(connection_pool_size=256))
+    builder = (Application.builder().token(TOKEN).request(request)
+               .concurrent_updates(UserOrderedUpdateProcessor(UPDATE_WORKERS)))
+    if webhook:
+        # Las actualizaciones llegan por HTTP: no hace falta el Updater
+        builder = builder.updater(None)
+    application = builder.build()
+    register_handlers(application)
 
-    print("🚀 Bot iniciado. Listo para vender!")
-    application.run_polling()
+    print(f"🚀 Bot iniciado en modo {'webhook' if webhook else 'polling'}. "
+          f"Listo para vender!")
+    asyncio.run(serve(application, webhook))
 
 
 # Ejecución principal
 if __name__ == '__main__':
-    keep_alive_thread = Thread(target=keep_alive)
-    keep_alive_thread.daemon = True
-    keep_alive_thread.start()
-    main()
\ No newline at end of file
+    main()
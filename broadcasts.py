@@ -0,0 +1,284 @@
+# broadcasts.py
+#
+# Difusión de anuncios a todos los usuarios (/broadcast). Los destinatarios
+# se leen por páginas de BROADCAST_PAGE_SIZE con un cursor sobre user_id,
+# así que la memoria no depende del número de usuarios. Los envíos pasan por
+# un planificador con BROADCAST_CONCURRENCY envíos en vuelo y un token
+# bucket de BROADCAST_RATE mensajes por segundo (por debajo del límite
+# global de Telegram, para dejar margen a las respuestas a los compradores);
+# un RetryAfter pausa toda la difusión el tiempo que pide Telegram.
+#
+# Tras cada página se guarda el cursor y los contadores en la tabla
+# broadcasts: si el proceso se detiene, la difusión se reanuda desde ahí (al
+# apagar o ante un error inesperado se guarda además lo ya enviado de la
+# página en curso). Los usuarios que bloquearon el bot o borraron su cuenta
+# se marcan y las difusiones siguientes los saltan.
+#
+# La difusión la envía un único proceso: el que la toma renueva una
+# concesión (lease) en cada página y, si deja de hacerlo, otro proceso la
+# retoma en la siguiente revisión.
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+import metrics
+import notifications
+import repository
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "200"))
+# Segundos sin renovar la concesión tras los que otro proceso la retoma
+BROADCAST_LEASE = float(os.getenv("BROADCAST_LEASE", "120"))
+
+_MAX_ATTEMPTS = 3
+_MAX_BACKOFF = 30
+# Revisión periódica de difusiones pendientes (reanudación)
+_IDLE_POLL = 60
+
+# Resultado de cada envío
+SENT = 'sent'
+FAILED = 'failed'
+BLOCKED = 'blocked'
+
+
+def _seconds(value) -> float:
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+def _is_unreachable(exc: BadRequest) -> bool:
+    """Errores 400 que significan que el chat ya no existe."""
+    message = exc.message.lower()
+    return 'chat not found' in message or 'user is deactivated' in message
+
+
+class BroadcastEngine:
+
+    def __init__(self, bot, owner: str):
+        self.bot = bot
+        self.owner = owner
+        self._bucket = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+        self._slots = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        self._resume_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                now = time.time()
+                row = await repository.claim_broadcast(
+                    self.owner, now, now + BROADCAST_LEASE)
+                if row is not None:
+                    await self._broadcast(*row)
+                    continue
+            except Exception:
+                logger.exception("Error en la difusión")
+            # Como en notifications.py: wait_for podría tragarse la
+            # cancelación de stop()
+            wakeup = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait((wakeup,), timeout=_IDLE_POLL)
+            finally:
+                wakeup.cancel()
+
+    async def _broadcast(self, broadcast_id, text, status, cursor, total,
+                         sent, failed, blocked, created_by, created_at,
+                         updated_at):
+        counts = [sent, failed, blocked]
+        if cursor:
+            logger.info("Reanudando la difusión %s desde el usuario %s",
+                        broadcast_id, cursor)
+        while True:
+            user_ids = await repository.users_after(cursor,
+                                                    BROADCAST_PAGE_SIZE)
+            if not user_ids:
+                break
+            outcomes = [None] * len(user_ids)
+            try:
+                results = await asyncio.gather(*(
+                    self._deliver(outcomes, i, user_id, text)
+                    for i, user_id in enumerate(user_ids)),
+                    return_exceptions=True)
+            except asyncio.CancelledError:
+                await self._checkpoint_prefix(broadcast_id, user_ids,
+                                              outcomes, counts)
+                raise
+            error = next((result for result in results
+                          if isinstance(result, BaseException)), None)
+            if error is not None:
+                # Cliente HTTP cerrado, por ejemplo: se guarda lo enviado y
+                # se reintenta en la próxima revisión
+                await self._checkpoint_prefix(broadcast_id, user_ids,
+                                              outcomes, counts)
+                raise error
+
+            cursor = user_ids[-1]
+            if not await self._checkpoint(broadcast_id, user_ids, outcomes,
+                                          counts):
+                logger.info("Difusión %s cancelada o tomada por otro proceso",
+                            broadcast_id)
+                return
+
+        now = time.time()
+        if await repository.checkpoint_broadcast(
+                broadcast_id, self.owner, cursor, tuple(counts), now, None,
+                'done'):
+            sent, failed, blocked = counts
+            logger.info("Difusión %s terminada: %s enviados, %s fallidos, "
+                        "%s bloqueados", broadcast_id, sent, failed, blocked)
+            await notifications.notify(
+                [created_by],
+                f"📣 Difusión #{broadcast_id} terminada.\n"
+                f"✅ Enviados: {sent}\n🚫 Bloqueados: {blocked}\n"
+                f"⚠️ Fallidos: {failed}")
+
+    async def _checkpoint(self, broadcast_id: int, user_ids: list,
+                          outcomes: list, counts: list) -> bool:
+        newly_blocked = [user_id for user_id, outcome in zip(user_ids,
+                                                             outcomes)
+                         if outcome == BLOCKED]
+        for index, kind in enumerate((SENT, FAILED, BLOCKED)):
+            counts[index] += outcomes.count(kind)
+        now = time.time()
+        if newly_blocked:
+            await repository.mark_blocked(newly_blocked, now)
+        return await repository.checkpoint_broadcast(
+            broadcast_id, self.owner, user_ids[-1], tuple(counts), now,
+            now + BROADCAST_LEASE)
+
+    async def _checkpoint_prefix(self, broadcast_id: int, user_ids: list,
+                                 outcomes: list, counts: list):
+        """Página interrumpida (apagado o error): guarda lo enviado hasta el
+        primer hueco para no repetirlo al reanudar."""
+        done = next((i for i, outcome in enumerate(outcomes)
+                     if outcome is None), len(outcomes))
+        if done:
+            await self._checkpoint(broadcast_id, user_ids[:done],
+                                   outcomes[:done], counts)
+
+    async def _deliver(self, outcomes: list, index: int, chat_id: int,
+                       text: str):
+        outcome = await self._send(chat_id, text)
+        outcomes[index] = outcome
+        if outcome == SENT:
+            self.sent += 1
+        elif outcome == BLOCKED:
+            self.blocked += 1
+        else:
+            self.failed += 1
+
+    async def _send(self, chat_id: int, text: str) -> str:
+        attempts = 0
+        while True:
+            async with self._slots:
+                # Pausa global tras un RetryAfter de Telegram
+                delay = self._resume_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self._bucket.acquire()
+                try:
+                    await self.bot.send_message(chat_id=chat_id, text=text)
+                    return SENT
+                except RetryAfter as exc:
+                    # No cuenta como intento fallido
+                    self._resume_at = max(
+                        self._resume_at,
+                        time.monotonic() + _seconds(exc.retry_after))
+                    continue
+                except Forbidden:
+                    return BLOCKED
+                except BadRequest as exc:
+                    if _is_unreachable(exc):
+                        return BLOCKED
+                    logger.warning("Difusión a %s descartada: %s", chat_id,
+                                   exc)
+                    return FAILED
+                except TelegramError as exc:
+                    attempts += 1
+                    if attempts >= _MAX_ATTEMPTS:
+                        logger.warning("Difusión a %s descartada tras %s "
+                                       "intentos: %s", chat_id, attempts, exc)
+                        return FAILED
+            # La espera entre intentos no ocupa un hueco de envío
+            await asyncio.sleep(min(2 ** attempts, _MAX_BACKOFF))
+
+
+_engine = None
+
+
+def start_engine(bot):
+    """Arranca el motor de difusiones y reanuda la que estuviera en curso."""
+    global _engine
+    if _engine is None:
+        _engine = BroadcastEngine(bot, f"{socket.gethostname()}:{os.getpid()}")
+        _engine.start()
+        metrics.register_counter('bot_broadcast_sent_total',
+                                 'Mensajes de difusión entregados',
+                                 lambda: _engine.sent if _engine else 0)
+        metrics.register_counter('bot_broadcast_blocked_total',
+                                 'Destinatarios que bloquearon el bot',
+                                 lambda: _engine.blocked if _engine else 0)
+        metrics.register_counter('bot_broadcast_failed_total',
+                                 'Mensajes de difusión descartados',
+                                 lambda: _engine.failed if _engine else 0)
+
+
+async def stop_engine():
+    """Detiene el envío guardando el progreso; se reanuda al arrancar."""
+    global _engine
+    if _engine is not None:
+        await _engine.stop()
+        _engine = None
+
+
+async def create(text: str, created_by: int):
+    """Crea una difusión y despierta al motor. Devuelve (id, destinatarios)
+    o None si ya hay una en curso."""
+    total = await repository.count_users()
+    broadcast_id = await repository.create_broadcast(text, total, created_by,
+                                                     time.time())
+    if broadcast_id is None:
+        return None
+    if _engine is not None:
+        _engine.wake()
+    return broadcast_id, total
+
+
+async def cancel():
+    """Cancela la difusión en curso; devuelve su id o None."""
+    return await repository.cancel_broadcast(time.time())
+
+
+async def latest():
+    return await repository.latest_broadcast()
@@ -0,0 +1,108 @@
+# callbacks.py
+#
+# Tabla de rutas de los botones inline. Cada callback_data tiene la forma
+# compacta "<ruta>:<arg>:<arg>..." (Telegram limita a 64 bytes); la ruta se
+# busca en un diccionario y los argumentos se convierten una sola vez a los
+# tipos declarados al registrarla, antes de llamar al handler.
+#
+# Los últimos `optional` argumentos se pueden omitir (el handler usa sus
+# valores por defecto), lo que mantiene funcionando los botones de mensajes
+# antiguos cuando una ruta gana parámetros nuevos.
+
+import logging
+import time
+
+import metrics
+import tap_guard
+
+logger = logging.getLogger(__name__)
+
+# Longitud máxima de callback_data que acepta Telegram
+MAX_CALLBACK_BYTES = 64
+
+CALLBACK_LATENCY = metrics.histogram(
+    'bot_callback_seconds', 'Latencia de los botones inline por ruta', 'route')
+
+# ruta -> (handler, tipos de los argumentos, mínimo de argumentos)
+_routes = {}
+
+stats = {'unknown': 0, 'invalid': 0}
+
+
+def route(name: str, *arg_types, optional: int = 0):
+    """Registra un handler `async (update, context, *args)` para la ruta `name`."""
+    def register(handler):
+        _routes[name] = (handler, arg_types, len(arg_types) - optional)
+        return handler
+    return register
+
+
+def encode(name: str, *args) -> str:
+    """Construye el callback_data de una ruta."""
+    data = ':'.join((name,) + tuple(str(arg) for arg in args))
+    if len(data.encode('utf-8')) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"callback_data demasiado largo: {data!r}")
+    return data
+
+
+def decode(data: str):
+    """Devuelve (ruta, handler, args) o None si la ruta no existe o los
+    argumentos no son válidos."""
+    name, *raw = (data or '').split(':')
+    entry = _routes.get(name)
+    if entry is None:
+        stats['unknown'] += 1
+        return None
+    handler, arg_types, required = entry
+    if not required <= len(raw) <= len(arg_types):
+        stats['invalid'] += 1
+        return None
+    try:
+        args = tuple(kind(value) for kind, value in zip(arg_types, raw))
+    except ValueError:
+        stats['invalid'] += 1
+        return None
+    return name, handler, args
+
+
+def route_name(data: str) -> str:
+    """Ruta registrada de un callback_data o 'unknown' (cardinalidad acotada)."""
+    name = (data or '').split(':', 1)[0]
+    return name if name in _routes else 'unknown'
+
+
+async def dispatch(update, context):
+    """Handler de CallbackQueryHandler: filtra con tap_guard, decodifica y
+    llama a la ruta."""
+    query = update.callback_query
+    verdict = tap_guard.admit(query.from_user.id, query.data,
+                              tap_guard.message_key(query))
+    if verdict != tap_guard.ALLOW:
+        # Taps repetidos o demasiado rápidos: no se ejecuta el handler, pero
+        # cada tap se responde (vacío o, al empezar la racha, con un aviso)
+        # para que el cliente no muestre el reloj de carga hasta que
+        # Telegram lo dé por caducado
+        if verdict == tap_guard.THROTTLED_NOTICE:
+            await query.answer("⏳ Vas muy rápido. Espera un momento.")
+        else:
+            await query.answer()
+        return
+
+    decoded = decode(query.data)
+    if decoded is None:
+        # Botón de una versión anterior del bot o datos manipulados: se
+        # responde para quitar el reloj de carga del cliente
+        logger.debug("Callback desconocido: %r", query.data)
+        await query.answer("Este botón ya no es válido. Usa /start.")
+        return
+
+    name, handler, args = decoded
+    if not metrics.ENABLED:
+        await handler(update, context, *args)
+        return
+
+    start = time.perf_counter()
+    try:
+        await handler(update, context, *args)
+    finally:
+        CALLBACK_LATENCY.observe(name, time.perf_counter() - start)
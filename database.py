@@ -0,0 +1,129 @@
+# database.py
+#
+# Pool de conexiones SQLite de larga duración: una conexión por hilo,
+# reutilizada entre llamadas, con modo WAL y pragmas ajustables desde el
+# entorno. El módulo sqlite3 cachea las sentencias preparadas por conexión,
+# así que mantener la conexión viva es lo que permite reutilizarlas.
+
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from products.load_products import DB_PATH
+
+# Configuración (variables de entorno)
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+_local = threading.local()
+_lock = threading.Lock()
+_connections = []
+_generation = 0
+
+# Contadores para diagnóstico. 'statements' solo avanza mientras
+# count_statements(True) esté activo (benchmarks)
+stats = {'connections_opened': 0, 'statements': 0}
+_counting = False
+
+
+def _on_statement(sql: str):
+    with _lock:
+        stats['statements'] += 1
+
+
+STATEMENT_LATENCY = metrics.histogram(
+    'bot_db_statement_seconds',
+    'Duración de execute/executemany en el pool por tipo de sentencia',
+    'op')
+
+
+def _operation(sql: str) -> str:
+    word = sql.lstrip().split(None, 1)
+    return word[0].lower() if word else 'empty'
+
+
+class _InstrumentedConnection(sqlite3.Connection):
+    """Conexión que mide cada execute/executemany si las métricas están activas.
+
+    Solo cuenta el paso inicial de la sentencia; las filas que se lean
+    después con fetch* no se incluyen.
+    """
+
+    def execute(self, sql, parameters=()):
+        if not metrics.ENABLED:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            STATEMENT_LATENCY.observe(_operation(sql),
+                                      time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        if not metrics.ENABLED:
+            return super().executemany(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            STATEMENT_LATENCY.observe(_operation(sql),
+                                      time.perf_counter() - start)
+
+
+def _connect() -> sqlite3.Connection:
+    # check_same_thread=False solo para poder cerrarlas desde close_all();
+    # cada conexión se usa exclusivamente desde el hilo que la creó.
+    conn = sqlite3.connect(DB_PATH,
+                           timeout=DB_BUSY_TIMEOUT,
+                           cached_statements=DB_STATEMENT_CACHE,
+                           check_same_thread=False,
+                           factory=_InstrumentedConnection)
+    conn.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    if _counting:
+        conn.set_trace_callback(_on_statement)
+
+    with _lock:
+        _connections.append(conn)
+        stats['connections_opened'] += 1
+    return conn
+
+
+def get_db() -> sqlite3.Connection:
+    """Devuelve la conexión del hilo actual, creándola la primera vez.
+
+    No se debe cerrar: usar `with conn:` para confirmar o deshacer la
+    transacción.
+    """
+    if getattr(_local, 'generation', None) != _generation:
+        _local.conn = _connect()
+        _local.generation = _generation
+    return _local.conn
+
+
+def count_statements(enabled: bool):
+    """Activa o desactiva el conteo de sentencias SQL en todas las conexiones."""
+    global _counting
+    with _lock:
+        _counting = enabled
+        for conn in _connections:
+            conn.set_trace_callback(_on_statement if enabled else None)
+
+
+def close_all():
+    """Cierra todas las conexiones del pool (al apagar el bot)."""
+    global _generation
+    with _lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+        _generation += 1
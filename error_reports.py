@@ -0,0 +1,192 @@
+# error_reports.py
+#
+# Agregación de errores. En lugar de un mensaje al administrador por cada
+# excepción, los errores se agrupan por huella (tipo de excepción + handler
+# donde ocurrió) y se cuentan; cada ERROR_DIGEST_INTERVAL segundos se envía
+# un único resumen por la bandeja de salida de notifications.
+#
+# La traza completa de cada error va a un log rotativo local
+# (ERROR_LOG_FILE); la agregación solo afecta al resumen de Telegram y a la
+# consola, que muestra una línea por huella e intervalo. La escritura la hace
+# un hilo aparte (QueueHandler/QueueListener), así que registrar un error
+# desde un handler es O(1) y nunca bloquea el event loop.
+
+import asyncio
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+import metrics
+import notifications
+
+logger = logging.getLogger(__name__)
+
+ERROR_DIGEST_INTERVAL = float(os.getenv("ERROR_DIGEST_INTERVAL", "300"))
+ERROR_LOG_FILE = os.getenv(
+    "ERROR_LOG_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs',
+                 'errors.log'))
+ERROR_LOG_MAX_BYTES = int(os.getenv("ERROR_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+ERROR_LOG_BACKUPS = int(os.getenv("ERROR_LOG_BACKUPS", "5"))
+
+# Huellas distintas por intervalo; el resto se cuenta junto
+_MAX_FINGERPRINTS = 100
+# Líneas del resumen (Telegram admite 4096 caracteres por mensaje)
+_DIGEST_LINES = 15
+_MAX_MESSAGE = 4000
+
+# Logger que solo escribe en el archivo rotativo (no en la consola)
+_trace_logger = logging.getLogger('bot.errors')
+_trace_logger.propagate = False
+
+
+class ErrorAggregator:
+    """Cuenta errores por huella dentro de la ventana actual."""
+
+    def __init__(self):
+        # huella -> [veces, primera vez, última vez, mensaje de ejemplo]
+        self._window = {}
+        self.window_start = time.time()
+        self.total = 0
+
+    def record(self, error: BaseException, where: str) -> bool:
+        """Cuenta el error; devuelve True si es la primera vez en la ventana."""
+        self.total += 1
+        now = time.time()
+        fingerprint = (type(error).__name__, where)
+        entry = self._window.get(fingerprint)
+        if entry is not None:
+            entry[0] += 1
+            entry[2] = now
+            return False
+
+        if len(self._window) >= _MAX_FINGERPRINTS:
+            fingerprint = ('otros', '*')
+            entry = self._window.get(fingerprint)
+            if entry is not None:
+                entry[0] += 1
+                entry[2] = now
+                return False
+        self._window[fingerprint] = [1, now, now, str(error)[:200]]
+        return True
+
+    def take_window(self) -> tuple:
+        """Devuelve (inicio, {huella: datos}) y abre una ventana nueva."""
+        window, start = self._window, self.window_start
+        self._window = {}
+        self.window_start = time.time()
+        return start, window
+
+    def restore_window(self, start: float, window: dict):
+        """Reincorpora una ventana cuyo resumen no se pudo guardar."""
+        for fingerprint, (count, first, last, sample) in window.items():
+            entry = self._window.get(fingerprint)
+            if entry is None:
+                self._window[fingerprint] = [count, first, last, sample]
+            else:
+                entry[0] += count
+                entry[1] = min(entry[1], first)
+        self.window_start = min(self.window_start, start)
+
+
+def format_digest(start: float, window: dict) -> str:
+    total = sum(entry[0] for entry in window.values())
+    since = time.strftime('%H:%M', time.localtime(start))
+    lines = [f"⚠️ {total} errores desde las {since} "
+             f"({len(window)} distintos):", ""]
+    ranked = sorted(window.items(), key=lambda item: item[1][0], reverse=True)
+    for (error_type, where), (count, _, last, sample) in ranked[:_DIGEST_LINES]:
+        when = time.strftime('%H:%M:%S', time.localtime(last))
+        lines.append(f"• {count}× {error_type} en {where} (última {when})")
+        if sample:
+            lines.append(f"   {sample}")
+    if len(ranked) > _DIGEST_LINES:
+        lines.append(f"… y {len(ranked) - _DIGEST_LINES} tipos más.")
+    lines.append("")
+    lines.append(f"Trazas completas en {os.path.basename(ERROR_LOG_FILE)}.")
+    return "\n".join(lines)[:_MAX_MESSAGE]
+
+
+aggregator = ErrorAggregator()
+_admin_ids = []
+_task = None
+_listener = None
+
+
+def _start_trace_log():
+    global _listener
+    os.makedirs(os.path.dirname(ERROR_LOG_FILE), exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        ERROR_LOG_FILE, maxBytes=ERROR_LOG_MAX_BYTES,
+        backupCount=ERROR_LOG_BACKUPS, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(
+        '%(asctime)s - %(levelname)s - %(message)s'))
+    records = queue.SimpleQueue()
+    _trace_logger.addHandler(logging.handlers.QueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, file_handler)
+    _listener.start()
+
+
+def record(error: BaseException, where: str):
+    """Registra un error (O(1), no bloquea). Se puede llamar desde cualquier
+    handler; si el agregador no está arrancado solo se cuenta."""
+    if aggregator.record(error, where):
+        # Primera vez en la ventana: una línea en la consola
+        logger.error("%s en %s: %s", type(error).__name__, where, error)
+    if _listener is not None:
+        # La traza completa va siempre al archivo
+        _trace_logger.error("%s en %s", type(error).__name__, where,
+                            exc_info=(type(error), error,
+                                      error.__traceback__))
+
+
+async def send_digest() -> bool:
+    """Envía el resumen de la ventana actual si hubo errores."""
+    start, window = aggregator.take_window()
+    if not window:
+        return False
+    try:
+        await notifications.notify(_admin_ids, format_digest(start, window))
+    except Exception:
+        # Base de datos caída, por ejemplo: se reintenta en el próximo ciclo
+        aggregator.restore_window(start, window)
+        logger.exception("No se pudo guardar el resumen de errores")
+        return False
+    return True
+
+
+async def _digest_loop():
+    while True:
+        await asyncio.sleep(ERROR_DIGEST_INTERVAL)
+        await send_digest()
+
+
+def start_reporter(admin_ids):
+    """Arranca el log de trazas y el envío periódico de resúmenes."""
+    global _task, _admin_ids
+    _admin_ids = list(admin_ids)
+    if _task is None:
+        _start_trace_log()
+        _task = asyncio.get_running_loop().create_task(_digest_loop())
+        metrics.register_counter('bot_errors_total',
+                                 'Excepciones en handlers desde el arranque',
+                                 lambda: aggregator.total)
+
+
+async def stop_reporter():
+    """Envía el último resumen y cierra el log de trazas."""
+    global _task, _listener
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        await send_digest()
+    if _listener is not None:
+        _listener.stop()
+        _trace_logger.handlers.clear()
+        _listener = None
@@ -0,0 +1,153 @@
+# inventory.py
+#
+# Existencias de claves digitales (códigos, cuentas...) por producto. Los
+# productos con claves importadas se entregan solos al confirmar el pago;
+# el resto sigue entregándose a mano.
+#
+# La reserva de claves ocurre al guardar el pedido (repository.insert_orders)
+# y es la única fuente de verdad. Aquí solo se guarda una copia en memoria
+# de las claves libres para los botones del catálogo y para rechazar en el
+# acto lo que ya está agotado; se actualiza tras cada lote de pedidos y
+# cada INVENTORY_REFRESH_INTERVAL segundos (compras de otros procesos).
+#
+# Importar claves: /claves <sku> en el bot o
+#   python -m inventory claves.csv            (columnas sku,code)
+#   python -m inventory claves.txt --sku SKU  (un código por línea)
+
+import argparse
+import asyncio
+import csv
+import logging
+import os
+import time
+
+import repository
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_REFRESH_INTERVAL = float(
+    os.getenv("INVENTORY_REFRESH_INTERVAL", "30"))
+
+# product_id -> claves libres (solo productos con claves)
+_counts = {}
+# Cambia cuando cambian los contadores (claves de la caché de render)
+version = 0
+
+_task = None
+
+
+def available(product_id: int):
+    """Claves libres de un producto o None si se entrega a mano."""
+    return _counts.get(product_id)
+
+
+def stocked(product_ids) -> tuple:
+    """Los product_ids que se entregan con claves del stock."""
+    return tuple(product_id for product_id in product_ids
+                 if product_id in _counts)
+
+
+async def refresh(product_ids=None) -> bool:
+    """Vuelve a leer las claves libres (de todos o de algunos productos).
+
+    Devuelve True si cambió algún contador.
+    """
+    global _counts, version
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return False
+    counts = await repository.stock_counts(product_ids)
+    if product_ids is None:
+        updated = counts
+    else:
+        updated = dict(_counts)
+        updated.update(counts)
+    if updated == _counts:
+        return False
+    _counts = updated
+    version += 1
+    return True
+
+
+async def import_keys(rows) -> dict:
+    """Añade claves [(sku, código), ...] al stock.
+
+    Devuelve {'added': nuevas, 'duplicates': repetidas, 'unknown': [skus]}.
+    """
+    rows = [(sku.strip(), code.strip()) for sku, code in rows
+            if sku and sku.strip() and code and code.strip()]
+    ids = await repository.product_ids_by_sku({sku for sku, _ in rows})
+    known = [(ids[sku], code) for sku, code in rows if sku in ids]
+    added = await repository.import_keys(known, time.time()) if known else 0
+    await refresh(set(ids.values()))
+    logger.info("Importadas %s claves nuevas", added)
+    return {'added': added, 'duplicates': len(known) - added,
+            'unknown': sorted({sku for sku, _ in rows if sku not in ids})}
+
+
+def read_keys_file(path: str, sku: str = None) -> list:
+    """Lee un CSV con columnas sku,code o, con `sku`, un código por línea."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if sku is not None:
+            return [(sku, line.strip()) for line in f if line.strip()]
+        return [(row.get('sku'), row.get('code')) for row in csv.DictReader(f)]
+
+
+async def _poll():
+    while True:
+        await asyncio.sleep(INVENTORY_REFRESH_INTERVAL)
+        try:
+            await refresh()
+        except Exception:
+            logger.exception("No se pudieron actualizar las existencias")
+
+
+async def start_refresher():
+    """Carga los contadores y lanza su recarga periódica."""
+    global _task
+    if _task is None:
+        await refresh()
+        _task = asyncio.get_running_loop().create_task(_poll())
+
+
+async def stop_refresher():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+async def _import_file(path: str, sku: str) -> dict:
+    try:
+        return await import_keys(read_keys_file(path, sku))
+    finally:
+        await repository.close_store()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Importa claves de producto al stock.")
+    parser.add_argument('path', help="CSV sku,code o texto con un código "
+                                     "por línea")
+    parser.add_argument('--sku', help="sku de todos los códigos del archivo")
+    args = parser.parse_args()
+
+    from products.load_products import create_tables
+    create_tables()
+    try:
+        result = asyncio.run(_import_file(args.path, args.sku))
+    finally:
+        repository.shutdown()
+    print(f"🔑 {result['added']} claves nuevas, {result['duplicates']} "
+          f"repetidas.")
+    if result['unknown']:
+        print(f"⚠️ SKU desconocidos: {', '.join(result['unknown'])}")
+
+
+if __name__ == '__main__':
+    main()
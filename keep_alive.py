@@ -1,16 +1,69 @@
 # keep_alive.py
-from flask import Flask
-from threading import Thread
+#
+# Servidor HTTP asíncrono (aiohttp) que corre en el mismo event loop que el
+# bot. Siempre responde la ruta de salud '/' y las métricas en '/metrics';
+# en modo webhook además recibe las actualizaciones de Telegram y las encola
+# en la Application.
 
-app = Flask('')
+import os
 
-@app.route('/')
-def home():
-    return "¡Mi bot de Telegram está vivo! 🚀"
+from aiohttp import web
+from telegram import Update
 
-def run():
-    app.run(host='0.0.0.0', port=8080)
+import metrics
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
\ No newline at end of file
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
+
+# Cabecera con la que Telegram envía el secret_token del webhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+async def home(request: web.Request) -> web.Response:
+    return web.Response(text="¡Mi bot de Telegram está vivo! 🚀")
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(),
+                        content_type='text/plain', charset='utf-8')
+
+
+async def telegram_webhook(request: web.Request) -> web.Response:
+    application = request.app['application']
+    secret = request.app['secret_token']
+    if secret and request.headers.get(SECRET_HEADER) != secret:
+        return web.Response(status=403)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+
+    # Se responde en cuanto la actualización está en cola; la Application
+    # la procesa en segundo plano
+    await application.update_queue.put(Update.de_json(data, application.bot))
+    return web.Response()
+
+
+def create_app(application=None, webhook_path: str = None,
+               secret_token: str = None) -> web.Application:
+    """Crea la aplicación aiohttp con la ruta de salud, las métricas y, si se
+    pasa una Application de telegram, la ruta del webhook."""
+    app = web.Application()
+    app.router.add_get('/', home)
+    app.router.add_get('/metrics', metrics_endpoint)
+    if application is not None:
+        app['application'] = application
+        app['secret_token'] = secret_token
+        app.router.add_post(webhook_path, telegram_webhook)
+    return app
+
+
+async def keep_alive(app: web.Application, host: str = HOST,
+                     port: int = PORT) -> web.AppRunner:
+    """Arranca el servidor dentro del event loop actual. Devuelve el runner
+    para poder detenerlo con `await runner.cleanup()`."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
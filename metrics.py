@@ -0,0 +1,161 @@
+# metrics.py
+#
+# Registro mínimo de métricas en formato de texto de Prometheus. Los
+# módulos registran funciones que devuelven el valor actual (gauges y
+# contadores) o crean histogramas que alimentan desde el camino caliente; el
+# servidor HTTP las publica en /metrics.
+#
+# La instrumentación del camino caliente se puede apagar en tiempo de
+# ejecución con set_enabled(False) (o METRICS_ENABLED=0): cada punto de
+# medida comprueba `metrics.ENABLED` antes de tomar tiempos, así que
+# apagada cuesta una lectura de atributo.
+
+import bisect
+import os
+import threading
+import time
+
+from telegram.request import BaseRequest
+
+ENABLED = os.getenv("METRICS_ENABLED", "1").strip().lower() not in (
+    "0", "false", "no", "off")
+
+# Límites (segundos) de los cubos de latencia
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+_gauges = {}
+_counters = {}
+_histograms = {}
+
+
+def set_enabled(enabled: bool):
+    """Activa o desactiva la instrumentación del camino caliente."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def register_gauge(name: str, help_text: str, func):
+    """Registra una métrica cuyo valor se obtiene llamando a `func()`."""
+    _gauges[name] = (help_text, func)
+
+
+def register_counter(name: str, help_text: str, func):
+    """Como register_gauge, para valores que solo crecen (aciertos, envíos...)."""
+    _counters[name] = (help_text, func)
+
+
+class Histogram:
+    """Histograma acumulado con una etiqueta (p. ej. la ruta o la operación).
+
+    Se puede observar desde cualquier hilo (los del pool de la base de datos
+    incluidos).
+    """
+
+    def __init__(self, name: str, help_text: str, label: str,
+                 buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        # valor de la etiqueta -> [cuentas por cubo..., suma, total]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (
+                    len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, label_value: str = None) -> int:
+        """Observaciones de una etiqueta (o de todas)."""
+        with self._lock:
+            if label_value is not None:
+                series = self._series.get(label_value)
+                return series[-1] if series else 0
+            return sum(series[-1] for series in self._series.values())
+
+    def render(self, lines: list):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        with self._lock:
+            snapshot = {key: list(series)
+                        for key, series in sorted(self._series.items())}
+        for label_value, series in snapshot.items():
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(
+                f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{label}}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{label}}} {series[-1]}')
+
+
+def histogram(name: str, help_text: str, label: str,
+              buckets=LATENCY_BUCKETS) -> Histogram:
+    """Devuelve el histograma `name`, creándolo la primera vez."""
+    if name not in _histograms:
+        _histograms[name] = Histogram(name, help_text, label, buckets)
+    return _histograms[name]
+
+
+def render() -> str:
+    lines = []
+    for kind, registry in (('gauge', _gauges), ('counter', _counters)):
+        for name, (help_text, func) in registry.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {func()}")
+    for hist in _histograms.values():
+        hist.render(lines)
+    return "\n".join(lines) + "\n"
+
+
+# --- Latencia de la Bot API ---
+
+API_LATENCY = histogram('bot_telegram_api_seconds',
+                        'Latencia de las llamadas a la Bot API por método',
+                        'method')
+
+
+class InstrumentedRequest(BaseRequest):
+    """Envuelve otra BaseRequest (HTTPXRequest, la falsa de los benchmarks...)
+    y mide la latencia de cada llamada a la Bot API."""
+
+    def __init__(self, inner: BaseRequest):
+        self._inner = inner
+
+    @property
+    def read_timeout(self):
+        return self._inner.read_timeout
+
+    async def initialize(self):
+        await self._inner.initialize()
+
+    async def shutdown(self):
+        await self._inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None,
+                         read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if not ENABLED:
+            return await self._inner.do_request(
+                url, method, request_data, read_timeout, write_timeout,
+                connect_timeout, pool_timeout)
+        start = time.perf_counter()
+        try:
+            return await self._inner.do_request(
+                url, method, request_data, read_timeout, write_timeout,
+                connect_timeout, pool_timeout)
+        finally:
+            API_LATENCY.observe(url.rsplit('/', 1)[-1],
+                                time.perf_counter() - start)
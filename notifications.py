@@ -0,0 +1,200 @@
+# notifications.py
+#
+# Envío de avisos a administradores en segundo plano. Los avisos se guardan
+# primero en la tabla outbox (sobreviven a reinicios) y un despachador los
+# entrega en paralelo respetando los límites de Telegram, con reintentos y
+# espera exponencial.
+#
+# Cada worker tiene su despachador sobre la misma bandeja: antes de enviar
+# un lote lo reclama (owner/lease_until) en una sola sentencia, así que
+# ningún aviso sale dos veces. Si un proceso muere con avisos reclamados,
+# otro los retoma al vencer NOTIFY_LEASE.
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+import metrics
+import repository
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Mensajes por segundo en total y por chat
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", "25"))
+NOTIFY_CHAT_RATE = float(os.getenv("NOTIFY_CHAT_RATE", "1"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+# Segundos que un lote reclamado queda reservado para este proceso (más de
+# lo que tarda en enviarse un lote a un solo chat)
+NOTIFY_LEASE = float(os.getenv("NOTIFY_LEASE", "300"))
+
+_BATCH_SIZE = 50
+_CHAT_BURST = 3
+_MAX_BACKOFF = 300
+# Revisión periódica de la bandeja aunque nadie avise
+_IDLE_POLL = 30
+
+
+def _seconds(value) -> float:
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class NotificationDispatcher:
+
+    def __init__(self, bot, owner: str):
+        self.bot = bot
+        self.owner = owner
+        self._global = TokenBucket(NOTIFY_RATE, NOTIFY_RATE)
+        self._chats = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                delay = await self._drain()
+            except Exception:
+                logger.exception("Error despachando avisos")
+                delay = _IDLE_POLL
+            # asyncio.wait y no wait_for: antes de Python 3.12, wait_for se
+            # traga la cancelación si el evento llega a la vez y stop() no
+            # terminaría nunca
+            wakeup = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait((wakeup,), timeout=delay)
+            finally:
+                wakeup.cancel()
+
+    async def _drain(self) -> float:
+        """Entrega todo lo pendiente y devuelve cuánto esperar hasta el próximo."""
+        while True:
+            now = time.time()
+            rows = await repository.claim_notices(
+                self.owner, now, now + NOTIFY_LEASE, _BATCH_SIZE)
+            if not rows:
+                next_time = await repository.next_notice_time()
+                if next_time is None:
+                    return _IDLE_POLL
+                return min(max(next_time - now, 0), _IDLE_POLL)
+
+            tasks = [asyncio.ensure_future(self._deliver(*row))
+                     for row in rows]
+            try:
+                await asyncio.wait(tasks)
+            finally:
+                # Apagado o error a mitad de lote: se guardan los avisos ya
+                # entregados para no repetirlos y el resto se libera para
+                # que lo envíe este u otro proceso sin esperar a la concesión
+                for task in tasks:
+                    task.cancel()
+                delivered, retries = [], []
+                for (notice_id, _, _, attempts), task in zip(rows, tasks):
+                    if (not task.done() or task.cancelled()
+                            or task.exception() is not None):
+                        retries.append((attempts, time.time(), 'pending',
+                                        notice_id))
+                    elif task.result() is None:
+                        delivered.append(notice_id)
+                    else:
+                        retries.append(task.result())
+                await repository.settle_notices(self.owner, delivered,
+                                                retries)
+            for task in tasks:
+                if task.exception() is not None:
+                    raise task.exception()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(NOTIFY_CHAT_RATE,
+                                                        _CHAT_BURST)
+        return bucket
+
+    async def _deliver(self, notice_id: int, chat_id: int, text: str,
+                       attempts: int):
+        """Envía un aviso. Devuelve None si se entregó o la fila de reintento."""
+        await self._chat_bucket(chat_id).acquire()
+        await self._global.acquire()
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text)
+        except RetryAfter as exc:
+            # Límite de Telegram: no cuenta como intento fallido
+            return (attempts, time.time() + _seconds(exc.retry_after),
+                    'pending', notice_id)
+        except (Forbidden, BadRequest) as exc:
+            logger.error("Aviso %s a %s descartado: %s", notice_id, chat_id,
+                         exc)
+            self.failed += 1
+            return attempts + 1, time.time(), 'failed', notice_id
+        except TelegramError as exc:
+            attempts += 1
+            if attempts >= NOTIFY_MAX_ATTEMPTS:
+                logger.error("Aviso %s a %s descartado tras %s intentos: %s",
+                             notice_id, chat_id, attempts, exc)
+                self.failed += 1
+                return attempts, time.time(), 'failed', notice_id
+            backoff = min(2 ** attempts, _MAX_BACKOFF)
+            return attempts, time.time() + backoff, 'pending', notice_id
+
+        self.sent += 1
+        return None
+
+
+_dispatcher = None
+
+
+def start_dispatcher(bot):
+    """Arranca el despachador (requiere un event loop activo)."""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = NotificationDispatcher(
+            bot, f"{socket.gethostname()}:{os.getpid()}")
+        _dispatcher.start()
+        metrics.register_counter('bot_notifications_sent',
+                                 'Avisos a administradores entregados',
+                                 lambda: _dispatcher.sent if _dispatcher else 0)
+        metrics.register_counter('bot_notifications_failed',
+                                 'Avisos a administradores descartados',
+                                 lambda: _dispatcher.failed if _dispatcher else 0)
+
+
+async def stop_dispatcher():
+    global _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.stop()
+        _dispatcher = None
+
+
+async def notify(chat_ids, text: str):
+    """Guarda el aviso para cada chat y despierta al despachador.
+
+    Solo espera a que el aviso quede guardado, no a que se entregue.
+    """
+    await repository.enqueue_notices(list(chat_ids), text, time.time())
+    if _dispatcher is not None:
+        _dispatcher.wake()
@@ -0,0 +1,280 @@
+# orders.py
+#
+# Canal de pedidos: el checkout encola el pedido y un worker en segundo
+# plano guarda los pedidos por lotes en una transacción, reservando las
+# claves de los productos con existencias (inventory.py), y luego avisa a
+# los administradores. El checkout solo espera a ese lote cuando el pedido
+# lleva productos con claves, para saber si quedaban.
+#
+# Si un lote no se puede guardar (base de datos bloqueada o caída) se
+# reintenta con espera exponencial sin sacarlo de la cola. Si al apagar
+# sigue fallando, los pedidos pendientes se escriben en ORDER_SPILL_FILE y
+# se vuelven a encolar al arrancar.
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+
+import inventory
+import metrics
+import notifications
+import repository
+from products.exchange_rates import convert_to_currency, format_currency
+
+logger = logging.getLogger(__name__)
+
+# lines: [(product_id, nombre, precio_cup, cantidad), ...]
+# stocked: product_ids de las líneas que se entregan con claves del stock
+OrderRequest = namedtuple(
+    'OrderRequest',
+    ['user_id', 'username', 'currency', 'lines', 'created_at', 'stocked'],
+    defaults=((),))
+
+PENDING = 'pending'
+PAID = 'paid'
+DELIVERED = 'delivered'
+CANCELLED = 'cancelled'
+
+# Estado previo requerido para cada transición
+TRANSITIONS = {
+    PAID: PENDING,
+    DELIVERED: PAID,
+    CANCELLED: PENDING,
+}
+
+ORDER_SPILL_FILE = os.getenv(
+    "ORDER_SPILL_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs',
+                 'orders_spill.jsonl'))
+
+_BATCH_SIZE = 100
+_MAX_BACKOFF = 30
+
+stats = {'retries': 0, 'spilled': 0}
+
+_queue = None
+_worker = None
+_stopping = None
+_admin_ids = ()
+
+
+def admin_message(order_id: int, order: OrderRequest) -> str:
+    total = 0
+    items = []
+    for product_id, name, price, qty in order.lines:
+        total += convert_to_currency(price, 'CUP', order.currency) * qty
+        mark = " 🔑" if product_id in order.stocked else ""
+        items.append(f"{qty}x {name}{mark}")
+
+    cart_items_str = "\n".join(items)
+    if len(order.stocked) == len(order.lines):
+        delivery = "🔑 Las claves se enviarán solas al confirmar el pago."
+    else:
+        delivery = "⚠️ ¡CONFIRMAR PAGO Y ENVIAR PRODUCTO MANUALMENTE!"
+    return (f"🚨 NUEVA COMPRA! Pedido #{order_id}\n"
+            f"👤 Usuario: @{order.username} ({order.user_id})\n"
+            f"🛒 Productos:\n{cart_items_str}\n"
+            f"💰 Total: {format_currency(total, order.currency)}\n\n"
+            f"{delivery}\n"
+            f"✅ /pagado {order_id} · ❌ /cancelar {order_id}")
+
+
+def delivery_message(order_id: int, keys: list) -> str:
+    """Mensaje al comprador con las claves [(nombre, código), ...]."""
+    lines = "\n".join(f"• {name}: {code}" for name, code in keys)
+    return f"🔑 Tus productos del pedido #{order_id}:\n\n{lines}"
+
+
+def _spill(orders):
+    """Añade pedidos sin guardar a ORDER_SPILL_FILE (una línea JSON cada uno)."""
+    os.makedirs(os.path.dirname(ORDER_SPILL_FILE), exist_ok=True)
+    with open(ORDER_SPILL_FILE, 'a', encoding='utf-8') as f:
+        for order in orders:
+            f.write(json.dumps(order._asdict(), ensure_ascii=False) + "\n")
+            f.flush()
+    stats['spilled'] += len(orders)
+
+
+def _load_spill() -> list:
+    """Lee y borra los pedidos que quedaron sin guardar al apagar."""
+    try:
+        with open(ORDER_SPILL_FILE, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+    os.remove(ORDER_SPILL_FILE)
+    return [OrderRequest(
+        row['user_id'], row['username'], row['currency'],
+        [tuple(line) for line in row['lines']], row['created_at'],
+        tuple(row['stocked'])) for row in rows]
+
+
+async def _insert(orders: tuple) -> list:
+    """Guarda un lote reintentándolo con espera exponencial mientras falle.
+
+    Al apagar ya no espera: tras un último intento propaga el error.
+    """
+    attempts = 0
+    while True:
+        try:
+            return await repository.insert_orders(orders)
+        except Exception:
+            if _stopping.is_set():
+                raise
+            attempts += 1
+            stats['retries'] += 1
+            delay = min(2 ** attempts, _MAX_BACKOFF)
+            logger.exception("No se pudieron guardar %s pedidos (intento %s), "
+                             "reintento en %s s", len(orders), attempts, delay)
+            try:
+                await asyncio.wait_for(_stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def _write_batch(batch: list):
+    orders, results = zip(*batch)
+    try:
+        placed = await _insert(orders)
+    except Exception as exc:
+        logger.exception("Se guardan %s pedidos en %s para reintentarlos al "
+                         "arrancar", len(orders), ORDER_SPILL_FILE)
+        try:
+            _spill(orders)
+        except OSError:
+            logger.exception("Pedidos perdidos: %s", orders)
+        for result in results:
+            if not result.done():
+                result.set_exception(exc)
+                # Sin esto asyncio avisaría de nuevo por cada pedido cuyo
+                # checkout no espera el lote
+                result.exception()
+        return
+
+    for order, result, (order_id, sold_out) in zip(orders, results, placed):
+        if not result.done():
+            result.set_result((order_id, sold_out))
+    for order, (order_id, _) in zip(orders, placed):
+        if order_id is not None:
+            await notifications.notify(_admin_ids,
+                                       admin_message(order_id, order))
+    # Los contadores de los botones reflejan las claves recién reservadas
+    await inventory.refresh({product_id for order in orders
+                             for product_id in order.stocked})
+
+
+async def _run():
+    while True:
+        batch = [await _queue.get()]
+        while len(batch) < _BATCH_SIZE and not _queue.empty():
+            batch.append(_queue.get_nowait())
+        try:
+            await _write_batch(batch)
+        except Exception:
+            # Los pedidos ya están guardados; falló el aviso o el recuento
+            logger.exception("Error tras guardar %s pedidos", len(batch))
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+def start_pipeline(admin_ids):
+    """Arranca el worker de pedidos (requiere un event loop activo) y
+    vuelve a encolar los que quedaron sin guardar al apagar."""
+    global _queue, _worker, _stopping, _admin_ids
+    if _worker is None:
+        _admin_ids = tuple(admin_ids)
+        _queue = asyncio.Queue()
+        _stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        spilled = _load_spill()
+        if spilled:
+            logger.warning("Reencolando %s pedidos de %s", len(spilled),
+                           ORDER_SPILL_FILE)
+        for order in spilled:
+            _queue.put_nowait((order, loop.create_future()))
+        _worker = loop.create_task(_run())
+        metrics.register_gauge('bot_orders_queued',
+                               'Pedidos en cola sin guardar',
+                               lambda: _queue.qsize() if _queue else 0)
+        metrics.register_counter('bot_order_batch_retries_total',
+                                 'Lotes de pedidos que hubo que reintentar',
+                                 lambda: stats['retries'])
+        metrics.register_counter('bot_orders_spilled_total',
+                                 'Pedidos guardados en archivo al apagar',
+                                 lambda: stats['spilled'])
+
+
+async def stop_pipeline():
+    """Guarda los pedidos en cola (o en ORDER_SPILL_FILE si la base de datos
+    sigue fallando) y detiene el worker."""
+    global _worker
+    if _worker is not None:
+        _stopping.set()
+        await _queue.join()
+        _worker.cancel()
+        try:
+            await _worker
+        except asyncio.CancelledError:
+            pass
+        _worker = None
+
+
+async def wait_idle():
+    """Espera a que se guarden todos los pedidos encolados hasta ahora."""
+    if _queue is not None:
+        await _queue.join()
+
+
+def submit(order: OrderRequest) -> asyncio.Future:
+    """Encola un pedido; no espera a que se guarde.
+
+    Devuelve un Future que se resuelve con (order_id, None) cuando se guarda
+    o con (None, product_id) si a ese producto no le quedaban claves.
+    """
+    result = asyncio.get_running_loop().create_future()
+    _queue.put_nowait((order, result))
+    return result
+
+
+async def pending_orders(limit: int = 20) -> list:
+    return await repository.orders_by_status(PENDING, limit)
+
+
+async def set_status(order_id: int, status: str):
+    """Aplica una transición válida. Devuelve el user_id del comprador o None."""
+    from_status = TRANSITIONS.get(status)
+    if from_status is None:
+        raise ValueError(f"Estado no válido: {status}")
+    return await repository.change_order_status(order_id, from_status, status,
+                                                time.time())
+
+
+async def deliver_keys(order_id: int, buyer_id: int):
+    """Envía al comprador las claves de un pedido recién pagado.
+
+    Si todas sus líneas tenían claves, el pedido pasa a entregado. Devuelve
+    (claves enviadas, entregado).
+    """
+    keys, manual = await repository.deliver_order_keys(order_id, time.time())
+    if not keys:
+        return 0, False
+    await notifications.notify([buyer_id], delivery_message(order_id, keys))
+    delivered = not manual and await set_status(order_id,
+                                                DELIVERED) is not None
+    return len(keys), delivered
+
+
+async def cancel(order_id: int):
+    """Cancela un pedido pendiente y devuelve sus claves al stock.
+
+    Devuelve el user_id del comprador o None si no estaba pendiente.
+    """
+    buyer_id = await set_status(order_id, CANCELLED)
+    if buyer_id is not None:
+        product_ids = await repository.release_order_keys(order_id)
+        await inventory.refresh(product_ids)
+    return buyer_id
@@ -0,0 +1,110 @@
+# products/catalog.py
+
+import sqlite3
+from collections import namedtuple
+from types import MappingProxyType
+
+from products.load_products import DB_PATH
+from products.exchange_rates import (DEFAULT_CURRENCY, convert_to_currency,
+                                     get_rates)
+
+Product = namedtuple(
+    'Product', ['id', 'name', 'category', 'price', 'description',
+                'delivery_info'])
+
+
+class Catalog:
+    """Instantánea inmutable del catálogo, indexada por id y por categoría.
+
+    `version` cambia con cada recarga en este proceso (claves de caché);
+    `revision` se guarda en la base de datos, solo cambia cuando cambia el
+    contenido y sobrevive a los reinicios (botones de mensajes antiguos).
+    """
+
+    __slots__ = ('version', 'revision', 'by_id', 'by_category')
+
+    def __init__(self, products, version: int, revision: int = 0):
+        by_category = {}
+        for product in products:
+            by_category.setdefault(product.category, []).append(product)
+
+        self.version = version
+        self.revision = revision
+        self.by_id = MappingProxyType({p.id: p for p in products})
+        self.by_category = MappingProxyType(
+            {key: tuple(items) for key, items in by_category.items()})
+
+    def products_in(self, category: str) -> tuple:
+        return self.by_category.get(category, ())
+
+
+_current = Catalog((), 0)
+
+
+def get_catalog() -> Catalog:
+    """Devuelve la instantánea vigente (no bloquea ni toca la base de datos)."""
+    return _current
+
+
+def reload_catalog() -> Catalog:
+    """Lee la tabla products y sustituye la instantánea de forma atómica."""
+    global _current
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute(
+            "SELECT id, name, category, price, description, delivery_info "
+            "FROM products WHERE active = 1 ORDER BY id").fetchall()
+        revision = conn.execute(
+            "SELECT value FROM meta WHERE key = 'catalog_revision'").fetchone()
+    finally:
+        conn.close()
+
+    _current = Catalog([Product(*row) for row in rows], _current.version + 1,
+                       int(revision[0]) if revision else 0)
+    return _current
+
+
+def reload_if_changed() -> bool:
+    """Recarga la instantánea si la revisión guardada no es la cargada.
+
+    Así los demás procesos ven los cambios de /recargar o de un arranque que
+    sincronizó el catálogo. Devuelve True si recargó.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        revision = conn.execute(
+            "SELECT value FROM meta WHERE key = 'catalog_revision'").fetchone()
+    finally:
+        conn.close()
+    if (int(revision[0]) if revision else 0) == _current.revision:
+        return False
+    reload_catalog()
+    return True
+
+
+# Precios de todo el catálogo en cada moneda: ((versión catálogo, versión
+# tasas), {moneda: {id_producto: precio}})
+_price_tables = (None, {})
+
+
+def price_table(currency: str):
+    """Precios del catálogo vigente convertidos a `currency`, por id.
+
+    Las tablas de todas las monedas se recalculan juntas cuando cambia el
+    catálogo o las tasas; el resto de llamadas son una búsqueda.
+    """
+    global _price_tables
+    catalog = _current
+    rates = get_rates()
+    stamp = (catalog.version, rates.version)
+    if _price_tables[0] != stamp:
+        tables = {
+            code: MappingProxyType({
+                p.id: convert_to_currency(p.price, 'CUP', code)
+                for p in catalog.by_id.values()
+            })
+            for code in rates.currencies
+        }
+        _price_tables = (stamp, tables)
+    tables = _price_tables[1]
+    return tables.get(currency) or tables[DEFAULT_CURRENCY]
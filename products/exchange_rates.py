@@ -1,25 +1,122 @@
 # products/exchange_rates.py
 
+import json
+import os
+import sqlite3
+from types import MappingProxyType
+
+from products.load_products import DB_PATH
+
 # Moneda por defecto
 DEFAULT_CURRENCY = 'CUP'
 
 # Tasas de cambio (CUP -> otra moneda)
 CUP_TO_USDT_RATE = 400  # 1 USDT ≈ 400 CUP (ajusta según tu mercado real)
 
+# Tasas por defecto: cuántos CUP vale una unidad de cada moneda. Se pueden
+# sobrescribir o ampliar desde RATES_FILE (JSON {"USDT": 400, ...}) y desde
+# la tabla exchange_rates, sin reiniciar el bot (ver reload_rates).
+DEFAULT_RATES = {'CUP': 1, 'USDT': CUP_TO_USDT_RATE}
+
+RATES_FILE = os.getenv("RATES_FILE",
+                       os.path.join(os.path.dirname(__file__), 'rates.json'))
+
+# Formato de cada moneda: (decimales, sufijo). None = sin decimales si el
+# monto es entero y uno si no lo es.
+CURRENCY_FORMATS = {
+    'CUP': (None, 'CUP'),
+    'USDT': (2, '₮'),
+}
+
+CURRENCY_NAMES = {
+    'CUP': "Pesos Cubanos (CUP)",
+    'USDT': "Tether (USDT)",
+}
+
+
+class Rates:
+    """Tabla de tasas inmutable; se sustituye entera al recargar."""
+
+    __slots__ = ('version', 'cup_per_unit')
+
+    def __init__(self, cup_per_unit: dict, version: int):
+        self.version = version
+        self.cup_per_unit = MappingProxyType(dict(cup_per_unit))
+
+    @property
+    def currencies(self) -> tuple:
+        return tuple(self.cup_per_unit)
+
+
+_current = Rates(DEFAULT_RATES, 1)
+
+
+def get_rates() -> Rates:
+    return _current
+
+
+def _read_sources() -> dict:
+    rates = dict(DEFAULT_RATES)
+
+    if os.path.exists(RATES_FILE):
+        with open(RATES_FILE, encoding='utf-8') as f:
+            rates.update({code.upper(): float(value)
+                          for code, value in json.load(f).items()})
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute(
+            "SELECT currency, cup_per_unit FROM exchange_rates").fetchall()
+    except sqlite3.OperationalError:
+        # Tabla aún no creada
+        rows = []
+    finally:
+        conn.close()
+    rates.update({code.upper(): value for code, value in rows})
+
+    rates[DEFAULT_CURRENCY] = 1
+    return {code: value for code, value in rates.items() if value > 0}
+
+
+def reload_rates() -> bool:
+    """Relee el archivo y la tabla de tasas y las sustituye de forma atómica.
+
+    Devuelve True si las tasas cambiaron.
+    """
+    global _current
+    rates = _read_sources()
+    if rates == dict(_current.cup_per_unit):
+        return False
+    _current = Rates(rates, _current.version + 1)
+    return True
+
+
+def save_rates(rates: dict):
+    """Guarda tasas en la tabla exchange_rates (las ven todos los procesos)."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT INTO exchange_rates (currency, cup_per_unit) "
+                "VALUES (?, ?) ON CONFLICT(currency) DO UPDATE SET "
+                "cup_per_unit = excluded.cup_per_unit",
+                [(code.upper(), value) for code, value in rates.items()])
+    finally:
+        conn.close()
+
 
 def convert_to_currency(amount_cup: float, from_currency: str, to_currency: str) -> float:
     """
-    Convierte una cantidad en CUP a otra moneda.
-    Solo soporta CUP ↔ USDT.
+    Convierte una cantidad entre dos monedas de la tabla de tasas vigente.
+    Si alguna moneda no existe devuelve la cantidad sin convertir.
     """
     if from_currency == to_currency:
         return amount_cup
 
-    if from_currency == 'CUP' and to_currency == 'USDT':
-        return amount_cup / CUP_TO_USDT_RATE
-    elif from_currency == 'USDT' and to_currency == 'CUP':
-        return amount_cup * CUP_TO_USDT_RATE
-    else:
+    table = _current.cup_per_unit
+    try:
+        return amount_cup * table[from_currency] / table[to_currency]
+    except KeyError:
         return amount_cup  # Fallback
 
 
@@ -28,18 +125,15 @@ def format_currency(amount: float, currency: str) -> str:
     Formatea un monto numérico con su símbolo correspondiente *después* del número.
 
     Ejemplos:
-        1800, 'CUP'  → "1800 $"
-        75.0, 'USDT' → "75.00 USDT"
-        1.5, 'CUP'   → "1.5 $"
+        1800, 'CUP'  → "1800 CUP"
+        75.0, 'USDT' → "75.00 ₮"
+        1.5, 'CUP'   → "1.5 CUP"
     """
-    if currency == 'CUP':
+    decimals, suffix = CURRENCY_FORMATS.get(currency, (2, currency))
+    if decimals is None:
         # Si es entero, mostrar sin decimales; si tiene decimal, mostrar hasta 1 decimal
         if amount == int(amount):
-            return f"{int(amount)} CUP"
+            return f"{int(amount)} {suffix}"
         else:
-            return f"{amount:.1f} CUP"
-    elif currency == 'USDT':
-        # Siempre 2 decimales, con "USDT" como texto (evitamos símbolos ambiguos)
-        return f"{amount:.2f} ₮"
-    else:
-        return f"{amount} {currency}"  # Fallback seguro
\ No newline at end of file
+            return f"{amount:.1f} {suffix}"
+    return f"{amount:.{decimals}f} {suffix}"
@@ -1,18 +1,52 @@
 # products/load_products.py
 
+import csv
+import hashlib
+import json
 import sqlite3
 import os
+import sys
+import time
 from products.products_data import PRODUCTS
 from products.categories import CATEGORIES
 
-# Ruta a la base de datos
-DB_PATH = os.path.join(os.path.dirname(__file__), 'database.db')
+# Ruta a la base de datos (se puede sobrescribir con la variable DB_PATH)
+DB_PATH = os.getenv("DB_PATH",
+                    os.path.join(os.path.dirname(__file__), 'database.db'))
 
-def create_tables():
-    """Crea las tablas 'products' y 'users' si no existen, y añade la columna 'currency' si es necesario."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def product_key(name: str, category: str) -> str:
+    """Clave estable de un producto cuando no se indica un sku explícito."""
+    return f"{category}:{name.strip().lower()}"
+
+
+def _backfill_skus(cursor):
+    rows = cursor.execute(
+        "SELECT id, name, category FROM products WHERE sku IS NULL ORDER BY id"
+    ).fetchall()
+    if not rows:
+        return
+    used = {row[0] for row in cursor.execute(
+        "SELECT sku FROM products WHERE sku IS NOT NULL")}
+    updates = []
+    for product_id, name, category in rows:
+        sku = product_key(name, category)
+        if sku in used:
+            sku = f"{sku}#{product_id}"
+        used.add(sku)
+        updates.append((sku, product_id))
+    cursor.executemany("UPDATE products SET sku = ? WHERE id = ?", updates)
+    print(f"✅ Clave sku asignada a {len(updates)} productos existentes.")
 
+
+# --- Migraciones del esquema ---
+#
+# Cada migración lleva el esquema de la versión N-1 a la N y se registra en
+# PRAGMA user_version. Todas son idempotentes (IF NOT EXISTS, comprobación de
+# columnas), de modo que las bases de datos anteriores al versionado
+# (user_version = 0) pueden aplicarlas todas sin perder datos. Las nuevas
+# migraciones se añaden siempre al final de MIGRATIONS.
+
+def _migration_base(cursor):
     # Crear tabla products
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS products (
@@ -21,10 +55,16 @@ def create_tables():
             category TEXT NOT NULL,
             price REAL NOT NULL,
             description TEXT,
-            delivery_info TEXT
+            delivery_info TEXT,
+            sku TEXT,
+            active INTEGER NOT NULL DEFAULT 1
         )
     ''')
 
+    # Índice para filtrar por categoría sin recorrer toda la tabla
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_category ON products(category)")
+
     # Crear tabla users con columna currency
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -51,30 +91,497 @@ def create_tables():
         cursor.execute("ALTER TABLE users ADD COLUMN currency TEXT DEFAULT 'CUP'")
         print("✅ Columna 'currency' añadida automáticamente a la tabla users.")
 
-    conn.commit()
-    conn.close()
-    print("✅ Tablas 'products' y 'users' verificadas/creadas.")
 
+def _migration_cart_items(cursor):
+    # Carritos normalizados: una fila por (usuario, producto)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cart_items (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            qty INTEGER NOT NULL CHECK (qty > 0),
+            PRIMARY KEY (user_id, product_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Migrar los carritos antiguos guardados como JSON en users.cart
+    cursor.execute('''
+        INSERT INTO cart_items (user_id, product_id, qty)
+        SELECT u.user_id, CAST(j.key AS INTEGER), j.value
+        FROM users u, json_each(u.cart) j
+        WHERE u.cart IS NOT NULL AND j.value > 0
+        ON CONFLICT (user_id, product_id) DO UPDATE SET qty = qty + excluded.qty
+    ''')
+    if cursor.rowcount > 0:
+        print(f"✅ {cursor.rowcount} líneas de carrito migradas a cart_items.")
+    cursor.execute("UPDATE users SET cart = NULL WHERE cart IS NOT NULL")
+
+
+def _migration_outbox(cursor):
+    # Bandeja de salida de avisos a administradores pendientes de entregar
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            next_attempt REAL NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt)")
+
+
+def _migration_exchange_rates(cursor):
+    # Tasas de cambio editables sin reiniciar (CUP por unidad de moneda)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exchange_rates (
+            currency TEXT PRIMARY KEY,
+            cup_per_unit REAL NOT NULL CHECK (cup_per_unit > 0)
+        )
+    ''')
+
+
+def _migration_orders(cursor):
+    # Pedidos y sus líneas (precio y nombre copiados al momento de la compra)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            currency TEXT NOT NULL,
+            total_cup REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status, created_at)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id, created_at)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id INTEGER NOT NULL REFERENCES orders(id),
+            product_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            price_cup REAL NOT NULL,
+            qty INTEGER NOT NULL,
+            PRIMARY KEY (order_id, product_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _migration_product_skus(cursor):
+    # Bases de datos antiguas: añadir la clave estable 'sku' y el borrado lógico
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(products)")}
+    if 'sku' not in columns:
+        cursor.execute("ALTER TABLE products ADD COLUMN sku TEXT")
+    if 'active' not in columns:
+        cursor.execute(
+            "ALTER TABLE products ADD COLUMN active INTEGER NOT NULL DEFAULT 1")
+    _backfill_skus(cursor)
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products(sku)")
 
-def clear_and_load_products():
-    """Borra todos los productos y carga los nuevos desde products_data.py."""
+
+def _migration_products_fts(cursor):
+    # Índice de búsqueda de texto completo (FTS5) sobre el catálogo. Es una
+    # tabla de contenido externo: guarda solo el índice y los triggers lo
+    # mantienen al día con cada cambio en products
+    has_fts = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone()
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description, delivery_info,
+            content='products', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO products_fts (rowid, name, description, delivery_info)
+            VALUES (new.id, new.name, new.description, new.delivery_info);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description,
+                                      delivery_info)
+            VALUES ('delete', old.id, old.name, old.description,
+                    old.delivery_info);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_update
+        AFTER UPDATE OF name, description, delivery_info ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description,
+                                      delivery_info)
+            VALUES ('delete', old.id, old.name, old.description,
+                    old.delivery_info);
+            INSERT INTO products_fts (rowid, name, description, delivery_info)
+            VALUES (new.id, new.name, new.description, new.delivery_info);
+        END
+    ''')
+    if not has_fts:
+        # Indexar los productos que ya existían
+        cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+        print("✅ Índice de búsqueda products_fts creado.")
+
+
+def _migration_meta(cursor):
+    # Metadatos clave/valor del bot (p. ej. el hash de products_data.PRODUCTS)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def _migration_broadcasts(cursor):
+    # Usuarios que bloquearon el bot o borraron su cuenta: las difusiones
+    # los saltan hasta que vuelvan a escribir
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(users)")}
+    if 'blocked_at' not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN blocked_at REAL")
+    # Difusiones a todos los usuarios; `cursor` es el último user_id
+    # procesado (se reanuda desde ahí) y `owner`/`lease_until` indican qué
+    # proceso la está enviando
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_by INTEGER NOT NULL,
+            owner TEXT,
+            lease_until REAL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    # Como mucho una difusión en curso a la vez
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_broadcasts_running "
+        "ON broadcasts(status) WHERE status = 'running'")
+
+
+def _migration_product_keys(cursor):
+    # Existencias de claves digitales (códigos, cuentas...) por producto. Una
+    # clave está libre mientras order_id es NULL; al pagar el pedido se
+    # entrega y se marca delivered_at
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL REFERENCES products(id),
+            code TEXT NOT NULL,
+            order_id INTEGER REFERENCES orders(id),
+            reserved_at REAL,
+            delivered_at REAL,
+            created_at REAL NOT NULL,
+            UNIQUE (product_id, code)
+        )
+    ''')
+    # Las reservas toman las claves libres más antiguas de un producto
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_product_keys_free "
+        "ON product_keys(product_id, id) WHERE order_id IS NULL")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_product_keys_order "
+        "ON product_keys(order_id) WHERE order_id IS NOT NULL")
+
+
+def _migration_analytics(cursor):
+    # Registro de eventos de la tienda (vistas de categoría, añadidos, vistas
+    # del carrito, compras). Solo se añaden filas; analytics.py las agrega
+    # en stats_hourly/stats_daily y borra las antiguas
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            item TEXT NOT NULL DEFAULT '',
+            qty INTEGER NOT NULL DEFAULT 0,
+            amount_cup REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    # Agregados por hora y por día. item '' es el total del tipo de evento;
+    # el resto, por categoría o producto. users (usuarios únicos) solo se
+    # lleva en stats_daily
+    for table in ('stats_hourly', 'stats_daily'):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                item TEXT NOT NULL,
+                events INTEGER NOT NULL DEFAULT 0,
+                qty INTEGER NOT NULL DEFAULT 0,
+                amount_cup REAL NOT NULL DEFAULT 0,
+                users INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, kind, item)
+            ) WITHOUT ROWID
+        ''')
+    # Usuarios ya contados en los días recientes (usuarios únicos por día)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_seen (
+            day INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (day, kind, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _migration_stats_users(cursor):
+    # Último día en que se vio a cada usuario por tipo de evento: /stats
+    # cuenta usuarios distintos en 7 y 30 días sin sumar los únicos de cada
+    # día (que contarían varias veces a quien vuelve)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_users (
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            PRIMARY KEY (kind, user_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(
+        "INSERT OR IGNORE INTO stats_users (kind, user_id, day) "
+        "SELECT kind, user_id, MAX(day) FROM stats_seen "
+        "GROUP BY kind, user_id")
+
+
+def _migration_outbox_lease(cursor):
+    # Con varios workers sobre la misma base de datos, cada aviso lo
+    # reclama un proceso (`owner`) hasta `lease_until` antes de enviarlo
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(outbox)")}
+    if 'owner' not in columns:
+        cursor.execute("ALTER TABLE outbox ADD COLUMN owner TEXT")
+    if 'lease_until' not in columns:
+        cursor.execute("ALTER TABLE outbox ADD COLUMN lease_until REAL")
+
+
+MIGRATIONS = [
+    _migration_base,
+    _migration_cart_items,
+    _migration_outbox,
+    _migration_exchange_rates,
+    _migration_orders,
+    _migration_product_skus,
+    _migration_products_fts,
+    _migration_meta,
+    _migration_broadcasts,
+    _migration_product_keys,
+    _migration_analytics,
+    _migration_stats_users,
+    _migration_outbox_lease,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def create_tables():
+    """Aplica las migraciones pendientes según PRAGMA user_version.
+
+    Cada migración corre en su propia transacción junto con el cambio de
+    versión, así que una migración fallida no deja el esquema a medias.
+    """
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            print(f"⚠️ La base de datos tiene el esquema v{version}, más nuevo "
+                  f"que el de este código (v{SCHEMA_VERSION}).")
+            return
+        cursor = conn.cursor()
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Otro proceso (varios workers arrancando a la vez) pudo
+                # aplicarla mientras se esperaba el bloqueo
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                    conn.execute("COMMIT")
+                    continue
+                MIGRATIONS[number - 1](cursor)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+    if version < SCHEMA_VERSION:
+        print(f"✅ Esquema actualizado de v{version} a v{SCHEMA_VERSION}.")
+
+
+def _normalize(i: int, product) -> tuple:
+    """Convierte una fila del catálogo en (sku, nombre, categoría, precio, descripción, entrega)."""
+    if isinstance(product, dict):
+        product = (product.get('name'), product.get('category'),
+                   product.get('price'), product.get('description'),
+                   product.get('delivery_info'), product.get('sku'))
+    if len(product) not in (5, 6):
+        raise ValueError(f"❌ Producto {i+1} tiene {len(product)} elementos, pero se esperan 5 (o 6 con sku): {product}")
+
+    name, category, price, description, delivery_info = product[:5]
+    if not name or not category:
+        raise ValueError(f"❌ Producto {i+1} sin nombre o categoría: {product}")
+    sku = product[5] if len(product) == 6 and product[5] else product_key(
+        name, category)
+    return (str(sku), name, category, float(price), description or None,
+            delivery_info or None)
+
+
+def _rows_hash(rows: dict) -> str:
+    payload = json.dumps(sorted(rows.values()), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def products_hash(products=PRODUCTS) -> str:
+    """Hash del contenido normalizado de un catálogo (independiente del orden)."""
+    return _rows_hash({row[0]: row for row in (
+        _normalize(i, product) for i, product in enumerate(products))})
+
+
+def sync_products(products=PRODUCTS) -> dict:
+    """Sincroniza la tabla products con `products` en una sola transacción.
+
+    Compara por sku: inserta los nuevos, actualiza solo los que cambiaron y
+    desactiva (borrado lógico) los que ya no están. Los ids existentes no
+    cambian, así que los carritos y los botones add:<id> siguen siendo
+    válidos.
+    """
+    rows = {}
+    for i, product in enumerate(products):
+        row = _normalize(i, product)
+        rows[row[0]] = row
+    # Al sincronizar products_data.py se guarda su hash para que el próximo
+    # arranque sepa que no hay nada que aplicar (ver prepare_database)
+    digest = _rows_hash(rows) if products is PRODUCTS else None
+
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        existing = {
+            row[0]: row[1:]
+            for row in conn.execute(
+                "SELECT sku, name, category, price, description, "
+                "delivery_info, active FROM products")
+        }
+        upserts = [row for sku, row in rows.items()
+                   if existing.get(sku) != row[1:] + (1,)]
+        removed = [(sku,) for sku, row in existing.items()
+                   if sku not in rows and row[-1]]
+
+        conn.executemany('''
+            INSERT INTO products (sku, name, category, price, description,
+                                  delivery_info, active)
+            VALUES (?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT(sku) DO UPDATE SET
+                name = excluded.name, category = excluded.category,
+                price = excluded.price, description = excluded.description,
+                delivery_info = excluded.delivery_info, active = 1
+        ''', upserts)
+        conn.executemany("UPDATE products SET active = 0 WHERE sku = ?",
+                         removed)
+        if digest is not None:
+            _set_meta(conn, 'products_hash', digest)
+        if upserts or removed:
+            # Revisión persistente del catálogo: va en los botones add:<id>
+            # para detectar los que se generaron con un catálogo anterior
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('catalog_revision', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    stats = {'total': len(rows), 'changed': len(upserts),
+             'removed': len(removed)}
+    print(f"✅ Catálogo sincronizado: {stats['total']} productos, "
+          f"{stats['changed']} nuevos o modificados, {stats['removed']} retirados.")
+    return stats
+
+
+def _set_meta(conn, key: str, value: str):
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+
+def prepare_database() -> bool:
+    """Deja la base de datos lista para arrancar el bot.
+
+    En un arranque en caliente (esquema al día y products_data.py sin
+    cambios) solo hace una lectura de metadatos. Si no, aplica las
+    migraciones pendientes y sincroniza el catálogo si PRODUCTS cambió.
+    Devuelve True si tuvo que modificar algo.
+    """
+    digest = products_hash()
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    try:
+        try:
+            version, stored = conn.execute(
+                "SELECT (SELECT user_version FROM pragma_user_version), "
+                "(SELECT value FROM meta WHERE key = 'products_hash')"
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # Base de datos nueva o anterior a la tabla meta
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            stored = None
+        if version == SCHEMA_VERSION and stored == digest:
+            return False
+
+        if version != SCHEMA_VERSION:
+            create_tables()
+    finally:
+        conn.close()
+
+    if stored != digest:
+        # También sin hash guardado (base de datos anterior a él): el
+        # catálogo existente puede no coincidir con PRODUCTS
+        print("⚠️ Catálogo vacío o products_data.py modificado. Sincronizando...")
+        sync_products()
+    return True
+
+
+def read_catalog_file(path: str) -> list:
+    """Lee un catálogo CSV (con cabecera) o JSON (lista de objetos o de filas).
+
+    Columnas/campos: name, category, price, description, delivery_info y,
+    opcionalmente, sku.
+    """
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
 
-    cursor.execute("DELETE FROM products")
 
-    for i, product in enumerate(PRODUCTS):
-        if len(product) != 5:
-            raise ValueError(f"❌ Producto {i+1} tiene {len(product)} elementos, pero se esperan 5: {product}")
-        cursor.execute('''
-            INSERT INTO products (name, category, price, description, delivery_info)
-            VALUES (?, ?, ?, ?, ?)
-        ''', product)
+def import_catalog(path: str) -> dict:
+    """Sincroniza la tabla products con el contenido de un archivo CSV/JSON."""
+    return sync_products(read_catalog_file(path))
 
-    conn.commit()
-    conn.close()
-    print("✅ Productos cargados correctamente.")
 
 if __name__ == "__main__":
+    # python -m products.load_products [catalogo.csv|catalogo.json]
+    start = time.perf_counter()
     create_tables()
-    clear_and_load_products()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        import_catalog(sys.argv[1])
+    else:
+        sync_products()
+    print(f"⏱️ {time.perf_counter() - start:.2f} s")
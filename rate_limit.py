@@ -0,0 +1,42 @@
+# rate_limit.py
+#
+# Token bucket sencillo para respetar los límites de envío de Telegram.
+# Pensado para usarse desde el event loop (no es seguro entre hilos).
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Permite `rate` operaciones por segundo con ráfagas de hasta `capacity`."""
+
+    __slots__ = ('rate', 'capacity', '_tokens', '_updated')
+
+    def __init__(self, rate: float, capacity: float, now: float = None):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1, now: float = None) -> bool:
+        """Consume `tokens` si están disponibles; no espera.
+
+        `now` permite usar otro reloj monotónico (trazas reproducidas).
+        """
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1):
+        """Espera hasta poder consumir `tokens`."""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep((tokens - self._tokens) / self.rate)
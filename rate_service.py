@@ -0,0 +1,106 @@
+# rate_service.py
+#
+# Recarga periódica de las tasas de cambio y del catálogo, de los que
+# dependen las tablas de precios. Cada RATES_POLL_INTERVAL segundos consulta
+# el proveedor (si hay uno), guarda lo obtenido en la tabla exchange_rates y
+# vuelve a leer archivo + tabla. Cada CATALOG_POLL_INTERVAL segundos compara
+# la revisión del catálogo guardada con la cargada, para que todos los
+# procesos vean lo que sincronizó /recargar en uno de ellos. Si algo cambia
+# se precalculan las tablas de precios.
+
+import asyncio
+import logging
+import os
+
+import repository
+from products import exchange_rates
+from products.catalog import get_catalog, price_table, reload_if_changed
+
+logger = logging.getLogger(__name__)
+
+RATES_POLL_INTERVAL = float(os.getenv("RATES_POLL_INTERVAL", "60"))
+CATALOG_POLL_INTERVAL = float(os.getenv("CATALOG_POLL_INTERVAL", "30"))
+
+
+class StaticRateProvider:
+    """Proveedor local de ejemplo: devuelve siempre las mismas tasas.
+
+    Un proveedor es cualquier objeto invocable que devuelva (de forma
+    asíncrona) un dict {moneda: CUP por unidad}.
+    """
+
+    def __init__(self, rates: dict):
+        self.rates = dict(rates)
+
+    async def __call__(self) -> dict:
+        return self.rates
+
+
+_tasks = []
+
+
+def refresh_price_tables():
+    """Calcula las tablas de precios de todas las monedas de antemano."""
+    for code in exchange_rates.get_rates().currencies:
+        price_table(code)
+
+
+async def refresh(provider=None) -> bool:
+    """Consulta el proveedor y recarga las tasas. Devuelve True si cambiaron."""
+    if provider is not None:
+        rates = await provider()
+        if rates:
+            await repository.run_db(exchange_rates.save_rates, rates)
+
+    changed = await repository.run_db(exchange_rates.reload_rates)
+    if changed:
+        refresh_price_tables()
+        logger.info("Tasas de cambio actualizadas: %s",
+                    dict(exchange_rates.get_rates().cup_per_unit))
+    return changed
+
+
+async def refresh_catalog() -> bool:
+    """Recarga el catálogo si cambió su revisión. Devuelve True si cambió."""
+    changed = await repository.run_db(reload_if_changed)
+    if changed:
+        refresh_price_tables()
+        logger.info("Catálogo recargado (revisión %s)",
+                    get_catalog().revision)
+    return changed
+
+
+async def _poll(provider):
+    while True:
+        await asyncio.sleep(RATES_POLL_INTERVAL)
+        try:
+            await refresh(provider)
+        except Exception:
+            logger.exception("No se pudieron actualizar las tasas de cambio")
+
+
+async def _poll_catalog():
+    while True:
+        await asyncio.sleep(CATALOG_POLL_INTERVAL)
+        try:
+            await refresh_catalog()
+        except Exception:
+            logger.exception("No se pudo recargar el catálogo")
+
+
+def start_rate_service(provider=None):
+    """Lanza la recarga periódica (requiere un event loop activo)."""
+    if not _tasks:
+        loop = asyncio.get_running_loop()
+        _tasks.append(loop.create_task(_poll(provider)))
+        _tasks.append(loop.create_task(_poll_catalog()))
+
+
+async def stop_rate_service():
+    for task in _tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _tasks.clear()
@@ -0,0 +1,331 @@
+# redis_store.py
+#
+# Estado compartido (usuarios, carritos, pedidos y claves) en Redis, para ejecutar
+# varios procesos del bot (en uno o varios hosts) contra el mismo estado.
+# Se activa con STATE_BACKEND=redis; SQLite sigue siendo el almacén por
+# defecto. El catálogo, las tasas y la bandeja de salida de avisos siguen en
+# la base de datos local de cada proceso.
+#
+# Claves (todas con el prefijo REDIS_PREFIX):
+#   user:<id>         hash  {currency, blocked_at}
+#   users             zset  user_id -> user_id (destinatarios de difusiones;
+#                           sin los que bloquearon el bot)
+#   cart:<id>         hash  {sku: qty}
+#   order:<id>        hash  {user_id, username, currency, total_cup, status,
+#                            created_at, updated_at, items (JSON)}
+#   orders:<estado>   zset  id de pedido -> created_at
+#   order_seq         contador de ids de pedido
+#   keys:<sku>        list  claves libres de un producto ([sku, código])
+#   keys_seen:<sku>   set   códigos importados (evita duplicados)
+#   stocked           set   skus con claves (el resto se entrega a mano)
+#   order_keys:<id>   list  claves ([sku, código]) reservadas por un pedido
+#
+# Los productos se identifican por sku: el id de products es el
+# AUTOINCREMENT de la base de datos de cada host y dos hosts pueden dar el
+# mismo id a productos distintos. Las operaciones reciben y devuelven ids
+# locales y los traducen con el catálogo local (incluidos los retirados).
+#
+# Cada operación del repositorio es un único viaje de ida y vuelta (pipeline),
+# salvo el cambio de estado de un pedido, que usa WATCH/MULTI para que dos
+# procesos no confirmen el mismo pedido a la vez.
+
+import json
+import os
+
+import repository
+from products.catalog import get_catalog
+from products.exchange_rates import DEFAULT_CURRENCY, get_rates
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "bot:")
+
+# Reintentos de un cambio de estado cuando otro proceso modifica el pedido
+_STATUS_RETRIES = 5
+# Reintentos de la reserva de claves de un lote con otros procesos comprando
+_RESERVE_RETRIES = 50
+
+
+class RedisStore:
+    """Implementa las operaciones de estado de repository sobre Redis."""
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX,
+                 client=None):
+        if client is None:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError:
+                raise RuntimeError(
+                    "❌ STATE_BACKEND=redis requiere el paquete 'redis' "
+                    "(pip install -r requirements-redis.txt).") from None
+            client = aioredis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+        self._sku_by_id = {}
+        self._id_by_sku = {}
+        self._map_version = None
+
+    def _key(self, *parts) -> str:
+        return self.prefix + ':'.join(str(part) for part in parts)
+
+    async def _sku_map(self, product_ids=()) -> tuple:
+        """(sku por id, id por sku) del catálogo local.
+
+        Se recarga cuando cambia el catálogo de este proceso o falta alguno
+        de `product_ids` (un producto añadido desde otro proceso).
+        """
+        version = get_catalog().version
+        if version != self._map_version or any(
+                product_id not in self._sku_by_id
+                for product_id in product_ids):
+            rows = await repository.product_skus()
+            self._sku_by_id = dict(rows)
+            self._id_by_sku = {sku: product_id for product_id, sku in rows}
+            self._map_version = version
+        return self._sku_by_id, self._id_by_sku
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def load_session(self, user_id: int):
+        """Devuelve (moneda, carrito) del usuario o None si no existe."""
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hget(self._key('user', user_id), 'currency')
+            pipe.hgetall(self._key('cart', user_id))
+            currency, raw_cart = await pipe.execute()
+        if currency is None:
+            return None
+
+        currency = currency.strip().upper()
+        if currency not in get_rates().cup_per_unit:
+            currency = DEFAULT_CURRENCY
+        # Como el JOIN de SQLite: se descartan productos que ya no existen
+        # (o que el catálogo de este host no tiene)
+        products = get_catalog().by_id
+        _, ids = await self._sku_map()
+        cart = {ids[sku]: int(qty) for sku, qty in raw_cart.items()
+                if ids.get(sku) in products}
+        return currency, cart
+
+    async def save_sessions(self, rows: list):
+        """Guarda [(user_id, moneda, vaciado, incrementos), ...] en un MULTI."""
+        skus, _ = await self._sku_map(
+            {product_id for *_, delta in rows for product_id in delta})
+        async with self.client.pipeline(transaction=True) as pipe:
+            for user_id, currency, cart_cleared, delta in rows:
+                user_key = self._key('user', user_id)
+                pipe.hset(user_key, 'currency', currency)
+                # Quien vuelve a usar el bot ya no lo tiene bloqueado
+                pipe.hdel(user_key, 'blocked_at')
+                pipe.zadd(self._key('users'), {user_id: user_id})
+                cart_key = self._key('cart', user_id)
+                if cart_cleared:
+                    pipe.delete(cart_key)
+                for product_id, qty in delta.items():
+                    if product_id in skus:
+                        pipe.hincrby(cart_key, skus[product_id], qty)
+            await pipe.execute()
+
+    async def insert_orders(self, orders: list) -> list:
+        """Guarda un lote de pedidos reservando sus claves.
+
+        Bajo WATCH se leen tantas claves libres de cada producto como pide
+        el lote y en la misma transacción que guarda los pedidos se recortan
+        de keys:<sku> y se copian a order_keys:<id>; si otro proceso toca
+        esas existencias antes del EXEC, se vuelve a decidir el lote entero.
+        Devuelve [(order_id, None) o (None, product_id agotado), ...].
+        """
+        from redis.exceptions import WatchError
+
+        skus, _ = await self._sku_map(
+            {line[0] for order in orders for line in order.lines})
+        last = await self.client.incrby(self._key('order_seq'), len(orders))
+        ids = range(last - len(orders) + 1, last + 1)
+        demand = {}
+        for order in orders:
+            for product_id, _, _, qty in order.lines:
+                if product_id in order.stocked:
+                    demand[product_id] = demand.get(product_id, 0) + qty
+
+        for _ in range(_RESERVE_RETRIES):
+            async with self.client.pipeline(transaction=True) as pipe:
+                try:
+                    free = {}
+                    if demand:
+                        await pipe.watch(*(self._key('keys', skus[product_id])
+                                           for product_id in demand))
+                        for product_id, qty in demand.items():
+                            free[product_id] = await pipe.lrange(
+                                self._key('keys', skus[product_id]), 0,
+                                qty - 1)
+                    taken = dict.fromkeys(free, 0)
+                    pipe.multi()
+                    results = [self._place_order(pipe, order_id, order, free,
+                                                 taken, skus)
+                               for order_id, order in zip(ids, orders)]
+                    for product_id, count in taken.items():
+                        if count:
+                            pipe.ltrim(self._key('keys', skus[product_id]),
+                                       count, -1)
+                    await pipe.execute()
+                    return results
+                except WatchError:
+                    # Otro proceso reservó o repuso claves: se vuelve a leer
+                    continue
+        raise RuntimeError("No se pudieron reservar las claves del lote")
+
+    def _place_order(self, pipe, order_id: int, order, free: dict,
+                     taken: dict, skus: dict) -> tuple:
+        """Añade a `pipe` un pedido si quedan claves en `free`.
+
+        `taken` cuenta las claves ya asignadas de cada producto en el lote.
+        Las líneas se guardan con el sku en lugar del id local.
+        """
+        for product_id, _, _, qty in order.lines:
+            if (product_id in order.stocked
+                    and len(free[product_id]) - taken[product_id] < qty):
+                return None, product_id
+
+        keys = []
+        for product_id, _, _, qty in order.lines:
+            if product_id in order.stocked:
+                start = taken[product_id]
+                keys.extend(free[product_id][start:start + qty])
+                taken[product_id] += qty
+        if keys:
+            pipe.rpush(self._key('order_keys', order_id), *keys)
+        total_cup = sum(price * qty for _, _, price, qty in order.lines)
+        pipe.hset(self._key('order', order_id), mapping={
+            'user_id': order.user_id,
+            'username': order.username or '',
+            'currency': order.currency,
+            'total_cup': total_cup,
+            'status': 'pending',
+            'created_at': order.created_at,
+            'updated_at': order.created_at,
+            'items': json.dumps(
+                [(skus[product_id], *rest)
+                 for product_id, *rest in order.lines], ensure_ascii=False),
+        })
+        pipe.zadd(self._key('orders', 'pending'), {order_id: order.created_at})
+        return order_id, None
+
+    async def stock_counts(self, product_ids=None) -> dict:
+        """{product_id: claves libres} de los productos que tienen claves."""
+        skus, ids = await self._sku_map()
+        stocked = {ids[sku] for sku in
+                   await self.client.smembers(self._key('stocked'))
+                   if sku in ids}
+        if product_ids is not None:
+            stocked &= set(product_ids)
+        stocked = sorted(stocked)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for product_id in stocked:
+                pipe.llen(self._key('keys', skus[product_id]))
+            counts = await pipe.execute()
+        return dict(zip(stocked, counts))
+
+    async def import_keys(self, rows: list, now: float) -> int:
+        """Añade [(product_id, código), ...]; ignora los códigos repetidos."""
+        skus, _ = await self._sku_map({product_id for product_id, _ in rows})
+        rows = [(skus[product_id], code) for product_id, code in rows]
+        async with self.client.pipeline(transaction=False) as pipe:
+            for sku, code in rows:
+                pipe.sadd(self._key('keys_seen', sku), code)
+            added = await pipe.execute()
+        new = [row for row, is_new in zip(rows, added) if is_new]
+        async with self.client.pipeline(transaction=True) as pipe:
+            for sku, code in new:
+                pipe.rpush(self._key('keys', sku),
+                           json.dumps([sku, code], ensure_ascii=False))
+                pipe.sadd(self._key('stocked'), sku)
+            await pipe.execute()
+        return len(new)
+
+    async def deliver_order_keys(self, order_id: int, now: float) -> tuple:
+        """Devuelve ([(nombre, código), ...], hay líneas sin claves)."""
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.lrange(self._key('order_keys', order_id), 0, -1)
+            pipe.hget(self._key('order', order_id), 'items')
+            pipe.hset(self._key('order', order_id), 'keys_delivered_at', now)
+            raw_keys, items, _ = await pipe.execute()
+        keys = [json.loads(key) for key in raw_keys]
+        names = {line[0]: line[1] for line in json.loads(items or '[]')}
+        stocked = {sku for sku, _ in keys}
+        manual = any(sku not in stocked for sku in names)
+        return sorted((names.get(sku, '?'), code)
+                      for sku, code in keys), manual
+
+    async def release_order_keys(self, order_id: int) -> list:
+        """Devuelve al stock las claves de un pedido cancelado."""
+        key = self._key('order_keys', order_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.lrange(key, 0, -1)
+            pipe.delete(key)
+            raw_keys, _ = await pipe.execute()
+        skus = [json.loads(raw)[0] for raw in raw_keys]
+        async with self.client.pipeline(transaction=True) as pipe:
+            for sku, raw in zip(skus, raw_keys):
+                pipe.lpush(self._key('keys', sku), raw)
+            await pipe.execute()
+        _, ids = await self._sku_map()
+        return sorted({ids[sku] for sku in skus if sku in ids})
+
+    async def orders_by_status(self, status: str, limit: int) -> list:
+        """[(id, user_id, username, currency, total_cup, created_at), ...] más antiguos primero."""
+        order_ids = await self.client.zrange(self._key('orders', status),
+                                             0, limit - 1)
+        fields = ('user_id', 'username', 'currency', 'total_cup', 'created_at')
+        async with self.client.pipeline(transaction=False) as pipe:
+            for order_id in order_ids:
+                pipe.hmget(self._key('order', order_id), fields)
+            rows = await pipe.execute()
+        return [(int(order_id), int(user_id), username or None, currency,
+                 float(total_cup), float(created_at))
+                for order_id, (user_id, username, currency, total_cup,
+                               created_at) in zip(order_ids, rows)]
+
+    async def users_after(self, after_id: int, limit: int) -> list:
+        """Siguientes `limit` user_id activos mayores que `after_id`."""
+        user_ids = await self.client.zrangebyscore(
+            self._key('users'), f'({after_id}', '+inf', start=0, num=limit)
+        return [int(user_id) for user_id in user_ids]
+
+    async def count_users(self) -> int:
+        return await self.client.zcard(self._key('users'))
+
+    async def mark_blocked(self, user_ids: list, now: float):
+        async with self.client.pipeline(transaction=True) as pipe:
+            for user_id in user_ids:
+                pipe.hset(self._key('user', user_id), 'blocked_at', now)
+            pipe.zrem(self._key('users'), *user_ids)
+            await pipe.execute()
+
+    async def change_order_status(self, order_id: int, from_status: str,
+                                  to_status: str, now: float):
+        """Cambia el estado solo si el pedido está en `from_status`.
+
+        Devuelve el user_id del comprador o None si no se pudo cambiar.
+        """
+        from redis.exceptions import WatchError
+
+        key = self._key('order', order_id)
+        for _ in range(_STATUS_RETRIES):
+            async with self.client.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(key)
+                    status, user_id, created_at = await pipe.hmget(
+                        key, ('status', 'user_id', 'created_at'))
+                    if status != from_status:
+                        return None
+                    pipe.multi()
+                    pipe.hset(key, mapping={'status': to_status,
+                                            'updated_at': now})
+                    pipe.zrem(self._key('orders', from_status), order_id)
+                    pipe.zadd(self._key('orders', to_status),
+                              {order_id: float(created_at)})
+                    await pipe.execute()
+                    return int(user_id)
+                except WatchError:
+                    # Otro proceso cambió el pedido: se vuelve a leer
+                    continue
+        return None
@@ -0,0 +1,788 @@
+# repository.py
+#
+# Capa de acceso a datos asíncrona. Los handlers de bot.py nunca tocan
+# sqlite3 directamente: cada operación se ejecuta en un pool de hilos
+# acotado para no bloquear el event loop de python-telegram-bot.
+#
+# El estado compartido entre procesos (usuarios, carritos, pedidos y claves
+# de producto) pasa por un almacén intercambiable elegido con STATE_BACKEND:
+# 'sqlite' (por defecto, la base de datos local) o 'redis' (redis_store.py,
+# para varios procesos o hosts). El catálogo, la búsqueda, la bandeja de
+# salida, las difusiones y el registro de eventos siempre usan la base de
+# datos local.
+
+import asyncio
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from database import get_db, close_all
+from products.exchange_rates import DEFAULT_CURRENCY, get_rates
+
+# Número máximo de hilos dedicados a la base de datos
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+
+# Coincidencias que se puntúan con bm25 como máximo en una búsqueda. Acota el
+# coste de términos muy comunes ("pr", "cuenta"): se ordenan las primeras N
+# coincidencias activas en lugar de todo el catálogo
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "1000"))
+
+# Almacén de usuarios, carritos, pedidos y claves: 'sqlite' o 'redis' (este
+# necesita pip install -r requirements-redis.txt)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").strip().lower()
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS,
+                               thread_name_prefix="db")
+
+
+async def run_db(func, *args):
+    """Ejecuta `func(*args)` en el pool de la base de datos y espera el resultado."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args))
+
+
+def shutdown():
+    """Espera a que terminen las operaciones pendientes y cierra el pool."""
+    _executor.shutdown(wait=True)
+    close_all()
+
+
+class SQLiteStore:
+    """Estado en la base de datos local (un solo host)."""
+
+    async def close(self):
+        pass
+
+    async def load_session(self, user_id: int):
+        return await run_db(_load_session, user_id)
+
+    async def save_sessions(self, rows: list):
+        await run_db(_save_sessions, rows)
+
+    async def insert_orders(self, orders: list) -> list:
+        return await run_db(_insert_orders, orders)
+
+    async def stock_counts(self, product_ids=None) -> dict:
+        return await run_db(_stock_counts, product_ids)
+
+    async def import_keys(self, rows: list, now: float) -> int:
+        return await run_db(_import_keys, rows, now)
+
+    async def deliver_order_keys(self, order_id: int, now: float) -> tuple:
+        return await run_db(_deliver_order_keys, order_id, now)
+
+    async def release_order_keys(self, order_id: int) -> list:
+        return await run_db(_release_order_keys, order_id)
+
+    async def orders_by_status(self, status: str, limit: int) -> list:
+        return await run_db(_orders_by_status, status, limit)
+
+    async def change_order_status(self, order_id: int, from_status: str,
+                                  to_status: str, now: float):
+        return await run_db(_change_order_status, order_id, from_status,
+                            to_status, now)
+
+    async def users_after(self, after_id: int, limit: int) -> list:
+        return await run_db(_users_after, after_id, limit)
+
+    async def count_users(self) -> int:
+        return await run_db(_count_users)
+
+    async def mark_blocked(self, user_ids: list, now: float):
+        await run_db(_mark_blocked, user_ids, now)
+
+
+_store = None
+
+
+def get_store():
+    """Devuelve el almacén de estado configurado, creándolo la primera vez."""
+    global _store
+    if _store is None:
+        if STATE_BACKEND == 'sqlite':
+            _store = SQLiteStore()
+        elif STATE_BACKEND == 'redis':
+            from redis_store import RedisStore
+            _store = RedisStore()
+        else:
+            raise ValueError(f"❌ STATE_BACKEND no válido: {STATE_BACKEND!r} "
+                             f"(usa 'sqlite' o 'redis').")
+    return _store
+
+
+def set_store(store):
+    """Sustituye el almacén de estado (benchmarks, otro servidor...)."""
+    global _store
+    _store = store
+
+
+async def close_store():
+    """Cierra las conexiones del almacén de estado."""
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+
+# --- Operaciones síncronas (se ejecutan dentro del pool) ---
+
+def _load_session(user_id: int):
+    """Devuelve (moneda, carrito) del usuario o None si no existe."""
+    conn = get_db()
+    row = conn.execute("SELECT currency FROM users WHERE user_id = ?",
+                       (user_id,)).fetchone()
+    if row is None:
+        return None
+
+    currency = (row[0] or '').strip().upper()
+    if currency not in get_rates().cup_per_unit:
+        currency = DEFAULT_CURRENCY
+    # El JOIN descarta líneas de productos que ya no existen
+    cart = dict(conn.execute(
+        "SELECT ci.product_id, ci.qty FROM cart_items ci "
+        "JOIN products p ON p.id = ci.product_id AND p.active = 1 "
+        "WHERE ci.user_id = ?",
+        (user_id,)).fetchall())
+    return currency, cart
+
+
+def _save_sessions(rows: list):
+    """Guarda [(user_id, moneda, vaciado, incrementos), ...] en una sola transacción."""
+    users = []
+    cleared = []
+    increments = []
+    for user_id, currency, cart_cleared, delta in rows:
+        users.append((user_id, currency))
+        if cart_cleared:
+            cleared.append((user_id,))
+        increments.extend((user_id, product_id, qty)
+                          for product_id, qty in delta.items())
+
+    with get_db() as conn:
+        # Quien vuelve a usar el bot ya no lo tiene bloqueado
+        conn.executemany(
+            "INSERT INTO users (user_id, currency) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET currency = excluded.currency, "
+            "blocked_at = NULL",
+            users)
+        conn.executemany("DELETE FROM cart_items WHERE user_id = ?", cleared)
+        conn.executemany(
+            "INSERT INTO cart_items (user_id, product_id, qty) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id, product_id) DO UPDATE SET qty = qty + excluded.qty",
+            increments)
+
+
+def _users_after(after_id: int, limit: int) -> list:
+    """Siguientes `limit` user_id activos mayores que `after_id`.
+
+    Paginación por clave sobre la clave primaria: cada página es un recorrido
+    de rango, sin mantener una lectura abierta entre páginas.
+    """
+    rows = get_db().execute(
+        "SELECT user_id FROM users WHERE user_id > ? AND blocked_at IS NULL "
+        "ORDER BY user_id LIMIT ?", (after_id, limit)).fetchall()
+    return [row[0] for row in rows]
+
+
+def _count_users() -> int:
+    return get_db().execute(
+        "SELECT COUNT(*) FROM users WHERE blocked_at IS NULL").fetchone()[0]
+
+
+def _mark_blocked(user_ids: list, now: float):
+    with get_db() as conn:
+        conn.executemany("UPDATE users SET blocked_at = ? WHERE user_id = ?",
+                         [(now, user_id) for user_id in user_ids])
+
+
+def match_expression(text: str) -> str:
+    """Convierte el texto del usuario en una consulta FTS5 segura.
+
+    Todas las palabras deben aparecer y la última se busca como prefijo
+    ("spotify prem" encuentra "Spotify Premium"); las anteriores ya están
+    completas y buscarlas exactas es mucho más barato. Las comillas evitan
+    que el usuario inyecte operadores. Devuelve '' si no hay palabras.
+    """
+    words = re.findall(r'\w+', text)[:8]
+    terms = [f'"{word}"' for word in words]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _search_products(text: str, limit: int) -> list:
+    """Ids de productos activos que coinciden con `text`, los más relevantes primero.
+
+    Primero van los que tienen todas las palabras en el nombre, del nombre
+    más corto (el más parecido a la búsqueda) al más largo: se ordenan todas
+    las coincidencias en el nombre, sin puntuarlas. Si faltan resultados, el
+    resto se ordena por bm25, donde un acierto en el nombre pesa más que en
+    la descripción, y esta más que en los datos de entrega.
+
+    Límite conocido: bm25 solo puntúa las primeras SEARCH_MAX_CANDIDATES
+    coincidencias activas por id, así que entre los aciertos fuera del
+    nombre de un término muy común puede faltar alguno más relevante que los
+    mostrados.
+    """
+    expression = match_expression(text)
+    if not expression:
+        return []
+    db = get_db()
+    ids = [row[0] for row in db.execute(
+        "SELECT p.id FROM products_fts "
+        "JOIN products p ON p.id = products_fts.rowid AND p.active = 1 "
+        "WHERE products_fts MATCH ? ORDER BY length(p.name), p.id LIMIT ?",
+        (f"{{name}} : ({expression})", limit))]
+    if len(ids) < limit:
+        found = set(ids)
+        rows = db.execute(
+            "SELECT c.id FROM ("
+            "  SELECT products_fts.rowid AS id, "
+            "         bm25(products_fts, 10.0, 2.0, 1.0) AS score "
+            "  FROM products_fts "
+            "  JOIN products p ON p.id = products_fts.rowid AND p.active = 1 "
+            "  WHERE products_fts MATCH ? LIMIT ?"
+            ") c ORDER BY c.score LIMIT ?",
+            (expression, SEARCH_MAX_CANDIDATES, limit + len(ids))).fetchall()
+        ids.extend(row[0] for row in rows if row[0] not in found)
+    return ids[:limit]
+
+
+def _enqueue_notices(chat_ids: list, text: str, now: float):
+    with get_db() as conn:
+        conn.executemany(
+            "INSERT INTO outbox (chat_id, text, next_attempt, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            [(chat_id, text, now, now) for chat_id in chat_ids])
+
+
+def _claim_notices(owner: str, now: float, lease_until: float,
+                   limit: int) -> list:
+    """Reclama para `owner` hasta `limit` avisos pendientes que ya tocan y
+    que ningún otro proceso tiene reclamados. Devuelve sus filas."""
+    with get_db() as conn:
+        return conn.execute(
+            "UPDATE outbox SET owner = ?, lease_until = ? WHERE id IN ("
+            "SELECT id FROM outbox WHERE status = 'pending' "
+            "AND next_attempt <= ? AND (lease_until IS NULL OR "
+            "lease_until < ?) ORDER BY next_attempt LIMIT ?) "
+            "RETURNING id, chat_id, text, attempts",
+            (owner, lease_until, now, now, limit)).fetchall()
+
+
+def _next_notice_time():
+    # Los reclamados por otro proceso no vuelven a estar libres hasta que
+    # vence su concesión
+    row = get_db().execute(
+        "SELECT MIN(MAX(next_attempt, COALESCE(lease_until, 0))) FROM outbox "
+        "WHERE status = 'pending'").fetchone()
+    return row[0]
+
+
+def _settle_notices(owner: str, delivered: list, retries: list):
+    """Borra los avisos entregados y reprograma o marca como fallidos el resto,
+    liberando la concesión. Solo toca los que siguen reclamados por `owner`.
+
+    `retries` es [(intentos, próximo_intento, estado, id), ...].
+    """
+    with get_db() as conn:
+        conn.executemany("DELETE FROM outbox WHERE id = ? AND owner = ?",
+                         [(notice_id, owner) for notice_id in delivered])
+        conn.executemany(
+            "UPDATE outbox SET attempts = ?, next_attempt = ?, status = ?, "
+            "owner = NULL, lease_until = NULL WHERE id = ? AND owner = ?",
+            [(*retry, owner) for retry in retries])
+
+
+def _reserve_keys(conn, order_id: int, order):
+    """Reserva las claves de las líneas con existencias de un pedido.
+
+    Cada UPDATE elige y marca las claves libres en una sola sentencia, así
+    que dos compras simultáneas nunca se llevan la misma clave. Devuelve el
+    product_id de la primera línea sin claves suficientes o None.
+    """
+    for product_id, _, _, qty in order.lines:
+        if product_id not in order.stocked:
+            continue
+        reserved = conn.execute(
+            "UPDATE product_keys SET order_id = ?, reserved_at = ? "
+            "WHERE id IN (SELECT id FROM product_keys WHERE product_id = ? "
+            "AND order_id IS NULL ORDER BY id LIMIT ?)",
+            (order_id, order.created_at, product_id, qty)).rowcount
+        if reserved < qty:
+            return product_id
+    return None
+
+
+def _insert_orders(orders: list) -> list:
+    """Guarda un lote de pedidos en una sola transacción y reserva sus claves.
+
+    Cada pedido con claves va en su propio SAVEPOINT: si a una línea le
+    faltan claves se deshace solo ese pedido. Devuelve [(order_id, None) o
+    (None, product_id agotado), ...] en el orden de `orders`.
+    """
+    results = []
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for order in orders:
+            if order.stocked:
+                conn.execute("SAVEPOINT pedido")
+            total_cup = sum(price * qty for _, _, price, qty in order.lines)
+            cursor = conn.execute(
+                "INSERT INTO orders (user_id, username, currency, total_cup, "
+                "status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+                (order.user_id, order.username, order.currency, total_cup,
+                 order.created_at, order.created_at))
+            order_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO order_items (order_id, product_id, name, "
+                "price_cup, qty) VALUES (?, ?, ?, ?, ?)",
+                [(order_id, product_id, name, price, qty)
+                 for product_id, name, price, qty in order.lines])
+            sold_out = None
+            if order.stocked:
+                sold_out = _reserve_keys(conn, order_id, order)
+                if sold_out is not None:
+                    conn.execute("ROLLBACK TO pedido")
+                    order_id = None
+                conn.execute("RELEASE pedido")
+            results.append((order_id, sold_out))
+    return results
+
+
+def _stock_counts(product_ids) -> dict:
+    """{product_id: claves libres} de los productos que tienen claves.
+
+    Con `product_ids` None se devuelven todos; los productos sin ninguna
+    clave (entrega manual) no aparecen.
+    """
+    query = ("SELECT product_id, COUNT(*) - COUNT(order_id) FROM product_keys "
+             "{} GROUP BY product_id")
+    if product_ids is None:
+        rows = get_db().execute(query.format(''))
+    else:
+        product_ids = list(product_ids)
+        marks = ','.join('?' * len(product_ids))
+        rows = get_db().execute(
+            query.format(f"WHERE product_id IN ({marks})"), product_ids)
+    return dict(rows.fetchall())
+
+
+def _import_keys(rows: list, now: float) -> int:
+    """Añade [(product_id, código), ...]; ignora los códigos repetidos.
+
+    Devuelve cuántas claves nuevas se guardaron.
+    """
+    with get_db() as conn:
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO product_keys (product_id, code, created_at) "
+            "VALUES (?, ?, ?)",
+            [(product_id, code, now) for product_id, code in rows])
+        return conn.total_changes - before
+
+
+def _deliver_order_keys(order_id: int, now: float) -> tuple:
+    """Marca como entregadas las claves de un pedido.
+
+    Devuelve ([(nombre, código), ...], hay líneas sin claves).
+    """
+    with get_db() as conn:
+        keys = conn.execute(
+            "UPDATE product_keys SET delivered_at = ? "
+            "WHERE order_id = ? RETURNING product_id, code",
+            (now, order_id)).fetchall()
+        names = dict(conn.execute(
+            "SELECT product_id, name FROM order_items WHERE order_id = ?",
+            (order_id,)).fetchall())
+    stocked = {product_id for product_id, _ in keys}
+    manual = any(product_id not in stocked for product_id in names)
+    return sorted((names.get(product_id, '?'), code)
+                  for product_id, code in keys), manual
+
+
+def _release_order_keys(order_id: int) -> list:
+    """Devuelve al stock las claves de un pedido cancelado; lista sus productos."""
+    with get_db() as conn:
+        rows = conn.execute(
+            "UPDATE product_keys SET order_id = NULL, reserved_at = NULL "
+            "WHERE order_id = ? AND delivered_at IS NULL RETURNING product_id",
+            (order_id,)).fetchall()
+    return sorted({row[0] for row in rows})
+
+
+def _product_ids_by_sku(skus) -> dict:
+    skus = list(skus)
+    marks = ','.join('?' * len(skus))
+    return dict(get_db().execute(
+        f"SELECT sku, id FROM products WHERE sku IN ({marks})",
+        skus).fetchall())
+
+
+def _product_skus() -> list:
+    """[(id, sku), ...] de todos los productos, también los retirados."""
+    return get_db().execute("SELECT id, sku FROM products").fetchall()
+
+
+def _orders_by_status(status: str, limit: int) -> list:
+    """[(id, user_id, username, currency, total_cup, created_at), ...] más antiguos primero."""
+    return get_db().execute(
+        "SELECT id, user_id, username, currency, total_cup, created_at "
+        "FROM orders WHERE status = ? ORDER BY created_at LIMIT ?",
+        (status, limit)).fetchall()
+
+
+def _change_order_status(order_id: int, from_status: str, to_status: str,
+                         now: float):
+    """Cambia el estado solo si el pedido está en `from_status`.
+
+    Devuelve el user_id del comprador o None si no se pudo cambiar.
+    """
+    with get_db() as conn:
+        row = conn.execute(
+            "UPDATE orders SET status = ?, updated_at = ? "
+            "WHERE id = ? AND status = ? RETURNING user_id",
+            (to_status, now, order_id, from_status)).fetchone()
+    return row[0] if row else None
+
+
+_BROADCAST_FIELDS = ("id, text, status, cursor, total, sent, failed, blocked, "
+                     "created_by, created_at, updated_at")
+
+
+def _create_broadcast(text: str, total: int, created_by: int, now: float):
+    """Crea una difusión en curso; devuelve su id o None si ya hay otra."""
+    try:
+        with get_db() as conn:
+            return conn.execute(
+                "INSERT INTO broadcasts (text, total, created_by, created_at, "
+                "updated_at) VALUES (?, ?, ?, ?, ?) RETURNING id",
+                (text, total, created_by, now, now)).fetchone()[0]
+    except sqlite3.IntegrityError:
+        return None
+
+
+def _claim_broadcast(owner: str, now: float, lease_until: float):
+    """Toma la difusión en curso si es de `owner` o su dueño dejó de
+    renovarla. Devuelve la fila o None."""
+    with get_db() as conn:
+        return conn.execute(
+            "UPDATE broadcasts SET owner = ?, lease_until = ? "
+            "WHERE status = 'running' AND (owner IS NULL OR owner = ? "
+            "OR lease_until < ?) RETURNING " + _BROADCAST_FIELDS,
+            (owner, lease_until, owner, now)).fetchone()
+
+
+def _checkpoint_broadcast(broadcast_id: int, owner: str, cursor: int,
+                          counts: tuple, now: float, lease_until: float,
+                          status: str) -> bool:
+    """Guarda el progreso y renueva la concesión; `status` 'done' la cierra.
+
+    Devuelve False si la difusión se canceló o la tomó otro proceso.
+    """
+    sent, failed, blocked = counts
+    with get_db() as conn:
+        updated = conn.execute(
+            "UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, "
+            "blocked = ?, updated_at = ?, lease_until = ?, status = ? "
+            "WHERE id = ? AND owner = ? AND status = 'running'",
+            (cursor, sent, failed, blocked, now, lease_until, status,
+             broadcast_id, owner)).rowcount
+    return updated == 1
+
+
+def _cancel_broadcast(now: float):
+    with get_db() as conn:
+        row = conn.execute(
+            "UPDATE broadcasts SET status = 'cancelled', updated_at = ? "
+            "WHERE status = 'running' RETURNING id", (now,)).fetchone()
+    return row[0] if row else None
+
+
+def _latest_broadcast():
+    return get_db().execute(
+        "SELECT " + _BROADCAST_FIELDS + " FROM broadcasts "
+        "ORDER BY id DESC LIMIT 1").fetchone()
+
+
+def _append_events(rows: list):
+    """Añade [(ts, tipo, user_id, item, cantidad, importe_cup), ...]."""
+    with get_db() as conn:
+        conn.executemany(
+            "INSERT INTO events (ts, kind, user_id, item, qty, amount_cup) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+# Tablas de agregados y ancho de sus cubos en segundos
+_ROLLUPS = (('stats_hourly', 3600), ('stats_daily', 86400))
+_ROLLUP_UPSERT = (
+    " ON CONFLICT(bucket, kind, item) DO UPDATE SET "
+    "events = events + excluded.events, qty = qty + excluded.qty, "
+    "amount_cup = amount_cup + excluded.amount_cup")
+
+
+def _bucket_sql(width: int) -> str:
+    # Inicio del cubo en hora local (:offset segundos respecto a UTC)
+    return f"CAST((ts + :offset) / {width} AS INTEGER) * {width} - :offset"
+
+
+def _rollup_events(limit: int, offset: int, keep_since: float,
+                   seen_since: int, users_since: int) -> int:
+    """Suma a los agregados hasta `limit` eventos aún no agregados.
+
+    El último id agregado se guarda en meta en la misma transacción, así
+    que varios procesos pueden llamarla a la vez sin contar nada dos veces.
+    Borra los eventos agregados anteriores a `keep_since`, los usuarios
+    vistos de los días anteriores a `seen_since` y los que no se ven desde
+    antes de `users_since`. Devuelve cuántos eventos agregó.
+    """
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT value FROM meta WHERE key = 'events_rolled_up'").fetchone()
+        first = int(row[0]) if row else 0
+        last, count = conn.execute(
+            "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM events "
+            "WHERE id > ? ORDER BY id LIMIT ?)", (first, limit)).fetchone()
+        if not count:
+            return 0
+
+        params = {'first': first, 'last': last, 'offset': offset}
+        span = "FROM events WHERE id > :first AND id <= :last"
+        for table, width in _ROLLUPS:
+            bucket = _bucket_sql(width)
+            conn.execute(
+                f"INSERT INTO {table} (bucket, kind, item, events, qty, "
+                f"amount_cup) SELECT {bucket}, kind, item, COUNT(*), "
+                f"SUM(qty), SUM(amount_cup) {span} GROUP BY 1, 2, 3"
+                + _ROLLUP_UPSERT, params)
+            # Totales por tipo de los eventos con categoría o producto
+            conn.execute(
+                f"INSERT INTO {table} (bucket, kind, item, events, qty, "
+                f"amount_cup) SELECT {bucket}, kind, '', COUNT(*), "
+                f"SUM(qty), SUM(amount_cup) {span} AND item != '' "
+                f"GROUP BY 1, 2" + _ROLLUP_UPSERT, params)
+
+        # Usuarios únicos por día: solo cuentan los que no se habían visto
+        day = _bucket_sql(86400)
+        conn.execute(
+            f"INSERT INTO stats_daily (bucket, kind, item, users) "
+            f"SELECT day, kind, '', COUNT(*) FROM (SELECT DISTINCT {day} AS "
+            f"day, kind, user_id {span}) AS seen WHERE NOT EXISTS (SELECT 1 "
+            f"FROM stats_seen s WHERE s.day = seen.day AND s.kind = seen.kind "
+            f"AND s.user_id = seen.user_id) GROUP BY day, kind "
+            f"ON CONFLICT(bucket, kind, item) DO UPDATE SET "
+            f"users = users + excluded.users", params)
+        conn.execute(
+            f"INSERT OR IGNORE INTO stats_seen (day, kind, user_id) "
+            f"SELECT DISTINCT {day}, kind, user_id {span}", params)
+        # Último día de cada usuario, para los usuarios distintos de /stats
+        conn.execute(
+            f"INSERT INTO stats_users (kind, user_id, day) "
+            f"SELECT kind, user_id, MAX({day}) {span} GROUP BY kind, user_id "
+            f"ON CONFLICT(kind, user_id) DO UPDATE SET "
+            f"day = MAX(day, excluded.day)", params)
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('events_rolled_up', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (last,))
+
+        # Los eventos se añaden en orden de tiempo: solo se recorren los que
+        # se van a borrar hasta encontrar el primero que se conserva. El
+        # evento del cursor nunca se borra: events.id no es AUTOINCREMENT y,
+        # con la tabla vacía, SQLite volvería a dar ids por debajo del
+        # cursor que ya no se agregarían
+        kept = conn.execute(
+            "SELECT id FROM events WHERE id <= ? AND ts >= ? "
+            "ORDER BY id LIMIT 1", (last, keep_since)).fetchone()
+        conn.execute("DELETE FROM events WHERE id < ?",
+                     (kept[0] if kept else last,))
+        purged = conn.execute("DELETE FROM stats_seen WHERE day < ?",
+                              (seen_since,)).rowcount
+        if purged:
+            # Cambió el día: recorrer stats_users una vez al día basta
+            conn.execute("DELETE FROM stats_users WHERE day < ?",
+                         (users_since,))
+    return count
+
+
+def _stats_totals(since: int) -> dict:
+    """{tipo: (eventos, cantidad, importe_cup, usuarios)} desde `since`.
+
+    Los usuarios son distintos en toda la ventana, no la suma de los únicos
+    de cada día.
+    """
+    conn = get_db()
+    users = dict(conn.execute(
+        "SELECT kind, COUNT(*) FROM stats_users WHERE day >= ? GROUP BY kind",
+        (since,)).fetchall())
+    rows = conn.execute(
+        "SELECT kind, SUM(events), SUM(qty), SUM(amount_cup) "
+        "FROM stats_daily WHERE bucket >= ? AND item = '' GROUP BY kind",
+        (since,)).fetchall()
+    return {row[0]: (*row[1:], users.get(row[0], 0)) for row in rows}
+
+
+def _stats_top_items(kind: str, since: int, limit: int) -> list:
+    """[(item, cantidad, importe_cup), ...] con más importe desde `since`."""
+    return get_db().execute(
+        "SELECT item, SUM(qty), SUM(amount_cup) FROM stats_daily "
+        "WHERE bucket >= ? AND kind = ? AND item != '' GROUP BY item "
+        "ORDER BY 3 DESC, 2 DESC LIMIT ?", (since, kind, limit)).fetchall()
+
+
+def _stats_hour(bucket: int) -> dict:
+    """{tipo: eventos} de la hora que empieza en `bucket`."""
+    return dict(get_db().execute(
+        "SELECT kind, events FROM stats_hourly WHERE bucket = ? "
+        "AND item = ''", (bucket,)).fetchall())
+
+
+# --- API asíncrona ---
+
+# Cargar la sesión (moneda, carrito) de un usuario
+async def load_session(user_id: int):
+    return await get_store().load_session(user_id)
+
+
+# Guardar un lote de sesiones modificadas
+async def save_sessions(rows: list):
+    await get_store().save_sessions(rows)
+
+
+# Búsqueda de texto completo en el catálogo
+async def search_products(text: str, limit: int) -> list:
+    return await run_db(_search_products, text, limit)
+
+
+# Guardar avisos en la bandeja de salida
+async def enqueue_notices(chat_ids: list, text: str, now: float):
+    await run_db(_enqueue_notices, chat_ids, text, now)
+
+
+# Reclamar avisos pendientes cuyo momento de envío ya llegó
+async def claim_notices(owner: str, now: float, lease_until: float,
+                        limit: int) -> list:
+    return await run_db(_claim_notices, owner, now, lease_until, limit)
+
+
+# Momento del próximo aviso pendiente (None si no hay)
+async def next_notice_time():
+    return await run_db(_next_notice_time)
+
+
+# Registrar el resultado de un lote de envíos
+async def settle_notices(owner: str, delivered: list, retries: list):
+    await run_db(_settle_notices, owner, delivered, retries)
+
+
+# Guardar un lote de pedidos reservando sus claves
+async def insert_orders(orders: list) -> list:
+    return await get_store().insert_orders(orders)
+
+
+# Claves libres por producto (solo productos con claves)
+async def stock_counts(product_ids=None) -> dict:
+    return await get_store().stock_counts(product_ids)
+
+
+# Añadir claves al stock
+async def import_keys(rows: list, now: float) -> int:
+    return await get_store().import_keys(rows, now)
+
+
+# Entregar las claves reservadas de un pedido pagado
+async def deliver_order_keys(order_id: int, now: float) -> tuple:
+    return await get_store().deliver_order_keys(order_id, now)
+
+
+# Liberar las claves de un pedido cancelado
+async def release_order_keys(order_id: int) -> list:
+    return await get_store().release_order_keys(order_id)
+
+
+# Ids de producto por sku (catálogo local)
+async def product_ids_by_sku(skus) -> dict:
+    return await run_db(_product_ids_by_sku, skus)
+
+
+# Sku de cada producto del catálogo local
+async def product_skus() -> list:
+    return await run_db(_product_skus)
+
+
+# Pedidos en un estado dado
+async def orders_by_status(status: str, limit: int) -> list:
+    return await get_store().orders_by_status(status, limit)
+
+
+# Transición de estado de un pedido
+async def change_order_status(order_id: int, from_status: str,
+                              to_status: str, now: float):
+    return await get_store().change_order_status(order_id, from_status,
+                                                 to_status, now)
+
+
+# Destinatarios de una difusión, en orden de user_id
+async def users_after(after_id: int, limit: int) -> list:
+    return await get_store().users_after(after_id, limit)
+
+
+# Usuarios que pueden recibir difusiones
+async def count_users() -> int:
+    return await get_store().count_users()
+
+
+# Usuarios que bloquearon el bot o desactivaron su cuenta
+async def mark_blocked(user_ids: list, now: float):
+    await get_store().mark_blocked(user_ids, now)
+
+
+# Difusiones (siempre en la base de datos local)
+async def create_broadcast(text: str, total: int, created_by: int,
+                           now: float):
+    return await run_db(_create_broadcast, text, total, created_by, now)
+
+
+async def claim_broadcast(owner: str, now: float, lease_until: float):
+    return await run_db(_claim_broadcast, owner, now, lease_until)
+
+
+async def checkpoint_broadcast(broadcast_id: int, owner: str, cursor: int,
+                               counts: tuple, now: float, lease_until: float,
+                               status: str = 'running') -> bool:
+    return await run_db(_checkpoint_broadcast, broadcast_id, owner, cursor,
+                        counts, now, lease_until, status)
+
+
+async def cancel_broadcast(now: float):
+    return await run_db(_cancel_broadcast, now)
+
+
+async def latest_broadcast():
+    return await run_db(_latest_broadcast)
+
+
+# Registro de eventos y sus agregados (siempre en la base de datos local)
+async def append_events(rows: list):
+    await run_db(_append_events, rows)
+
+
+async def rollup_events(limit: int, offset: int, keep_since: float,
+                        seen_since: int, users_since: int) -> int:
+    return await run_db(_rollup_events, limit, offset, keep_since,
+                        seen_since, users_since)
+
+
+async def stats_totals(since: int) -> dict:
+    return await run_db(_stats_totals, since)
+
+
+async def stats_top_items(kind: str, since: int, limit: int) -> list:
+    return await run_db(_stats_top_items, kind, since, limit)
+
+
+async def stats_hour(bucket: int) -> dict:
+    return await run_db(_stats_hour, bucket)
@@ -0,0 +1,232 @@
+# sessions.py
+#
+# Caché LRU de sesiones por usuario (moneda y carrito) con escritura
+# diferida: los handlers modifican la sesión en memoria y los cambios se
+# vuelcan a las tablas users y cart_items por lotes cada
+# SESSION_FLUSH_INTERVAL segundos y al apagar el bot.
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import repository
+from products.exchange_rates import DEFAULT_CURRENCY
+
+logger = logging.getLogger(__name__)
+
+SESSION_MAX_SIZE = int(os.getenv("SESSION_MAX_SIZE", "10000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "5"))
+
+
+class Session:
+    """Estado en memoria de un usuario.
+
+    Además del carrito completo guarda los cambios aún no volcados
+    (`cart_delta` y `cart_cleared`), que se aplican en la base de datos como
+    incrementos atómicos sobre cart_items.
+    """
+
+    __slots__ = ('user_id', 'currency', 'cart', 'cart_delta', 'cart_cleared',
+                 'last_access')
+
+    def __init__(self, user_id: int, currency: str, cart: dict):
+        self.user_id = user_id
+        self.currency = currency
+        self.cart = cart
+        self.cart_delta = {}
+        self.cart_cleared = False
+        self.last_access = time.monotonic()
+
+    def add_item(self, product_id: int, qty: int = 1):
+        self.cart[product_id] = self.cart.get(product_id, 0) + qty
+        self.cart_delta[product_id] = self.cart_delta.get(product_id, 0) + qty
+
+    def clear_cart(self):
+        self.cart.clear()
+        self.cart_delta.clear()
+        self.cart_cleared = True
+
+    def take_changes(self) -> tuple:
+        """Devuelve y reinicia los cambios pendientes de volcar."""
+        changes = (self.user_id, self.currency, self.cart_cleared,
+                   self.cart_delta)
+        self.cart_delta = {}
+        self.cart_cleared = False
+        return changes
+
+    def restore_changes(self, cleared: bool, delta: dict):
+        """Reincorpora cambios cuyo volcado falló."""
+        if self.cart_cleared:
+            # Un vaciado posterior ya los anula
+            return
+        for product_id, qty in delta.items():
+            self.cart_delta[product_id] = self.cart_delta.get(product_id,
+                                                              0) + qty
+        self.cart_cleared = cleared
+
+
+class SessionCache:
+    """LRU acotada con expiración por inactividad y volcado por lotes."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        # Sesiones con cambios sin guardar (incluye las ya desalojadas)
+        self._dirty = {}
+        # Sesiones que se están guardando en este momento
+        self._flushing = {}
+        self._loading = {}
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def get(self, user_id: int) -> Session:
+        session = self._sessions.get(user_id)
+        now = time.monotonic()
+        if session is not None and now - session.last_access <= self.ttl:
+            session.last_access = now
+            self._sessions.move_to_end(user_id)
+            self.stats['hits'] += 1
+            return session
+
+        self.stats['misses'] += 1
+
+        # Una sesión expirada o desalojada con cambios pendientes sigue
+        # siendo la versión más reciente
+        session = self._dirty.get(user_id) or self._flushing.get(user_id)
+        if session is None:
+            session = await self._load(user_id)
+
+        session.last_access = now
+        self._insert(session)
+        return session
+
+    async def _load(self, user_id: int) -> Session:
+        # Evita cargar dos veces al mismo usuario si llegan taps simultáneos
+        pending = self._loading.get(user_id)
+        if pending is not None:
+            return await pending
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        try:
+            row = await repository.load_session(user_id)
+            if row is None:
+                session = Session(user_id, DEFAULT_CURRENCY, {})
+                self._dirty[user_id] = session
+            else:
+                session = Session(user_id, *row)
+            future.set_result(session)
+            return session
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Marcar la excepción como recuperada si nadie más esperaba
+            future.exception()
+            raise
+        finally:
+            del self._loading[user_id]
+
+    async def currency(self, user_id: int) -> str:
+        """Moneda del usuario sin crear su sesión si no existe (la de un
+        usuario desconocido se guardaría y lo convertiría en destinatario de
+        /broadcast)."""
+        session = (self._sessions.get(user_id) or self._dirty.get(user_id)
+                   or self._flushing.get(user_id))
+        if session is None:
+            row = await repository.load_session(user_id)
+            if row is None:
+                return DEFAULT_CURRENCY
+            # get() pudo cargarla o crearla mientras tanto
+            session = self._sessions.get(user_id) or self._dirty.get(user_id)
+            if session is None:
+                session = Session(user_id, *row)
+                self._insert(session)
+        return session.currency
+
+    def _insert(self, session: Session):
+        self._sessions[session.user_id] = session
+        self._sessions.move_to_end(session.user_id)
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+
+    def mark_dirty(self, session: Session):
+        self._dirty[session.user_id] = session
+
+    def evict_expired(self):
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_access > deadline:
+                break
+            del self._sessions[user_id]
+
+    async def flush(self) -> int:
+        """Guarda en un único lote todas las sesiones modificadas."""
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, {}
+        self._flushing = dirty
+        rows = [session.take_changes() for session in dirty.values()]
+        try:
+            await repository.save_sessions(rows)
+        except Exception:
+            # Se reintentará en el próximo volcado
+            for (user_id, session), (_, _, cleared, delta) in zip(
+                    dirty.items(), rows):
+                session.restore_changes(cleared, delta)
+                self._dirty.setdefault(user_id, session)
+            raise
+        finally:
+            self._flushing = {}
+        return len(rows)
+
+
+session_cache = SessionCache(SESSION_MAX_SIZE, SESSION_TTL)
+_flusher = None
+
+
+async def get_session(user_id: int) -> Session:
+    return await session_cache.get(user_id)
+
+
+async def get_currency(user_id: int) -> str:
+    return await session_cache.currency(user_id)
+
+
+def mark_dirty(session: Session):
+    session_cache.mark_dirty(session)
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL)
+        try:
+            await session_cache.flush()
+        except Exception:
+            logger.exception("No se pudieron guardar las sesiones")
+        session_cache.evict_expired()
+
+
+def start_flusher():
+    """Lanza la tarea periódica de volcado (requiere un event loop activo)."""
+    global _flusher
+    if _flusher is None:
+        _flusher = asyncio.get_running_loop().create_task(_flush_loop())
+
+
+async def stop_flusher():
+    """Detiene la tarea periódica y guarda los cambios pendientes."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+        _flusher = None
+    await session_cache.flush()
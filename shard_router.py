@@ -0,0 +1,161 @@
+# shard_router.py
+#
+# Reparte las actualizaciones del webhook entre varios procesos del bot
+# según el usuario: todas las actualizaciones de un mismo usuario van
+# siempre al mismo worker (user_id % número de workers). Así cada sesión
+# vive en la caché de un único proceso, el orden por usuario se mantiene y
+# el resto del estado (carritos guardados, pedidos) se comparte a través del
+# almacén de repository.py (STATE_BACKEND=redis para varios hosts; con
+# SQLite todos los workers deben usar la misma base de datos en el mismo
+# host).
+#
+# Despliegue:
+#   - Router:  WEBHOOK_URL apunta aquí; SHARD_WORKERS=http://w1:8081/telegram,...
+#              python shard_router.py
+#   - Workers: RUN_MODE=webhook PORT=8081 ... python bot.py (mismo WEBHOOK_URL
+#              y WEBHOOK_SECRET; WEBHOOK_REGISTER=0 en todos menos uno)
+#
+# El router solo lee el JSON para encontrar el usuario y reenvía el cuerpo
+# tal cual. Si el worker no responde se devuelve 502 y Telegram reintenta.
+
+import asyncio
+import json
+import logging
+import os
+import signal
+
+import aiohttp
+from aiohttp import web
+
+import metrics
+from keep_alive import SECRET_HEADER, home, keep_alive, metrics_endpoint
+
+logger = logging.getLogger(__name__)
+
+# URLs completas del webhook de cada worker, separadas por comas. El orden
+# importa: cambiarlo (o el número de workers) reasigna los usuarios
+SHARD_WORKERS = [url.strip() for url in os.getenv("SHARD_WORKERS", "").split(',')
+                 if url.strip()]
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Tiempo máximo de respuesta de un worker (segundos)
+SHARD_TIMEOUT = float(os.getenv("SHARD_TIMEOUT", "10"))
+
+
+def shard_key(update: dict) -> int:
+    """Usuario (o chat) de una actualización de Telegram en JSON; 0 si no hay.
+
+    Usa los mismos campos que UserOrderedUpdateProcessor: primero el usuario
+    que la originó y si no el chat.
+    """
+    for field, value in update.items():
+        if field == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+        chat = value.get('chat')
+        if chat:
+            return chat['id']
+        # Solo hay un objeto por actualización
+        break
+    return 0
+
+
+def shard_index(update: dict, shards: int) -> int:
+    return shard_key(update) % shards
+
+
+async def forward(request: web.Request) -> web.Response:
+    app = request.app
+    if app['secret_token'] and (
+            request.headers.get(SECRET_HEADER) != app['secret_token']):
+        return web.Response(status=403)
+
+    body = await request.read()
+    try:
+        update = json.loads(body)
+    except ValueError:
+        return web.Response(status=400)
+
+    index = shard_index(update, len(app['workers']))
+    headers = {'Content-Type': 'application/json'}
+    if app['secret_token']:
+        headers[SECRET_HEADER] = app['secret_token']
+    try:
+        async with app['session'].post(app['workers'][index], data=body,
+                                       headers=headers) as resp:
+            await resp.read()
+            status = resp.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+        logger.warning("Worker %s no disponible: %s", index, exc)
+        app['failed'][index] += 1
+        return web.Response(status=502)
+
+    app['forwarded'][index] += 1
+    return web.Response(status=status)
+
+
+async def _open_session(app: web.Application):
+    app['session'] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=0),
+        timeout=aiohttp.ClientTimeout(total=SHARD_TIMEOUT))
+
+
+async def _close_session(app: web.Application):
+    await app['session'].close()
+
+
+def create_router_app(workers: list, webhook_path: str = WEBHOOK_PATH,
+                      secret_token: str = None) -> web.Application:
+    """Aplicación aiohttp que reenvía el webhook a `workers` por usuario."""
+    if not workers:
+        raise ValueError("❌ Hace falta al menos un worker en SHARD_WORKERS.")
+    app = web.Application()
+    app['workers'] = list(workers)
+    app['secret_token'] = secret_token
+    app['forwarded'] = [0] * len(workers)
+    app['failed'] = [0] * len(workers)
+    app.on_startup.append(_open_session)
+    app.on_cleanup.append(_close_session)
+    app.router.add_get('/', home)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.router.add_post(webhook_path, forward)
+
+    metrics.register_counter('bot_shard_forwarded_total',
+                             'Actualizaciones reenviadas a los workers',
+                             lambda: sum(app['forwarded']))
+    metrics.register_counter('bot_shard_failed_total',
+                             'Reenvíos fallidos (worker caído o lento)',
+                             lambda: sum(app['failed']))
+    return app
+
+
+async def serve(app: web.Application):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows no soporta señales en el event loop
+            pass
+
+    runner = await keep_alive(app)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO)
+    app = create_router_app(SHARD_WORKERS, WEBHOOK_PATH, WEBHOOK_SECRET)
+    print(f"🔀 Router iniciado con {len(SHARD_WORKERS)} workers.")
+    asyncio.run(serve(app))
+
+
+if __name__ == '__main__':
+    main()
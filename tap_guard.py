@@ -0,0 +1,147 @@
+# tap_guard.py
+#
+# Protección frente a usuarios impacientes, delante de callbacks.dispatch:
+#
+#   - Antirrebote: un tap idéntico (mismos datos, mismo mensaje) al último
+#     del usuario dentro de TAP_DEBOUNCE_WINDOW segundos se descarta sin
+#     ejecutar el handler; solo se responde el callback (sin texto) para
+#     quitar el reloj de carga.
+#   - Límite por usuario (token bucket): TAP_BURST taps seguidos y luego
+#     TAP_RATE por segundo. Al pasarse se avisa una vez con un toast y el
+#     resto de taps de la racha se responden sin texto.
+#   - Ediciones redundantes: edit_message() recuerda un hash del texto y el
+#     teclado enviados a cada mensaje y no llama a editMessageText si el
+#     resultado sería idéntico (Telegram lo rechazaría con "message is not
+#     modified").
+#
+# Todo es memoria local del proceso y O(1) por tap; con varios workers cada
+# usuario va siempre al mismo (shard_router.py), así que basta.
+
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from telegram.error import BadRequest
+
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("TAP_GUARD_ENABLED", "1").strip().lower() not in (
+    "0", "false", "no", "off")
+TAP_DEBOUNCE_WINDOW = float(os.getenv("TAP_DEBOUNCE_WINDOW", "1.0"))
+TAP_RATE = float(os.getenv("TAP_RATE", "2"))
+TAP_BURST = float(os.getenv("TAP_BURST", "6"))
+# Usuarios y mensajes recordados como máximo (LRU)
+TAP_USERS_MAX = int(os.getenv("TAP_USERS_MAX", "50000"))
+EDIT_CACHE_SIZE = int(os.getenv("EDIT_CACHE_SIZE", "50000"))
+
+# Resultados de admit()
+ALLOW = 'allow'
+DEBOUNCED = 'debounced'
+THROTTLED = 'throttled'
+# Primer tap rechazado de una racha: se avisa al usuario
+THROTTLED_NOTICE = 'throttled_notice'
+
+stats = {'debounced': 0, 'throttled': 0, 'edits_skipped': 0}
+
+# Reloj de las ventanas (los benchmarks lo sustituyen para reproducir trazas)
+_clock = time.monotonic
+
+
+class _TapState:
+    __slots__ = ('bucket', 'last_tap', 'last_at', 'noticed')
+
+    def __init__(self, now: float):
+        self.bucket = TokenBucket(TAP_RATE, TAP_BURST, now)
+        self.last_tap = None
+        self.last_at = 0.0
+        self.noticed = False
+
+
+# user_id -> _TapState
+_users = OrderedDict()
+# mensaje -> hash de (texto, teclado) enviado por última vez
+_sent = OrderedDict()
+
+
+def set_enabled(enabled: bool):
+    """Activa o desactiva antirrebote, límite y supresión de ediciones."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def reset():
+    """Olvida el estado de todos los usuarios y mensajes."""
+    _users.clear()
+    _sent.clear()
+
+
+def message_key(query):
+    """Identifica el mensaje de un callback (normal o inline)."""
+    if query.inline_message_id:
+        return query.inline_message_id
+    message = query.message
+    return (message.chat.id, message.message_id) if message else None
+
+
+def admit(user_id: int, data: str, message) -> str:
+    """Decide si un tap se procesa. `message` es el de message_key()."""
+    if not ENABLED:
+        return ALLOW
+    now = _clock()
+    state = _users.get(user_id)
+    if state is None:
+        state = _users[user_id] = _TapState(now)
+        if len(_users) > TAP_USERS_MAX:
+            _users.popitem(last=False)
+    else:
+        _users.move_to_end(user_id)
+
+    tap = (data, message)
+    if tap == state.last_tap and now - state.last_at <= TAP_DEBOUNCE_WINDOW:
+        # Doble tap sobre el mismo botón: el primero ya está en marcha. La
+        # ventana cuenta desde el último tap procesado, no se desliza.
+        stats['debounced'] += 1
+        return DEBOUNCED
+
+    if not state.bucket.try_acquire(now=now):
+        stats['throttled'] += 1
+        if state.noticed:
+            return THROTTLED
+        state.noticed = True
+        return THROTTLED_NOTICE
+    state.noticed = False
+    state.last_tap = tap
+    state.last_at = now
+    return ALLOW
+
+
+async def edit_message(query, text: str, reply_markup=None):
+    """edit_message_text que no repite una edición idéntica a la anterior."""
+    if not ENABLED:
+        return await query.edit_message_text(text, reply_markup=reply_markup)
+
+    key = message_key(query)
+    digest = hash((text, reply_markup))
+    if key is not None and _sent.get(key) == digest:
+        _sent.move_to_end(key)
+        stats['edits_skipped'] += 1
+        return True
+
+    try:
+        result = await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as exc:
+        # El mensaje ya tenía este contenido (p. ej. tras reiniciar el bot)
+        if 'not modified' not in exc.message.lower():
+            raise
+        logger.debug("Edición idéntica rechazada por Telegram: %s", key)
+        result = True
+
+    if key is not None:
+        _sent[key] = digest
+        _sent.move_to_end(key)
+        if len(_sent) > EDIT_CACHE_SIZE:
+            _sent.popitem(last=False)
+    return result
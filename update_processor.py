@@ -0,0 +1,83 @@
+# update_processor.py
+#
+# Procesador de actualizaciones concurrente para python-telegram-bot que
+# mantiene el orden por usuario: las actualizaciones de distintos usuarios
+# se atienden en paralelo (hasta `workers` a la vez) y las de un mismo
+# usuario, una detrás de otra y en el orden de llegada.
+
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Límite de tareas aceptadas por PTB; la concurrencia real la fija `workers`
+_MAX_PENDING = 2 ** 16
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+
+    def __init__(self, workers: int):
+        super().__init__(_MAX_PENDING)
+        if workers < 1:
+            raise ValueError("`workers` debe ser un entero positivo")
+        self.workers = workers
+        self._workers = asyncio.BoundedSemaphore(workers)
+        # clave de usuario -> [lock, actualizaciones pendientes]
+        self._users = {}
+        self.waiting = 0
+        self.in_flight = 0
+        self.processed = 0
+
+    @staticmethod
+    def _key(update: object):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        entry = None
+        if key is not None:
+            entry = self._users.get(key)
+            if entry is None:
+                entry = self._users[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+
+        self.waiting += 1
+        started = False
+        try:
+            # Primero el turno del usuario y después un hueco de trabajo, para
+            # que un usuario con muchos taps en cola no acapare los workers
+            if entry is not None:
+                await entry[0].acquire()
+            try:
+                async with self._workers:
+                    self.waiting -= 1
+                    started = True
+                    self.in_flight += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.in_flight -= 1
+                        self.processed += 1
+            finally:
+                if entry is not None:
+                    entry[0].release()
+        finally:
+            if not started:
+                # Cancelada antes de empezar
+                self.waiting -= 1
+                coroutine.close()
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._users[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
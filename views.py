@@ -0,0 +1,142 @@
+# views.py
+#
+# Pantallas ya renderizadas (texto + teclado) cacheadas por
+# (pantalla, categoría, moneda, versión del catálogo). El contenido solo
+# depende de esas claves, de las tasas de cambio y de las existencias, así
+# que un tap repetido cuesta una búsqueda en un diccionario.
+
+import os
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import callbacks
+import inventory
+from products.catalog import get_catalog, price_table
+from products.categories import CATEGORIES
+from products.exchange_rates import DEFAULT_CURRENCY, format_currency, get_rates
+
+# Productos por página en las listas de categorías
+CATEGORY_PAGE_SIZE = int(os.getenv("CATEGORY_PAGE_SIZE", "8"))
+
+_cache = {}
+# (versión del catálogo, de las tasas y de las existencias) con la que se
+# llenó la caché
+_stamp = None
+
+# Estadísticas de aciertos
+stats = {'hits': 0, 'misses': 0}
+
+
+def _cached(screen: str, category, currency: str, build):
+    global _stamp
+    catalog = get_catalog()
+    stamp = (catalog.version, get_rates().version, inventory.version)
+    if stamp != _stamp:
+        # Catálogo recargado, tasa cambiada o existencias distintas: todo lo
+        # anterior es obsoleto
+        _cache.clear()
+        _stamp = stamp
+
+    key = (screen, category, currency, catalog.version)
+    view = _cache.get(key)
+    if view is None:
+        stats['misses'] += 1
+        view = _cache[key] = build(catalog, category, currency)
+    else:
+        stats['hits'] += 1
+    return view
+
+
+def invalidate():
+    """Vacía la caché a mano (los cambios de catálogo o tasas ya la invalidan)."""
+    global _stamp
+    _cache.clear()
+    _stamp = None
+
+
+def _build_main_menu(catalog, category, currency):
+    keyboard = []
+    for key, label in CATEGORIES.items():
+        keyboard.append([InlineKeyboardButton(
+            label, callback_data=callbacks.encode('category', key))])
+
+    keyboard.extend(
+        [[InlineKeyboardButton("🛒 Ver Carrito", callback_data='cart')],
+         [InlineKeyboardButton("💰 Pagar", callback_data='checkout')]])
+
+    # Un botón por moneda disponible, la moneda por defecto al final
+    codes = [code for code in get_rates().currencies
+             if code != DEFAULT_CURRENCY] + [DEFAULT_CURRENCY]
+    buttons = [
+        InlineKeyboardButton(
+            f"💱 Cambiar a {code}",
+            callback_data=callbacks.encode('set_currency', code))
+        for code in codes
+    ]
+    keyboard.extend(buttons[i:i + 2] for i in range(0, len(buttons), 2))
+
+    text = (f"¡Bienvenido a la tienda de productos digitales! 🚀\n"
+            f"Moneda actual: {currency}\n\n"
+            f"Elige una categoría:")
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def _page_count(products) -> int:
+    return -(-len(products) // CATEGORY_PAGE_SIZE)
+
+
+def _build_category(catalog, key, currency):
+    category, page = key
+    products = catalog.products_in(category)
+    if not products:
+        return f"No hay productos en {CATEGORIES[category]}.", None
+
+    # Solo se recorre la porción de la página, sea cual sea el tamaño de la
+    # categoría (render_category ya acotó `page`)
+    pages = _page_count(products)
+    start = page * CATEGORY_PAGE_SIZE
+
+    prices = price_table(currency)
+    buttons = []
+    for product in products[start:start + CATEGORY_PAGE_SIZE]:
+        btn_text = f"{product.name} - {format_currency(prices[product.id], currency)}"
+        stock = inventory.available(product.id)
+        if stock is not None:
+            btn_text += f" · {stock} disp." if stock else " · Agotado"
+        buttons.append([
+            InlineKeyboardButton(btn_text, callback_data=callbacks.encode(
+                'add', product.id, catalog.revision))
+        ])
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(
+            "◀️ Anterior",
+            callback_data=callbacks.encode('category', category, page - 1)))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton(
+            "Siguiente ▶️",
+            callback_data=callbacks.encode('category', category, page + 1)))
+    if nav:
+        buttons.append(nav)
+
+    buttons.append([InlineKeyboardButton("⬅️ Volver", callback_data='start')])
+
+    title = f"Productos de {CATEGORIES[category]}"
+    if pages > 1:
+        title += f" (página {page + 1}/{pages})"
+    return f"{title}:", InlineKeyboardMarkup(buttons)
+
+
+def render_main_menu(currency: str):
+    """Devuelve (texto, teclado) del menú principal."""
+    return _cached('menu', None, currency, _build_main_menu)
+
+
+def render_category(category: str, currency: str, page: int = 0):
+    """Devuelve (texto, teclado | None) de una página de productos de una categoría."""
+    # Acotar antes de formar la clave: una página fuera de rango (botón
+    # antiguo o callback_data manipulado) es la última y no otra entrada
+    pages = _page_count(get_catalog().products_in(category))
+    page = min(max(page, 0), max(pages - 1, 0))
+    return _cached('category', (category, page), currency, _build_category)